@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+############################
+## Mock OpenAI-compatible chat completions server
+############################
+# Answers POST /v1/chat/completions like the OpenAI API, with:
+#  - configurable latency (mean and jitter, in ms)
+#  - a configurable share of 429 responses, with a Retry-After header
+#  - a configurable mix of response shapes: text feedback, JSON feedback, fenced JSON, "Pass", and
+#    malformed feedback that the parser should drop
+# Every well-formed feedback item carries a unique marker ("[mock-<request>-<item>]") in its Fail
+# text, and GET /stats returns the markers sent, so a benchmark can measure parse accuracy.
+#
+# python benchmarks/mock_llm_server.py --port 8080 --latency-ms 500 --rate-429 0.05
+
+RESPONSE_SHAPES = ("text", "json", "fenced_json", "pass", "malformed")
+CATEGORIES = [("💡", "Logic Issues"), ("🔒", "Security Issues"), ("🚀", "Performance Issues"), ("⚠️", "Error Handling Issues")]
+PRIORITIES = [("🔴", "High"), ("🟠", "Medium"), ("🟡", "Low")]
+PACKED_FILE_HEADER_PATTERN = re.compile(r"^=== FILE: (.*) ===$", re.MULTILINE)
+
+
+def parse_shapes(value):
+    weights = {}
+    for part in value.split(","):
+        shape, _, weight = part.partition("=")
+        if shape not in RESPONSE_SHAPES:
+            raise argparse.ArgumentTypeError(f"Unknown response shape {shape}. Choose from: {', '.join(RESPONSE_SHAPES)}")
+        weights[shape] = float(weight or 1)
+    return weights
+
+
+class MockState:
+    def __init__(self, options):
+        self.options = options
+        self.lock = threading.Lock()
+        self.random = random.Random(options.seed)
+        self.requests = 0
+        self.rate_limited = 0
+        self.shapes = {shape: 0 for shape in RESPONSE_SHAPES}
+        # markers of well-formed items, and of items the parser is expected to drop
+        self.markers = []
+        self.malformed_markers = []
+
+    def next_request(self):
+        with self.lock:
+            self.requests += 1
+            request_id = self.requests
+            if self.random.random() < self.options.rate_429:
+                self.rate_limited += 1
+                return request_id, None, 0, 0.0
+            shapes, weights = zip(*self.options.shapes.items())
+            shape = self.random.choices(shapes, weights)[0]
+            self.shapes[shape] += 1
+            num_items = 0 if shape == "pass" else self.random.randint(1, self.options.max_items)
+            latency = max(0.0, self.random.gauss(self.options.latency_ms, self.options.jitter_ms) / 1000)
+            return request_id, shape, num_items, latency
+
+    def record_markers(self, markers, malformed):
+        with self.lock:
+            (self.malformed_markers if malformed else self.markers).extend(markers)
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "rate_limited": self.rate_limited,
+                "shapes": dict(self.shapes),
+                "markers": list(self.markers),
+                "malformed_markers": list(self.malformed_markers),
+            }
+
+
+def get_feedback_items(request_id, num_items, file_paths, num_lines, rng):
+    items = []
+    for item_index in range(num_items):
+        emoji, category = rng.choice(CATEGORIES)
+        priority_emoji, priority = rng.choice(PRIORITIES)
+        items.append({
+            "filepath": rng.choice(file_paths),
+            "function_name": f"function_{rng.randint(0, 99)}",
+            "line_number": rng.randint(1, max(1, num_lines)),
+            "error_category": category,
+            "category_emoji": emoji,
+            "priority": priority,
+            "priority_emoji": priority_emoji,
+            "fail": f"[mock-{request_id}-{item_index}] something looks wrong here",
+            "fix": "do the right thing instead",
+        })
+    return items
+
+
+def render_content(shape, items):
+    if shape == "pass":
+        return "Pass"
+    if shape in ("json", "fenced_json"):
+        fields = ("filepath", "function_name", "line_number", "error_category", "priority", "fail", "fix")
+        body = json.dumps({"feedback_items": [{field: item[field] for field in fields} for item in items]})
+        return f"```json\n{body}\n```" if shape == "fenced_json" else body
+    lines = []
+    for item in items:
+        # malformed items have no line number, so the parser can't place them
+        line_number = "" if shape == "malformed" else f":{item['line_number']}"
+        lines.append(f"** {item['filepath']}:{item['function_name']}{line_number} {item['category_emoji']} {item['error_category']} **")
+        lines.append(f"[{item['priority_emoji']} {item['priority']}] Fail: {item['fail']}")
+        lines.append(f"Fix: {item['fix']}")
+    return "\n".join(lines)
+
+
+def make_handler(state):
+    class MockHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def send_json(self, status, payload, headers=None):
+            body = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path.rstrip("/") == "/stats":
+                self.send_json(200, state.get_stats())
+            else:
+                self.send_json(404, {"error": {"message": "not found"}})
+
+        def do_POST(self):
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self.send_json(404, {"error": {"message": "not found"}})
+                return
+
+            request_id, shape, num_items, latency = state.next_request()
+            if shape is None:
+                self.send_json(429, {"error": {"message": "Rate limit reached (mock)", "type": "requests", "code": "rate_limit_exceeded"}},
+                               {"Retry-After": str(state.options.retry_after)})
+                return
+
+            messages = request.get("messages", [])
+            user_content = messages[-1]["content"] if messages else ""
+            # packed requests name their files; single-file requests don't say which file they are
+            file_paths = PACKED_FILE_HEADER_PATTERN.findall(user_content) or ["unknown.py"]
+            rng = random.Random(request_id)
+            items = get_feedback_items(request_id, num_items, file_paths, user_content.count("\n"), rng)
+            state.record_markers([item["fail"].split("]")[0] + "]" for item in items], malformed=shape == "malformed")
+            content = render_content(shape, items)
+            time.sleep(latency)
+
+            prompt_tokens = sum(len(message.get("content", "")) for message in messages) // 4
+            completion_tokens = len(content) // 4
+            self.send_json(200, {
+                "id": f"chatcmpl-mock-{request_id}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model", "mock"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                    "prompt_tokens_details": {"cached_tokens": 0},
+                },
+            })
+
+    return MockHandler
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description="Mock OpenAI-compatible chat completions server for offline benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=0, help="0 picks a free port")
+    parser.add_argument("--latency-ms", type=float, default=500)
+    parser.add_argument("--jitter-ms", type=float, default=150)
+    parser.add_argument("--rate-429", type=float, default=0.0, help="Share of requests answered with HTTP 429")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds sent with each 429")
+    parser.add_argument("--shapes", type=parse_shapes, default=parse_shapes("text=4,json=4,fenced_json=1,pass=1"),
+                        help=f"Weighted mix of response shapes, e.g. text=4,json=4,malformed=1. Shapes: {', '.join(RESPONSE_SHAPES)}")
+    parser.add_argument("--max-items", type=int, default=4, help="Max feedback items per response")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser
+
+
+def main():
+    options = get_parser().parse_args()
+    server = ThreadingHTTPServer((options.host, options.port), make_handler(MockState(options)))
+    server.daemon_threads = True
+    # the benchmark harness reads this line to find the server
+    print(f"listening on http://{options.host}:{server.server_address[1]}/v1", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
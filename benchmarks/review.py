@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import logging
+import os
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from contextlib import redirect_stdout
+
+from synthetic_repo import create_synthetic_repo
+
+############################
+## Offline end-to-end review benchmark
+############################
+# Runs `ailinter.run` end to end on a synthetic git repo (see synthetic_repo.py) against the mock
+# OpenAI-compatible server (see mock_llm_server.py), with no network access, and measures:
+#  - throughput: files and requests per second of the review stage
+#  - per-file latency p50/p99: from the start of the run to each file's feedback being streamed
+#  - peak RSS of the reviewing process
+#  - parse accuracy: how many of the feedback items the mock sent came back out of the parser
+#    (recall), and how many parsed items weren't sent as well-formed items (precision)
+# With --warm-cache the same review runs a second time, served from the review cache.
+# Runs use --ci, so nothing prompts and no browser opens. The run's output goes to --log.
+#
+# python benchmarks/review.py --files 200 --churn 0.3 --latency-ms 300 --output review.json
+# python benchmarks/review.py --files 200 --churn 0.3 --latency-ms 300 --baseline review.json
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MOCK_SERVER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "mock_llm_server.py")
+MARKER_PATTERN = re.compile(r"\[mock-\d+-\d+\]")
+
+
+def start_mock_server(args):
+    command = [
+        sys.executable, MOCK_SERVER_PATH,
+        "--latency-ms", str(args.latency_ms), "--jitter-ms", str(args.jitter_ms),
+        "--rate-429", str(args.rate_429), "--retry-after", str(args.retry_after),
+        "--shapes", args.shapes, "--max-items", str(args.max_items), "--seed", str(args.seed),
+    ]
+    server = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    first_line = server.stdout.readline()
+    if not first_line.startswith("listening on "):
+        server.kill()
+        raise RuntimeError(f"The mock LLM server didn't start: {first_line!r}")
+    return server, first_line[len("listening on "):].strip()
+
+
+def get_mock_stats(base_url):
+    with urllib.request.urlopen(base_url.rsplit("/v1", 1)[0] + "/stats") as response:
+        return json.load(response)
+
+
+# Point the review cache and history at a scratch directory and lift the rate limits, so the benchmark measures
+# the reviewer rather than the configured provider limits. Has to happen before ailinter is imported:
+# modules read their config constants at import time.
+def configure(work_dir, rpm, tpm):
+    sys.path.insert(0, REPO_ROOT)
+    from reviewme.ailinter.helpers import load_config
+
+    config = load_config()
+    config['REVIEW_CACHE_DIR'] = os.path.join(work_dir, "cache")
+    config['SAVED_REVIEWS_DIR'] = work_dir
+    config['RATE_LIMITS'] = {'default': {'rpm': rpm, 'tpm': tpm}}
+    # --ci refuses reviews over this projected cost
+    config['CI_MAX_COST_USD'] = float("inf")
+    os.environ.setdefault("OPENAI_API_KEY", "mock")
+
+
+# Result writer (see ci.py) that records when each file's feedback arrives
+class TimingWriter:
+    def __init__(self, started_at):
+        self.started_at = started_at
+        self.latencies = []
+        self.markers = []
+
+    def write(self, file_path, feedback_items):
+        self.latencies.append(time.perf_counter() - self.started_at)
+        for item in feedback_items:
+            self.markers.extend(MARKER_PATTERN.findall(item["fail"]))
+
+    def close(self):
+        pass
+
+
+def get_percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def get_peak_rss_mb():
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak_rss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+# `num_files`: how many files the review covers
+def run_review(args, repo_dir, num_files, base_url, log_file):
+    from reviewme.ailinter import ailinter
+    from reviewme.ailinter.format_results import PARSE_STATS
+    from reviewme.ailinter.telemetry import TELEMETRY
+
+    # the CLI logs every request at DEBUG: keep that in the log too
+    for handler in logging.getLogger().handlers:
+        handler.setStream(log_file)
+
+    stats_before = get_mock_stats(base_url)
+    started_at = time.perf_counter()
+    writer = TimingWriter(started_at)
+    cwd = os.getcwd()
+    os.chdir(repo_dir)
+    try:
+        with redirect_stdout(log_file):
+            exit_code = ailinter.run(
+                args.scope, "", args.model, concurrency=args.concurrency, base_url=base_url, use_cache=True,
+                feedback_format=args.feedback_format, pack=not args.no_pack, ci=True, fail_on="never", result_writers=[writer],
+            )
+    finally:
+        os.chdir(cwd)
+    wall_seconds = time.perf_counter() - started_at
+    stats_after = get_mock_stats(base_url)
+
+    telemetry_report = TELEMETRY.get_report()
+    review_seconds = telemetry_report["stages"].get("review", {}).get("seconds") or wall_seconds
+    num_requests = stats_after["requests"] - stats_before["requests"]
+
+    sent_markers = set(stats_after["markers"]) - set(stats_before["markers"])
+    malformed_markers = set(stats_after["malformed_markers"])
+    parsed_markers = set(writer.markers)
+    return {
+        "exit_code": exit_code,
+        "wall_seconds": wall_seconds,
+        "review_seconds": review_seconds,
+        "throughput": {
+            "files_per_second": num_files / review_seconds if review_seconds else None,
+            "requests_per_second": num_requests / review_seconds if review_seconds else None,
+        },
+        "file_latency": {
+            "files": len(writer.latencies),
+            "p50_seconds": get_percentile(writer.latencies, 0.5),
+            "p99_seconds": get_percentile(writer.latencies, 0.99),
+            "max_seconds": max(writer.latencies, default=None),
+        },
+        "mock": {
+            "requests": num_requests,
+            "rate_limited": stats_after["rate_limited"] - stats_before["rate_limited"],
+            "shapes": {shape: count - stats_before["shapes"][shape] for shape, count in stats_after["shapes"].items()},
+        },
+        # only meaningful when the responses weren't served from the cache
+        "parse_accuracy": {
+            "items_sent": len(sent_markers),
+            "items_parsed": len(parsed_markers),
+            "recall": len(parsed_markers & sent_markers) / len(sent_markers) if sent_markers else None,
+            "precision": len(parsed_markers & sent_markers) / len(parsed_markers) if parsed_markers else None,
+            "malformed_items_parsed": len(parsed_markers & malformed_markers),
+            "parse_stats": dict(vars(PARSE_STATS)),
+        },
+        "peak_rss_mb": get_peak_rss_mb(),
+        "telemetry": telemetry_report,
+    }
+
+
+# Metrics compared against a baseline, as (run, section, key, whether higher is better)
+COMPARED_METRICS = [
+    ("cold", "throughput", "files_per_second", True),
+    ("cold", "file_latency", "p50_seconds", False),
+    ("cold", "file_latency", "p99_seconds", False),
+    ("cold", "parse_accuracy", "recall", True),
+    ("cold", "parse_accuracy", "precision", True),
+    ("warm", "throughput", "files_per_second", True),
+    ("warm", "file_latency", "p99_seconds", False),
+]
+
+
+def compare_to_baseline(report, baseline, max_regression):
+    regressions = []
+    for run_name, section, key, higher_is_better in COMPARED_METRICS:
+        if run_name not in report["runs"] or run_name not in baseline["runs"]:
+            continue
+        current, previous = report["runs"][run_name][section][key], baseline["runs"][run_name][section][key]
+        if current is None or not previous:
+            continue
+        regressed = current < previous * (1 - max_regression) if higher_is_better else current > previous * (1 + max_regression)
+        if regressed:
+            regressions.append(f"{run_name}.{section}.{key}: {previous:.3f} -> {current:.3f}")
+
+    previous_rss, current_rss = baseline["runs"]["cold"]["peak_rss_mb"], report["runs"]["cold"]["peak_rss_mb"]
+    if current_rss > previous_rss * (1 + max_regression):
+        regressions.append(f"peak_rss_mb: {previous_rss:.1f} -> {current_rss:.1f}")
+    return regressions
+
+
+def format_seconds(seconds):
+    return "n/a" if seconds is None else f"{seconds:.2f}s"
+
+
+def format_ratio(ratio):
+    return "n/a" if ratio is None else f"{ratio:.1%}"
+
+
+def format_report(report):
+    settings = report["settings"]
+    result = f"\n=== ⏱️ Review benchmark: {settings['files']} files, {settings['churn']:.0%} churn, --scope {settings['scope']}, concurrency {settings['concurrency']} ===\n"
+    result += f"Mock: {settings['latency_ms']:.0f}±{settings['jitter_ms']:.0f}ms latency, {settings['rate_429']:.0%} 429s, shapes {settings['shapes']}\n"
+    for run_name, run in report["runs"].items():
+        result += f"\n{run_name} cache: {run['mock']['requests']} requests ({run['mock']['rate_limited']} rate limited), review {run['review_seconds']:.2f}s of {run['wall_seconds']:.2f}s\n"
+        result += f"  Throughput: {run['throughput']['files_per_second']:.1f} files/s, {run['throughput']['requests_per_second']:.1f} requests/s\n"
+        result += f"  Per-file latency over {run['file_latency']['files']} files: p50 {format_seconds(run['file_latency']['p50_seconds'])}, p99 {format_seconds(run['file_latency']['p99_seconds'])}\n"
+        accuracy = run["parse_accuracy"]
+        if accuracy["items_sent"]:
+            result += f"  Parse accuracy: recall {format_ratio(accuracy['recall'])}, precision {format_ratio(accuracy['precision'])} ({accuracy['items_parsed']} of {accuracy['items_sent']} items, {accuracy['malformed_items_parsed']} malformed items parsed)\n"
+        result += f"  Peak RSS: {run['peak_rss_mb']:.1f}MB\n"
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark a full scanline review offline, against a mock LLM server and a synthetic repo")
+    parser.add_argument("--files", type=int, default=50)
+    parser.add_argument("--lines", type=int, default=120, help="Approximate lines per file")
+    parser.add_argument("--churn", type=float, default=0.3, help="Fraction of files with uncommitted edits (what --scope commit reviews)")
+    parser.add_argument("--scope", default="commit", choices=["commit", "repo"])
+    parser.add_argument("--model", default="gpt-4")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--feedback-format", default="json", choices=["json", "text"])
+    parser.add_argument("--no-pack", action="store_true", help="Don't pack small diffs into shared requests")
+    parser.add_argument("--warm-cache", action="store_true", help="Run the review a second time, from the review cache")
+    parser.add_argument("--rpm", type=int, default=100000, help="Rate limit for every model during the benchmark")
+    parser.add_argument("--tpm", type=int, default=100000000)
+    parser.add_argument("--latency-ms", type=float, default=300)
+    parser.add_argument("--jitter-ms", type=float, default=100)
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=float, default=0.5)
+    parser.add_argument("--shapes", default="text=4,json=4,fenced_json=1,pass=1", help="Mock response shapes, see mock_llm_server.py")
+    parser.add_argument("--max-items", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--log", default=os.devnull, help="Write the review's own output here")
+    parser.add_argument("--output", default=None, help="Write the JSON report here")
+    parser.add_argument("--baseline", default=None, help="JSON report of an earlier run to compare against; exits 1 on a regression")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="Allowed regression against the baseline, as a fraction. Defaults to 0.2")
+    args = parser.parse_args()
+
+    report = {"python": sys.version.split()[0], "settings": {key: value for key, value in vars(args).items() if key not in ("output", "baseline", "log")}, "runs": {}}
+    server, base_url = start_mock_server(args)
+    try:
+        with tempfile.TemporaryDirectory(prefix="scanline-bench-") as work_dir, open(args.log, 'w') as log_file:
+            repo_dir = os.path.join(work_dir, "repo")
+            churned_file_paths = create_synthetic_repo(repo_dir, args.files, args.lines, args.churn, seed=args.seed)
+            num_files = len(churned_file_paths) if args.scope == "commit" else args.files
+            configure(work_dir, args.rpm, args.tpm)
+            report["runs"]["cold"] = run_review(args, repo_dir, num_files, base_url, log_file)
+            if args.warm_cache:
+                report["runs"]["warm"] = run_review(args, repo_dir, num_files, base_url, log_file)
+    finally:
+        server.terminate()
+        server.wait()
+
+    print(format_report(report))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            regressions = compare_to_baseline(report, json.load(f), args.max_regression)
+        if regressions:
+            print("The review benchmark regressed against the baseline:\n\t" + "\n\t".join(regressions))
+            sys.exit(1)
+        print("No review benchmark regressions against the baseline.")
+
+
+if __name__ == '__main__':
+    main()
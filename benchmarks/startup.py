@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+############################
+## CLI startup benchmark
+############################
+# Tracks how long `scanline` takes before it does any work:
+#  - `python -X importtime -c "import reviewme.cli"`: total import time, the slowest modules, and
+#    whether any of the heavy review-only modules got pulled in at import time
+#  - `scanline run --help` from source, which is what every early exit in the CLI pays
+#  - optionally the PyInstaller binary (dist/scanline): the first run after a build is the cold
+#    start, which includes unpacking the one-file archive
+#
+# python benchmarks/startup.py --output startup.json
+# python benchmarks/startup.py --binary dist/scanline --baseline startup.json
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Only the review itself should import these, never `--help` or the CLI's early exits
+HEAVY_MODULES = ["openai", "aiohttp", "tiktoken", "requests", "http.server", "socketserver", "reviewme.ailinter.ailinter"]
+
+HELP_COMMAND = [sys.executable, "-c", "from reviewme.cli import cli; cli(['run', '--help'])"]
+
+
+# Parses `-X importtime` output: "import time: self [us] | cumulative | imported package"
+def parse_importtime(stderr):
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        # nested imports are indented by two spaces per level
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        modules.append({"module": name.strip(), "depth": depth, "self_us": int(self_us), "cumulative_us": int(cumulative_us)})
+    return modules
+
+
+def measure_import_time(module, runs):
+    totals = []
+    modules = []
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=REPO_ROOT, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"Importing {module} failed:\n{result.stderr}")
+        modules = parse_importtime(result.stderr)
+        totals.append(sum(m["cumulative_us"] for m in modules if m["depth"] == 0))
+
+    imported = {m["module"] for m in modules}
+    return {
+        "module": module,
+        "median_ms": statistics.median(totals) / 1000,
+        "slowest_modules": sorted(modules, key=lambda m: m["self_us"], reverse=True)[:15],
+        "heavy_modules_imported": [name for name in HEAVY_MODULES if name in imported],
+    }
+
+
+def time_command(command, runs):
+    durations = []
+    for _ in range(runs):
+        started_at = time.perf_counter()
+        subprocess.run(command, cwd=REPO_ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        durations.append(time.perf_counter() - started_at)
+    return durations
+
+
+def measure_command(command, runs):
+    durations = time_command(command, runs)
+    return {"command": " ".join(command), "first_ms": durations[0] * 1000, "median_ms": statistics.median(durations) * 1000}
+
+
+# Metrics compared against a baseline, as paths into the report
+COMPARED_METRICS = [("import", "median_ms"), ("help", "median_ms"), ("binary", "first_ms"), ("binary", "median_ms")]
+
+
+def compare_to_baseline(report, baseline, max_regression):
+    regressions = []
+    for section, key in COMPARED_METRICS:
+        if section not in report or section not in baseline:
+            continue
+        current, previous = report[section][key], baseline[section][key]
+        if previous and current > previous * (1 + max_regression):
+            regressions.append(f"{section}.{key}: {previous:.1f}ms -> {current:.1f}ms")
+
+    new_heavy_modules = set(report["import"]["heavy_modules_imported"]) - set(baseline.get("import", {}).get("heavy_modules_imported", []))
+    if new_heavy_modules:
+        regressions.append(f"now imported at startup: {', '.join(sorted(new_heavy_modules))}")
+    return regressions
+
+
+def format_report(report):
+    result = f"\n=== ⏱️ Startup: import {report['import']['module']} ===\n\n"
+    result += f"Median import time: {report['import']['median_ms']:.1f}ms\n"
+    for module in report['import']['slowest_modules']:
+        result += f"{module['self_us'] / 1000:>8.1f}ms  {module['module']}\n"
+    heavy_modules = report['import']['heavy_modules_imported']
+    result += f"Heavy modules imported at startup: {', '.join(heavy_modules) if heavy_modules else 'none'}\n"
+    result += f"\n`run --help` from source: median {report['help']['median_ms']:.1f}ms\n"
+    if "binary" in report:
+        result += f"Binary `run --help`: cold start {report['binary']['first_ms']:.1f}ms, median {report['binary']['median_ms']:.1f}ms\n"
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure scanline CLI startup time")
+    parser.add_argument("--module", default="reviewme.cli", help="Module to import with -X importtime")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--binary", default=None, help="Path to the PyInstaller binary, e.g. dist/scanline. Run right after a build so the first run is a cold start.")
+    parser.add_argument("--output", default=None, help="Write the JSON report here")
+    parser.add_argument("--baseline", default=None, help="JSON report of an earlier run to compare against; exits 1 on a regression")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="Allowed slowdown against the baseline, as a fraction. Defaults to 0.2")
+    args = parser.parse_args()
+
+    report = {
+        "python": sys.version.split()[0],
+        "import": measure_import_time(args.module, args.runs),
+        "help": measure_command(HELP_COMMAND, args.runs),
+    }
+    if args.binary:
+        report["binary"] = measure_command([os.path.abspath(args.binary), "run", "--help"], args.runs)
+
+    print(format_report(report))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            regressions = compare_to_baseline(report, json.load(f), args.max_regression)
+        if regressions:
+            print("Startup regressed against the baseline:\n\t" + "\n\t".join(regressions))
+            sys.exit(1)
+        print("No startup regressions against the baseline.")
+
+
+if __name__ == '__main__':
+    main()
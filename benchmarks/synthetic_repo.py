@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+import argparse
+import os
+import random
+import subprocess
+
+############################
+## Synthetic git repositories for benchmarks
+############################
+# Builds a git repo of generated Python modules: `num_files` files of about `lines_per_file` lines,
+# each importing functions from a few earlier modules (so the import graph has something to
+# resolve), committed once. Then `churn` (a fraction of the files) gets uncommitted edits, which
+# is what `--scope commit` reviews.
+#
+# python benchmarks/synthetic_repo.py /tmp/bench-repo --files 200 --lines 150 --churn 0.2
+
+GIT_IDENTITY = ["-c", "user.name=scanline-bench", "-c", "user.email=bench@example.com"]
+PACKAGE_NAME = "app"
+
+
+def get_module_name(index):
+    return f"module_{index:04d}"
+
+
+def render_function(rng, module_index, function_index, imported_functions):
+    name = f"function_{module_index}_{function_index}"
+    lines = [f"def {name}(items, threshold={rng.randint(1, 100)}):", "    result = []"]
+    for step in range(rng.randint(2, 6)):
+        lines.append(f"    for item in items:")
+        lines.append(f"        if item > threshold + {step}:")
+        lines.append(f"            result.append(item * {rng.randint(2, 9)})")
+    if imported_functions:
+        lines.append(f"    result.extend({rng.choice(imported_functions)}(result))")
+    lines.append("    return result")
+    lines.append("")
+    lines.append("")
+    return lines
+
+
+def render_module(rng, module_index, lines_per_file, imports_per_file):
+    imports = rng.sample(range(module_index), min(module_index, imports_per_file))
+    imported_functions = [f"function_{imported}_0" for imported in imports]
+    lines = [f"from {PACKAGE_NAME}.{get_module_name(imported)} import function_{imported}_0" for imported in imports]
+    lines += ["", ""]
+    function_index = 0
+    while len(lines) < lines_per_file:
+        lines += render_function(rng, module_index, function_index, imported_functions)
+        function_index += 1
+    return "\n".join(lines) + "\n"
+
+
+# Edit a module the way a commit would: change some constants and append a new function
+def churn_module(rng, content, module_index):
+    lines = content.split("\n")
+    for _ in range(rng.randint(1, 3)):
+        line_index = rng.randrange(len(lines))
+        if "threshold=" in lines[line_index]:
+            lines[line_index] = lines[line_index].split("threshold=")[0] + f"threshold={rng.randint(101, 200)}):"
+    lines += render_function(rng, module_index, 1000 + rng.randint(0, 999), [])
+    return "\n".join(lines)
+
+
+def git(repo_dir, *args):
+    subprocess.run(["git", *GIT_IDENTITY, *args], cwd=repo_dir, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+# Returns the paths (relative to repo_dir) of the churned files
+def create_synthetic_repo(repo_dir, num_files=50, lines_per_file=120, churn=0.2, imports_per_file=3, seed=0):
+    rng = random.Random(seed)
+    package_dir = os.path.join(repo_dir, PACKAGE_NAME)
+    os.makedirs(package_dir, exist_ok=True)
+    git(repo_dir, "init", "-q", "-b", "main")
+
+    with open(os.path.join(package_dir, "__init__.py"), 'w') as f:
+        f.write("")
+    contents = {}
+    for module_index in range(num_files):
+        file_path = os.path.join(PACKAGE_NAME, get_module_name(module_index) + ".py")
+        contents[file_path] = render_module(rng, module_index, lines_per_file, imports_per_file)
+        with open(os.path.join(repo_dir, file_path), 'w') as f:
+            f.write(contents[file_path])
+    git(repo_dir, "add", "-A")
+    git(repo_dir, "commit", "-q", "-m", "Initial synthetic repository")
+
+    churned_file_paths = sorted(rng.sample(sorted(contents), round(num_files * churn)))
+    for file_path in churned_file_paths:
+        module_index = int(os.path.basename(file_path)[len("module_"):-len(".py")])
+        with open(os.path.join(repo_dir, file_path), 'w') as f:
+            f.write(churn_module(rng, contents[file_path], module_index))
+    return churned_file_paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic git repository to benchmark scanline on")
+    parser.add_argument("repo_dir")
+    parser.add_argument("--files", type=int, default=50)
+    parser.add_argument("--lines", type=int, default=120, help="Approximate lines per file")
+    parser.add_argument("--churn", type=float, default=0.2, help="Fraction of files with uncommitted edits")
+    parser.add_argument("--imports", type=int, default=3, help="Imports from other generated modules per file")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    churned_file_paths = create_synthetic_repo(args.repo_dir, args.files, args.lines, args.churn, args.imports, args.seed)
+    print(f"Created {args.repo_dir}: {args.files} files, {len(churned_file_paths)} with uncommitted changes")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,24 +1,41 @@
 from datetime import datetime
-import subprocess
 import os, sys
-from dotenv import load_dotenv
 from pprint import pprint 
 import logging 
-import argparse
+import asyncio
+import copy
+import time
+from collections import Counter
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import List, Optional
 import shutil
 import json
 
-#to run local webapp
-import http.server
-import socketserver
-import socketserver
-
-from reviewme.ailinter.helpers import create_openai_chat_completion, create_simple_openai_chat_completion, load_config
-from reviewme.ailinter.format_results import organize_feedback_items, format_feedback_for_print, get_files_to_review, get_okay_files, PRIORITY_MAP, LIST_OF_ERROR_CATEGORIES, DESCRIPTIONS_OF_ERROR_CATEGORIES
+from reviewme.ailinter.helpers import close_aiohttp_session, get_aiohttp_session, load_config, ProviderTimeoutError, RateLimitedError
+from reviewme.ailinter.providers import complete_chat, get_fallback_chain, get_model_endpoint, pick_model, route_model, split_model_spec
+from reviewme.ailinter.ratelimit import get_rate_limiter
+from reviewme.ailinter.file_index import list_files
+from reviewme.ailinter.git_utils import collect_file_diffs, get_current_branch, get_git_root, get_main_branch_name
+from reviewme.ailinter.history import open_history_writer
+from reviewme.ailinter.dedup import DEDUP_FINDINGS, cluster_feedback_items
+from reviewme.ailinter.triage import CHEAP, SKIP, TRIAGE_CHEAP_MODEL, TRIAGE_DIFFS, DiffTriage, format_triage_summary
+from reviewme.ailinter.ci import CI_FAIL_ON, CI_MAX_COST_USD, EXIT_OK, EXIT_REFUSED, get_exit_code
+from reviewme.ailinter.packer import PACK_MAX_FILES, PACK_SMALL_DIFFS, PACK_TOKEN_BUDGET, PACKED_REVIEW_INSTRUCTIONS, demultiplex_feedback_items, get_pack_groups, render_packed_code
+from reviewme.ailinter.chunker import ReviewChunk, chunk_diff, chunk_file, get_chunk_token_budget, remap_feedback_items, merge_chunk_feedback_items
+from reviewme.ailinter.tokenizer import count_tokens, count_message_tokens
+from reviewme.ailinter.planner import build_review_plan, format_review_plan, format_duration
+from reviewme.ailinter.import_graph import ImportGraph
+from reviewme.ailinter.usage import UsageStats
+from reviewme.ailinter.telemetry import TELEMETRY
+from reviewme.ailinter.batch import write_batch_run, wait_for_batch_results, find_latest_batch_run
+from reviewme.ailinter.progress import ReviewProgress, ResultStreamWriter
+from reviewme.ailinter.cache import ReviewCache, get_review_cache_key
+from reviewme.ailinter.review_state import get_review_state_path, load_review_state, save_review_state, get_blob_shas, partition_by_review_state, update_review_state, prune_review_state
+from reviewme.ailinter.format_results import organize_feedback_items, format_feedback_for_print, FEEDBACK_ITEM_SCHEMA, PARSE_STATS, format_file_feedback_for_stream, get_files_to_review, get_okay_files, PRIORITY_MAP, LIST_OF_ERROR_CATEGORIES, DESCRIPTIONS_OF_ERROR_CATEGORIES
 
 ###########
 logging.getLogger(__name__)
-load_dotenv()
 
 SUPPORTED_FILE_EXTENSIONS = [
     ".js",
@@ -72,16 +89,27 @@ def load_rule_guide(config):
     with open(rule_guide_path, 'r') as f:
         return f.read()
 
+# Read on first use rather than at import, and only once per process
+@lru_cache(maxsize=None)
+def get_rule_guide():
+    return load_rule_guide(load_config())
+
 ############################
 ## Set up based on config 
 ############################
 config = load_config()
-RULE_GUIDE_MD = load_rule_guide(config)
-
-SAVED_REVIEWS_DIR=config['SAVED_REVIEWS_DIR']
 
-# Create the folder, in the local directory, if it doesn't exist already
-os.makedirs(SAVED_REVIEWS_DIR, exist_ok=True)
+DEFAULT_CONCURRENCY = config['DEFAULT_CONCURRENCY']
+MAX_REVIEW_ATTEMPTS = config['MAX_REVIEW_ATTEMPTS']
+IMPORT_CONTEXT_TOKEN_BUDGET = config['IMPORT_CONTEXT_TOKEN_BUDGET']
+DEFAULT_BATCH_BACKEND = config['BATCH_BACKEND']
+DEFAULT_FEEDBACK_FORMAT = config['FEEDBACK_FORMAT']
+JSON_MODE_MODELS = config['JSON_MODE_MODELS']
+# Where the web report and streamed results are written
+WEBAPP_DIR = "/var/tmp/scanline"
+# Past this many input tokens the user is asked before the review starts
+LARGE_REVIEW_TOKENS = 30000
+FILE_TOKENS_LIMIT = 10000
 
 ############################
 ## Load all code in the directory 
@@ -104,23 +132,15 @@ def read_py_files(file_paths):
 
     return file_contents
 
-import os
 def clear_terminal():
     os.system('cls' if os.name == 'nt' else 'clear')
 
-# Check for local imports in the code and append the imported code
-def check_and_append_local_imports(code, file_paths):
-    lines = code.split('\n')
-    for line in lines:
-        if line.startswith('import ') or line.startswith('from '):
-            try:
-                module_name = line.split(' ')[1].split('.')[0]
-                if module_name + '.py' in file_paths:
-                    imported_code = read_py_files([module_name + '.py'])[module_name + '.py']
-                    code += '\n' + imported_code
-            except Exception as e:
-                print(f"An error occurred while processing import statements: {e}")
-    return code
+# Append the definitions of local symbols the code under review imports and uses, under a token budget
+def append_import_context(code, file_path, import_graph):
+    import_context = import_graph.get_import_context(file_path, code, IMPORT_CONTEXT_TOKEN_BUDGET)
+    if not import_context:
+        return code
+    return f"{code}\n\n=== DEFINITIONS OF LOCAL SYMBOLS USED ABOVE, FOR REFERENCE ===\n{import_context}"
 
 ############################
 ## LLM call and Prompt 
@@ -175,85 +195,70 @@ AILINTER_INSTRUCTIONS=f"""
 
     """
 
+# Structured-output variant: the same review instructions, answered with JSON matching FEEDBACK_ITEM_SCHEMA
+JSON_FEEDBACK_FORMAT_INSTRUCTIONS = f"""
+    - Respond with a single JSON object and nothing else, matching this JSON schema:
+        {json.dumps(FEEDBACK_ITEM_SCHEMA)}
+    - Use one entry in "feedback_items" per issue. "priority" is High, Medium or Low and "error_category" is the category name.
+    - If it looks OK, respond with {{"feedback_items": []}}
+
+    """
+AILINTER_JSON_INSTRUCTIONS = AILINTER_INSTRUCTIONS[:AILINTER_INSTRUCTIONS.index("    - If it looks OK")] + JSON_FEEDBACK_FORMAT_INSTRUCTIONS.lstrip("\n")
+
 ############################
 ## Construct the prompt 
 ############################
 
 def get_completion_prompt (code):
-    completion_prompt = f"{AILINTER_INSTRUCTIONS} \n\n === RULE GUIDE: === {RULE_GUIDE_MD} \n\n === CODE TO REVIEW === ```\n {code} \n```"
+    completion_prompt = f"{AILINTER_INSTRUCTIONS} \n\n === RULE GUIDE: === {get_rule_guide()} \n\n === CODE TO REVIEW === ```\n {code} \n```"
     return completion_prompt
 
-def get_chat_completion_messages_for_review(code, full_file_content):
+FEEDBACK_FORMAT_INSTRUCTIONS = {
+    "text": AILINTER_INSTRUCTIONS,
+    "json": AILINTER_JSON_INSTRUCTIONS,
+}
+
+# Instructions + rule guide, byte-identical for every request in a run. Providers cache a shared
+# prompt prefix, so nothing file-specific may appear before the end of this message.
+@lru_cache(maxsize=None)
+def get_static_system_prompt(feedback_format=DEFAULT_FEEDBACK_FORMAT):
+    return f"{FEEDBACK_FORMAT_INSTRUCTIONS[feedback_format].strip()}\n\n=== RULE GUIDE: ===\n{get_rule_guide().strip()}\n"
+
+# JSON mode is requested from the API only for models that support it; the others get the prompt alone
+def get_response_format(model, feedback_format):
+    if feedback_format == "json" and model in JSON_MODE_MODELS:
+        return {"type": "json_object"}
+    return None
+
+# `num_packed_files` > 0: `code` holds several small diffs under "=== FILE: <path> ===" headers
+def get_chat_completion_messages_for_review(code, full_file_content, feedback_format=DEFAULT_FEEDBACK_FORMAT, num_packed_files=0):
+    user_content = ""
+    if num_packed_files:
+        user_content += PACKED_REVIEW_INSTRUCTIONS.format(num_files=num_packed_files) + "\n\n"
     if full_file_content is not None:
-        chat_messsages = [
-                    {"role": "system", "content": f"{AILINTER_INSTRUCTIONS} \n\n === RULE GUIDE: === \n{RULE_GUIDE_MD} \n\n === FULL FILE CONTENT BEFORE CHANGES FOR REFERENCE=== \n{full_file_content} \n"},
-                    {"role": "user", "content": f"=== CODE TO REVIEW === ```\n{code}\n```"},
-                ]
-    else:
-        chat_messsages = [
-                        {"role": "system", "content": f"{AILINTER_INSTRUCTIONS} \n\n === RULE GUIDE: === \n{RULE_GUIDE_MD} \n\n \n"},
-                        {"role": "user", "content": f"=== CODE TO REVIEW === ```\n{code}\n```"},
-                    ]
+        user_content += f"=== FULL FILE CONTENT BEFORE CHANGES FOR REFERENCE===\n{full_file_content}\n\n"
+    user_content += f"=== CODE TO REVIEW === ```\n{code}\n```"
+
+    chat_messsages = [
+                {"role": "system", "content": get_static_system_prompt(feedback_format)},
+                {"role": "user", "content": user_content},
+            ]
     return chat_messsages
 
 ############################
 ## LLM call and Prompt 
 ############################
 
-def get_main_branch_name():
-    # Get the name of the main branch (either main or master)
-    result = subprocess.run(
-        "git ls-remote --heads origin | grep 'refs/heads/main'",
-        shell=True,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True
-    )
-    if result.stdout:
-        return "main"
-    else:
-        return "master"
-
-def get_git_root():
-    try:
-        root = subprocess.run(
-            "git rev-parse --show-toplevel",
-            shell=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
-        ).stdout.strip()
-    except Exception as e:
-        logging.error(f"Error while getting git root: {e}. Setting root to None")
-        root = None
-
-    return root
-
 def get_files_changed(target): 
-    # Get list of absolute paths to all files that changed on this git branch compared to main
+    # Get list of absolute paths to all files that changed on this git branch compared to target
     # Assumes target is a valid git identifier like HEAD~0 or main
-    file_paths_changed = os.popen("git diff --name-only {0}".format(target)).read().split("\n")
-
-    git_root = get_git_root()
-
-    # add . prefix to all files
-    result = []
-    for file_path in file_paths_changed:
-        file_extension = os.path.splitext(file_path)[1]
-        if file_path != "" and file_extension in SUPPORTED_FILE_EXTENSIONS:
-            result.append(git_root + "/" + file_path)
-
-    return result
+    return list(collect_file_diffs(target, SUPPORTED_FILE_EXTENSIONS))
 
 def get_file_diffs(file_paths, target):
-    # Get the diff for each file compared to target
+    # Get the diff for each file compared to target, all from a single git diff call
     # Note: Won't include any files that only exist upstream but not locally. 
-
-    file_diffs = {}
-    for file_path in file_paths:
-        logging.debug(f"Getting diff for {file_path} and target {target}")
-        file_diffs[file_path] = os.popen("git diff --unified=0 {0} {1} 2>/dev/null".format(target, file_path)).read()
-    return file_diffs
+    file_diffs = collect_file_diffs(target, SUPPORTED_FILE_EXTENSIONS)
+    return {file_path: file_diffs[file_path].diff_text if file_path in file_diffs else "" for file_path in file_paths}
 
 def get_final_organized_feedback(feedback_list):
 
@@ -266,63 +271,223 @@ def get_final_organized_feedback(feedback_list):
 ## Main 
 ############################
 
-def review_code(code, full_file_content, model):
-    import time
-    import random
+# One review request: a chunk of a file (or several small diffs packed together), the code sent
+# for it (the chunk plus imported definitions) and the model it is routed to
+@dataclass
+class ReviewJob:
+    chunks: List[ReviewChunk]
+    code: str
+    full_file_content: Optional[str]
+    model: str
+
+    @property
+    def num_packed_files(self):
+        return len(self.chunks) if len(self.chunks) > 1 else 0
+
+    # what the plan and the logs call this request
+    @property
+    def label(self):
+        if self.num_packed_files:
+            return f"packed: {', '.join(chunk.file_path for chunk in self.chunks)}"
+        return self.chunks[0].file_path
+
+def get_review_job_messages(job, feedback_format=DEFAULT_FEEDBACK_FORMAT):
+    return get_chat_completion_messages_for_review(job.code, job.full_file_content, feedback_format, job.num_packed_files)
+
+# (file path, prompt messages, model) for every request a list of review jobs will send
+def get_review_requests(review_jobs, feedback_format=DEFAULT_FEEDBACK_FORMAT):
+    return [(job.label, get_review_job_messages(job, feedback_format), job.model) for job in review_jobs]
+
+# Pack single-chunk diffs routed to the same model into shared requests, so a commit of many
+# tiny diffs doesn't send the static system prompt once per file (see packer.py)
+def pack_review_jobs(review_jobs, feedback_format=DEFAULT_FEEDBACK_FORMAT):
+    jobs_by_model = {}
+    for job in review_jobs:
+        jobs_by_model.setdefault(job.model, []).append(job)
+
+    packed_jobs = []
+    for model, model_jobs in jobs_by_model.items():
+        # a pack must still fit the model's context next to the prompt and the response
+        prompt_overhead_tokens = count_message_tokens(get_chat_completion_messages_for_review("", None, feedback_format, PACK_MAX_FILES))
+        budget = min(PACK_TOKEN_BUDGET, get_chunk_token_budget(model, prompt_overhead_tokens))
+        job_tokens = [
+            count_tokens(job.code) if job.chunks[0].total == 1 and job.full_file_content is None else float('inf')
+            for job in model_jobs
+        ]
+        groups, unpacked = get_pack_groups(job_tokens, budget)
+        packed_jobs.extend(model_jobs[i] for i in unpacked)
+        for group in groups:
+            sections = [(model_jobs[i].chunks[0].file_path, model_jobs[i].code) for i in group]
+            packed_jobs.append(ReviewJob([model_jobs[i].chunks[0] for i in group], render_packed_code(sections), None, model))
+    return packed_jobs
+
+# Parse one response into (chunk, feedback items with original file line numbers) for every chunk it covers
+def get_chunk_feedback_items(chunks, llm_response):
+    with TELEMETRY.stage("parsing"):
+        feedback_items = organize_feedback_items([llm_response])
+        if len(chunks) == 1:
+            return [(chunks[0], remap_feedback_items(feedback_items, chunks[0]))]
+        feedback_items_by_file = demultiplex_feedback_items(feedback_items, [chunk.file_path for chunk in chunks])
+        return [(chunk, remap_feedback_items(feedback_items_by_file[chunk.file_path], chunk)) for chunk in chunks]
+
+# Split one file's diff (or whole content in demo/repo scope) into chunks that fit the model's context
+def get_review_chunks(file_path, content, file_diff, full_file_content, model, feedback_format=DEFAULT_FEEDBACK_FORMAT):
+    # leave room in every chunk for the imported definitions appended to it
+    prompt_overhead_tokens = count_message_tokens(get_chat_completion_messages_for_review("", full_file_content, feedback_format)) + IMPORT_CONTEXT_TOKEN_BUDGET
+    budget = get_chunk_token_budget(model, prompt_overhead_tokens)
+    if file_diff is not None:
+        return chunk_diff(file_diff, budget, count_tokens)
+    return chunk_file(file_path, content, budget, count_tokens)
+
+# One review job per chunk of every changed file, minus the ones triage skips (see triage.py)
+def get_review_jobs(file_paths_changed, diffs, file_diffs, import_graph, model, onlyReviewThisFile="", feedback_format=DEFAULT_FEEDBACK_FORMAT, route=False, triage_decisions=None):
+    triage_decisions = triage_decisions or {}
+    review_jobs = []
+    for file_path in file_paths_changed:
+        try:
+            if onlyReviewThisFile != "" and onlyReviewThisFile not in file_path:
+                logging.debug(f"Skipping {file_path} because it does not match onlyReviewThisFile {onlyReviewThisFile}")
+                continue
 
-    delay = 0.1
-    success = False
-    numAttempts = 10
-    attemptsLeft = numAttempts
-    while not success and attemptsLeft > 0:
-        llm_response = create_openai_chat_completion(
-            messages = get_chat_completion_messages_for_review(code, full_file_content),
-            model = model,
-        ) 
-
-        if llm_response is not None and "Rate limit reached" not in llm_response:
-            return llm_response
+            content = diffs[file_path]
+            print(f"\n== Checking {file_path} ==")
 
-        print(f"llm_response: {llm_response}")
-        time.sleep(delay)
-        delay *= random.uniform(1.5, 3)
-        attemptsLeft -= 1
+            if content == "" or content == None:
+                print(f"Skipping {file_path} because it is empty")
+                continue
 
-    # hail mary try gpt3.5 with 16k context window see if this works!
-    llm_response = create_openai_chat_completion(
-        messages = get_chat_completion_messages_for_review(code, full_file_content),
-        model = "gpt-3.5-turbo-16k",
-    )
-    return llm_response
+            triage_decision = triage_decisions.get(file_path)
+            if triage_decision is not None and triage_decision.action == SKIP:
+                print(f"Skipping {file_path}: {triage_decision.reason}")
+                continue
+
+            full_file_content = None # read_file(file_path)
+
+            # Large diffs/files are split along hunk and declaration boundaries and the chunks reviewed concurrently
+            chunks = get_review_chunks(file_path, content, file_diffs.get(file_path), full_file_content, model, feedback_format)
+            if len(chunks) > 1:
+                print(f"Splitting {file_path} into {len(chunks)} chunks to fit the {model} context window")
+            for chunk in chunks:
+                # Append the definitions of imported local symbols this chunk uses
+                code = append_import_context(chunk.text, file_path, import_graph)
+                job_model = model
+                if triage_decision is not None and triage_decision.action == CHEAP:
+                    job_model = TRIAGE_CHEAP_MODEL
+                    logging.debug(f"Sending {file_path} chunk {chunk.index + 1}/{chunk.total} to {job_model} ({triage_decision.reason})")
+                elif route:
+                    request_tokens = count_message_tokens(get_chat_completion_messages_for_review(code, full_file_content, feedback_format))
+                    job_model, route_name = route_model(model, file_path, chunk.text, count_tokens(chunk.text), request_tokens)
+                    if route_name is not None:
+                        logging.debug(f"Routing {file_path} chunk {chunk.index + 1}/{chunk.total} to {job_model} ({route_name})")
+                review_jobs.append(ReviewJob([chunk], code, full_file_content, job_model))
+        except Exception as e:
+            logging.error(f"Error while reviewing {file_path}: {e}, skipping this file")
+    return review_jobs
+
+async def review_code(code, full_file_content, model, rate_limiter=None, base_url=None, cache=None, usage_stats=None, feedback_format=DEFAULT_FEEDBACK_FORMAT, num_packed_files=0, request_timeout=None):
+    # Identical code + context + prompt + model was reviewed before: reuse that response
+    if cache is not None:
+        cache_key = get_review_cache_key(code, full_file_content, get_static_system_prompt(feedback_format), get_rule_guide(), model, config['DEFAULT_TEMPERATURE'], get_model_endpoint(model, base_url))
+        cached_response = cache.get(cache_key)
+        if cached_response is not None:
+            TELEMETRY.increment("cache_hits")
+            return cached_response
+
+    # All workers share one limiter, so a 429 seen by one worker slows every worker down
+    # instead of each retrying blindly on its own schedule
+    rate_limiter = rate_limiter or get_rate_limiter()
+    messages = get_chat_completion_messages_for_review(code, full_file_content, feedback_format, num_packed_files)
+    num_tokens = count_message_tokens(messages)
+
+    # Each attempt goes to the first model of the fallback chain that isn't backed off or out of quota,
+    # so a busy model spills over to the next one instead of every request queueing behind it
+    chain = get_fallback_chain(model)
+    failed_models = set()
+    for attempt in range(MAX_REVIEW_ATTEMPTS):
+        attempt_model = pick_model(chain, rate_limiter, num_tokens, failed_models)
+        if attempt > 0:
+            TELEMETRY.increment("retries", labels={"model": attempt_model})
+        if attempt_model != model:
+            TELEMETRY.increment("fallbacks", labels={"from": model, "to": attempt_model})
+        waiting_since = time.perf_counter()
+        await rate_limiter.aacquire(attempt_model, num_tokens)
+        requested_at = time.perf_counter()
+        TELEMETRY.observe("rate_limit_wait_seconds", requested_at - waiting_since, {"model": attempt_model})
+        try:
+            llm_response = await complete_chat(messages, attempt_model, base_url = base_url, usage_stats = usage_stats, response_format = get_response_format(attempt_model, feedback_format), timeout = request_timeout)
+        except RateLimitedError as e:
+            logging.debug(f"{attempt_model} rate limited on attempt {attempt + 1}/{MAX_REVIEW_ATTEMPTS}: {e}")
+            TELEMETRY.increment("requests", labels={"model": attempt_model, "outcome": "rate_limited"})
+            rate_limiter.report_rate_limited(attempt_model, retry_after=e.retry_after)
+            continue
+        except ProviderTimeoutError as e:
+            # a slow model is most likely overloaded: back it off like a 429 and try the next one
+            logging.debug(f"Timed out on attempt {attempt + 1}/{MAX_REVIEW_ATTEMPTS}: {e}")
+            TELEMETRY.increment("requests", labels={"model": attempt_model, "outcome": "timeout"})
+            rate_limiter.report_rate_limited(attempt_model)
+            failed_models.add(attempt_model)
+            continue
+
+        TELEMETRY.observe("llm_latency_seconds", time.perf_counter() - requested_at, {"model": attempt_model})
+        TELEMETRY.increment("requests", labels={"model": attempt_model, "outcome": "ok" if llm_response is not None else "error"})
+        rate_limiter.report_success(attempt_model)
+        if llm_response is not None:
+            # only cache what the requested model said, under its own key
+            if cache is not None and attempt_model == model:
+                cache.put(cache_key, llm_response, model)
+            return llm_response
+        failed_models.add(attempt_model)
+
+    logging.error(f"No model in {chain} returned a review after {MAX_REVIEW_ATTEMPTS} attempts, giving up on this file")
+    return None
+
+# Run every review as an asyncio task on one pooled HTTP session, with at most `concurrency` in flight
+# Reviews are handed to `on_review_complete(job_index, llm_response)` in completion order, so results
+# can be shown while slower files are still in flight. Returns all responses in job order.
+# At `deadline` (a time.monotonic() timestamp), or when the run is cancelled (Ctrl-C), reviews that
+# haven't started are dropped and in-flight requests aborted; their responses stay None and
+# `on_review_complete` is never called for them.
+async def review_files(review_jobs, concurrency, base_url=None, cache=None, on_review_complete=None, usage_stats=None, feedback_format=DEFAULT_FEEDBACK_FORMAT, request_timeout=None, deadline=None):
+    rate_limiter = get_rate_limiter()
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    # size the shared connection pool to the number of reviews in flight
+    get_aiohttp_session(pool_size = max(1, concurrency))
+
+    async def review_one(job_index, job):
+        queued_at = time.perf_counter()
+        async with semaphore:
+            TELEMETRY.observe("queue_wait_seconds", time.perf_counter() - queued_at)
+            return job_index, await review_code(job.code, job.full_file_content, job.model, rate_limiter, base_url, cache, usage_stats, feedback_format, job.num_packed_files, request_timeout)
+
+    review_results = [None] * len(review_jobs)
+    tasks = [asyncio.ensure_future(review_one(job_index, job)) for job_index, job in enumerate(review_jobs)]
+    try:
+        timeout = None if deadline is None else max(0, deadline - time.monotonic())
+        for next_completed in asyncio.as_completed(tasks, timeout=timeout):
+            job_index, llm_response = await next_completed
+            review_results[job_index] = llm_response
+            if on_review_complete is not None:
+                on_review_complete(job_index, llm_response)
+    except asyncio.TimeoutError:
+        logging.warning(f"Deadline reached with {sum(not task.done() for task in tasks)} of {len(tasks)} reviews unfinished, cancelling them")
+    finally:
+        # cancelling a task aborts its HTTP call or rate limiter wait
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await close_aiohttp_session()
+    return review_results
 
 def read_file(file_path):
     with open(file_path, 'r') as f:
         return f.read()
 
-def get_current_branch():
-    # use git cli to figure out which branch we're on    
-    result = subprocess.run(
-        "git branch --show-current",
-        shell=True,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True
-    )
-    
-    if result.stdout:
-        return result.stdout.strip()
-    else:
-        return None
-
-def select_candidate_files(file_paths, k=3):
-    # get all files starting at the git root of this project
-    file_paths = subprocess.check_output(['git', 'ls-files']).decode('utf-8').split('\n')
+DEMO_FILE_EXTENSIONS = ('.js', '.py', '.java', '.cpp', '.h', '.c', '.html', '.css', '.xml', '.json', '.yml', '.yaml', '.sh', '.md', '.txt', '.go', '.ts')
 
-    # filter for programming source code files
-    file_paths = [f for f in file_paths if f.endswith(('.js', '.py', '.java', '.cpp', '.h', '.c', '.html', '.css', '.xml', '.json', '.yml', '.yaml', '.sh', '.md', '.txt', '.go', '.ts'))]
-
-    # filter for files with at least 500 and less than 5000 characters
-    file_char_counts = {f: os.stat(f).st_size for f in file_paths if os.stat(f).st_size >= 500 and os.stat(f).st_size < 5000}
+def select_candidate_files(file_entries, k=3):
+    # filter for programming source code files with at least 500 and less than 5000 characters,
+    # using the sizes the file listing already stat'ed
+    file_char_counts = {entry.path: entry.size for entry in file_entries if entry.path.endswith(DEMO_FILE_EXTENSIONS) and 500 <= entry.size < 5000 and not entry.is_binary}
 
     # randomize order o the file_char_counts dictionary keys so its different on every call to select_candidate_files
     import random
@@ -342,19 +507,135 @@ def select_candidate_files(file_paths, k=3):
 
     return candidate_files
 
-def run(scope, onlyReviewThisFile, model): 
-    # Get all .py files in this directory and subdirectories
-    excluded_dirs = ["bin", "lib", "include", "env", "node_modules"]
-    file_paths = []
+# Stream each file's feedback as soon as all of its chunks are back, in completion order.
+# Returns ({file path: merged feedback items}, {file paths with a failed or unfinished chunk}).
+# Stopping at the deadline or on Ctrl-C still returns the feedback of every file that finished.
+# `result_writers` (see ci.py) get each reviewed file's feedback as it completes, empty for files without findings.
+def stream_reviews(review_jobs, plan, concurrency, base_url, use_cache, feedback_format=DEFAULT_FEEDBACK_FORMAT, request_timeout=None, deadline=None, result_writers=()):
+    cache = ReviewCache() if use_cache else None
+    feedback_items_by_file = {}
+    failed_file_paths = set()
+    chunks_remaining_by_file = Counter(chunk.file_path for job in review_jobs for chunk in job.chunks)
+    progress = ReviewProgress(total_files=len(chunks_remaining_by_file), total_requests=len(review_jobs))
+    result_stream = ResultStreamWriter(os.path.join(WEBAPP_DIR, "results.jsonl"))
+
+    def on_review_complete(job_index, llm_response):
+        chunks = review_jobs[job_index].chunks
+        if llm_response is None:
+            failed_file_paths.update(chunk.file_path for chunk in chunks)
+        else:
+            # Parse this response's feedback, split it per file if packed, and map line numbers back onto the original files
+            for chunk, chunk_feedback_items in get_chunk_feedback_items(chunks, llm_response):
+                feedback_items_by_file.setdefault(chunk.file_path, []).extend(chunk_feedback_items)
+        progress.request_done(plan.request_input_tokens[job_index] + (count_tokens(llm_response) if llm_response else 0))
+
+        for chunk in chunks:
+            chunks_remaining_by_file[chunk.file_path] -= 1
+            if chunks_remaining_by_file[chunk.file_path] > 0:
+                continue
+            progress.file_done()
+            if feedback_items_by_file.get(chunk.file_path):
+                file_feedback_items = merge_chunk_feedback_items(feedback_items_by_file[chunk.file_path])
+                feedback_items_by_file[chunk.file_path] = file_feedback_items
+                with TELEMETRY.stage("rendering"):
+                    progress.clear()
+                    print(format_file_feedback_for_stream(chunk.file_path, file_feedback_items))
+                    result_stream.write(chunk.file_path, file_feedback_items)
+            # writers also hear about files reviewed without findings, unless a chunk of the file failed
+            if chunk.file_path not in failed_file_paths:
+                for result_writer in result_writers:
+                    result_writer.write(chunk.file_path, feedback_items_by_file.get(chunk.file_path, []))
+        progress.render()
+
+    usage_stats = UsageStats()
+    interrupted = False
+    try:
+        asyncio.run(review_files(review_jobs, concurrency, base_url, cache, on_review_complete, usage_stats, feedback_format, request_timeout, deadline))
+    except KeyboardInterrupt:
+        interrupted = True
+    finally:
+        result_stream.close()
+        progress.finish()
+
+    unfinished_file_paths = {file_path for file_path, chunks_remaining in chunks_remaining_by_file.items() if chunks_remaining > 0}
+    if unfinished_file_paths:
+        reason = "Interrupted" if interrupted else "Deadline reached"
+        print(f"\n=== ⏹️ {reason}: {len(unfinished_file_paths)} of {len(chunks_remaining_by_file)} files not fully reviewed, showing partial results ===")
+        failed_file_paths.update(unfinished_file_paths)
+        # keep what the finished chunks of partly reviewed files found
+        for file_path in unfinished_file_paths & feedback_items_by_file.keys():
+            feedback_items_by_file[file_path] = merge_chunk_feedback_items(feedback_items_by_file[file_path])
+
+    TELEMETRY.set_usage(usage_stats)
+    print(f"\n=== 📈 Token usage: {usage_stats.get_summary(count_tokens(get_static_system_prompt(feedback_format)))} ===")
+    if cache is not None:
+        print(f"\n=== 🗄️ Review cache: {cache.get_summary()} ===")
+
+    return feedback_items_by_file, failed_file_paths
+
+
+# Group ([chunks], llm_response) results into merged feedback items per file, with line numbers mapped back
+def collect_chunk_feedback(chunk_results):
+    feedback_items_by_file = {}
+    failed_file_paths = set()
+    for chunks, llm_response in chunk_results:
+        if llm_response is None:
+            failed_file_paths.update(chunk.file_path for chunk in chunks)
+            continue
+        for chunk, chunk_feedback_items in get_chunk_feedback_items(chunks, llm_response):
+            feedback_items_by_file.setdefault(chunk.file_path, []).extend(chunk_feedback_items)
+
+    for file_path, file_feedback_items in feedback_items_by_file.items():
+        feedback_items_by_file[file_path] = merge_chunk_feedback_items(file_feedback_items)
+    return feedback_items_by_file, failed_file_paths
+
+# Write all requests to a batch file, submit it to the batch backend and wait for the results
+def run_batch_review(review_jobs, model, batch_backend, base_url, feedback_format=DEFAULT_FEEDBACK_FORMAT, deadline=None):
+    batch_requests = []
+    for job in review_jobs:
+        # the Batch API takes plain OpenAI model names
+        request_model = split_model_spec(job.model)[1] if batch_backend == "openai" else job.model
+        batch_requests.append((job.chunks, get_review_job_messages(job, feedback_format), request_model, get_response_format(job.model, feedback_format)))
+    run_dir = write_batch_run(batch_requests, model, config['DEFAULT_TEMPERATURE'], batch_backend, base_url)
+    print(f"\n=== 📦 Wrote {len(batch_requests)} requests to {run_dir}, submitting to the {batch_backend} batch backend ===\n")
+    print(f"If this run is interrupted, pick it up again with: scanline resume-batch --run-dir {run_dir}\n")
+    chunk_results = wait_for_batch_results(run_dir, deadline=deadline)
+    return collect_chunk_feedback(chunk_results)
+
+# Resume a batch run started earlier (the latest one by default): poll, download and show its results
+def resume_batch_review(run_dir=None):
+    run_dir = run_dir or find_latest_batch_run()
+    if run_dir is None:
+        print("No batch runs found to resume.")
+        return
 
+    print(f"\n=== 📦 Resuming batch run {run_dir} ===\n")
+    PARSE_STATS.reset()
+    feedback_items_by_file, _ = collect_chunk_feedback(wait_for_batch_results(run_dir))
+    print(f"\n=== 🧾 Feedback parsing: {PARSE_STATS.get_summary()} ===")
+    display_and_save_results([item for file_feedback_items in feedback_items_by_file.values() for item in file_feedback_items])
+
+def run(scope, onlyReviewThisFile, model, concurrency=DEFAULT_CONCURRENCY, base_url=None, use_cache=True, incremental=False, plan_only=False, batch=False, batch_backend=DEFAULT_BATCH_BACKEND, feedback_format=DEFAULT_FEEDBACK_FORMAT, route=False, pack=PACK_SMALL_DIFFS, triage=TRIAGE_DIFFS, request_timeout=None, deadline=None, ci=False, fail_on=CI_FAIL_ON, result_writers=()): 
+    # `deadline`: seconds the whole run may take, counted from now
+    # `ci`: never prompt or open the browser; returns the exit code for `fail_on` (see ci.py)
+    # `triage`: skip formatting churn, vendored and generated files, and send trivial changes to TRIAGE_CHEAP_MODEL (see triage.py)
+    deadline = None if deadline is None else time.monotonic() + deadline
+    # stage timings, latencies and retries for the run report (see telemetry.py)
+    TELEMETRY.reset(scope=scope, model=model, concurrency=concurrency, batch=batch, feedback_format=feedback_format)
+    # All files in this directory and subdirectories, minus gitignored/excluded/oversized ones (see FILE_INDEX_* in config.yaml)
     # TODO fix this bug.  if we call scanline from within dir it'll ignore files not in this dir even if we do scope == repo
-    for root, dirs, files in os.walk("."):
-        dirs[:] = [d for d in dirs if d not in excluded_dirs]
-        for file in files:
-            full_file_path = os.path.join(root, file)
-            file_paths.append(full_file_path)
+    with TELEMETRY.stage("file_discovery"):
+        file_entries = list_files(".")
+    file_paths = [entry.path for entry in file_entries]
 
-    feedback_list = [] 
+    carried_over_feedback_items = []
+    file_diffs = {}
+    diff_target = None
+    incremental = incremental and scope == "repo"
+
+    if scope == "demo" and ci:
+        print("The demo asks which files to review, so it can't run with --ci. Pick --scope commit, branch or repo.")
+        return EXIT_REFUSED
 
     if scope == "demo":
         # rendering demo splash screen
@@ -367,15 +648,15 @@ def run(scope, onlyReviewThisFile, model):
         selection = input("Press any key to continue, or press q to quit: ")
         if selection == "q":
             print("Okay, exiting...")
-            return
+            return EXIT_OK
 
         review_candidate_files = "n"
         while review_candidate_files.lower() != "y":
             clear_terminal()
-            candidate_files = select_candidate_files(file_paths, k=3)
+            candidate_files = select_candidate_files(file_entries, k=3)
             if len(candidate_files) == 0:
                 print("Couldn't find any good source-code files to review. Please try running this from the root directory of a git project that has some source code files.")
-                return
+                return EXIT_OK
 
             print("\nHere are some candidate files we could review as part of this demo:")
             for file in candidate_files:
@@ -391,146 +672,204 @@ def run(scope, onlyReviewThisFile, model):
             file_paths_changed = candidate_files
  
     elif scope == "commit":
-        file_paths_changed = get_files_changed("HEAD~0")
-        diffs = get_file_diffs(file_paths_changed, "HEAD~0")
+        diff_target = "HEAD~0"
+        with TELEMETRY.stage("git"):
+            file_diffs = collect_file_diffs(diff_target, SUPPORTED_FILE_EXTENSIONS)
+        file_paths_changed = list(file_diffs)
+        diffs = {file_path: file_diff.diff_text for file_path, file_diff in file_diffs.items()}
     elif scope == "branch":
-        main_branch_name = get_main_branch_name()
-        remote_branch_name = f"origin/{main_branch_name}"
-        try:
-            file_paths_changed = get_files_changed(remote_branch_name)
-            diffs = get_file_diffs(file_paths_changed, remote_branch_name)
-        except Exception as e:
-            pass
-        try:
-            file_paths_changed = get_files_changed(remote_branch_name)
-            diffs = get_file_diffs(file_paths_changed, remote_branch_name)
-        except Exception as e:
-            pass
+        with TELEMETRY.stage("git"):
+            main_branch_name = get_main_branch_name()
+            diff_target = f"origin/{main_branch_name}"
+            file_diffs = collect_file_diffs(diff_target, SUPPORTED_FILE_EXTENSIONS)
+        file_paths_changed = list(file_diffs)
+        diffs = {file_path: file_diff.diff_text for file_path, file_diff in file_diffs.items()}
     elif scope == "repo":
         file_paths_changed = []
         # not actually getting diffs, just reading whole file to review and using "diffs" for naming consistency with the other scope options above
         diffs = {}
-        file_contents = read_py_files(file_paths)
+        files_to_read = [entry.path for entry in file_entries if entry.extension in SUPPORTED_FILE_EXTENSIONS and not entry.is_binary]
+        if incremental:
+            # only files whose git blob changed since the saved review get re-read and re-reviewed
+            git_root = get_git_root()
+            review_state_path = get_review_state_path()
+            review_state = load_review_state(review_state_path)
+            with TELEMETRY.stage("git"):
+                blob_shas = get_blob_shas(git_root)
+            review_fingerprint = get_review_cache_key(None, None, get_static_system_prompt(feedback_format), get_rule_guide(), model, config['DEFAULT_TEMPERATURE'], get_model_endpoint(model, base_url))
+            supported_file_paths = files_to_read
+            files_to_read, carried_over_feedback_items = partition_by_review_state(supported_file_paths, review_state, blob_shas, git_root, review_fingerprint, triage)
+            print(f"Incremental review: {len(files_to_read)} files changed since the last saved review, reusing saved results for {len(supported_file_paths) - len(files_to_read)} files")
+        with TELEMETRY.stage("file_read"):
+            file_contents = read_py_files(files_to_read)
         for file_path, diff in file_contents.items():
             file_paths_changed.append(file_path)
             diffs[file_path] = diff
         
-    # Define the maximum concurrency
-    from concurrent.futures import ThreadPoolExecutor
-    MAX_CONCURRENCY = 1
-
-    # preliminary scan all files see how big this change is
-    total_chars = 0
-    file_size_dict = {}
-    ESTIMATED_AVG_CHARS_PER_TOKEN = 4
-    for file_path in list(file_paths_changed):
-        try:
-            with open(file_path, 'r') as f:
-                content = f.read()
-                total_chars += len(content)
-                file_size_dict[file_path] = len(content) / ESTIMATED_AVG_CHARS_PER_TOKEN
-        except Exception as e:
-            file_paths_changed.remove(file_path)
-            logging.debug(f"Error while reading {file_path}: {e}")
-            
-    GPT4_PRICING_1K_TOKENS = 0.03
-    numTokens = total_chars/ESTIMATED_AVG_CHARS_PER_TOKEN
+    # Local triage before anything is sent: formatting churn, vendored and generated files are skipped
+    triage_decisions = {}
+    if triage and scope != "demo":
+        with TELEMETRY.stage("triage"):
+            diff_triage = DiffTriage(get_git_root() or ".")
+            triage_decisions = diff_triage.triage_diffs(file_diffs, diff_target) if diff_target else diff_triage.triage_files(diffs)
+        for decision in triage_decisions.values():
+            TELEMETRY.increment("triage_files", labels={"action": decision.action})
+        triage_summary = format_triage_summary(triage_decisions)
+        if triage_summary:
+            print(f"\n{triage_summary}")
+
+    # Collect the review jobs. They all run concurrently below, paced by the shared rate limiter.
+    # timed by hand rather than with a `with` block, as it ends after packing
+    prompt_building_started_at = time.perf_counter()
+    import_graph = ImportGraph(file_paths, get_git_root() or ".")
+    review_jobs = get_review_jobs(file_paths_changed, diffs, file_diffs, import_graph, model, onlyReviewThisFile, feedback_format, route, triage_decisions)
+
+    # Commit and branch diffs are mostly a few lines each: share requests between the small ones
+    if pack and file_diffs:
+        num_jobs = len(review_jobs)
+        review_jobs = pack_review_jobs(review_jobs, feedback_format)
+        if len(review_jobs) < num_jobs:
+            print(f"\nPacked {num_jobs} review requests into {len(review_jobs)} by sharing requests between small diffs")
+    TELEMETRY.add_stage_time("prompt_building", time.perf_counter() - prompt_building_started_at)
+
+    if batch and batch_backend == "openai":
+        other_provider_models = sorted({job.model for job in review_jobs if split_model_spec(job.model)[0] != "openai"})
+        if other_provider_models:
+            print(f"The openai batch backend can only run OpenAI models, but this review would use {', '.join(other_provider_models)}. Use --batch-backend local, or change --model / MODEL_ROUTES.")
+            return EXIT_REFUSED
+
+    # Plan the run: count the tokens of every prompt that will actually be sent, and project cost and time
+    with TELEMETRY.stage("planning"):
+        plan = build_review_plan(get_review_requests(review_jobs, feedback_format), model, concurrency, num_files=len({chunk.file_path for job in review_jobs for chunk in job.chunks}))
+    print(format_review_plan(plan))
+    if plan_only:
+        return EXIT_OK
 
     # TODO on 1ST INSTALL ask for preference -> save initial config file 
     # config file stores all global configs like folders/files to ignore, persistent settings default loaded by scanline
     # dynamic options mid run: Y = continue, 2 = ignore files beyond X size 3 bail out/don't run. 4. select files you want
-    if numTokens > 30000: 
-        FILE_TOKENS_LIMIT = 10000
-        print("Heads up this change is roughly {0} tokens which is fairly large. On GPT4 as of October 2023 this may cost >${1} USD?".format(numTokens, (numTokens/1000) * GPT4_PRICING_1K_TOKENS))
+    if ci:
+        # no one to ask: apply the size and cost policy from config.yaml
+        if plan.input_tokens > LARGE_REVIEW_TOKENS:
+            large_file_paths = [file_path for file_path, num_tokens in plan.input_tokens_by_file.items() if num_tokens > FILE_TOKENS_LIMIT]
+            for file_path in large_file_paths:
+                print(f"Ignoring {file_path} because it is {plan.input_tokens_by_file[file_path]} >= {FILE_TOKENS_LIMIT} tokens")
+            review_jobs = [job for job in review_jobs if not any(chunk.file_path in large_file_paths for chunk in job.chunks)]
+            plan = build_review_plan(get_review_requests(review_jobs, feedback_format), model, concurrency, num_files=len({chunk.file_path for job in review_jobs for chunk in job.chunks}))
+        if plan.cost > CI_MAX_COST_USD:
+            print(f"This review is projected to cost ~${plan.cost:.2f} USD, over the CI limit of ${CI_MAX_COST_USD:.2f} (CI_MAX_COST_USD in config.yaml). Not reviewing.")
+            return EXIT_REFUSED
+    elif plan.input_tokens > LARGE_REVIEW_TOKENS: 
+        print("Heads up this change is {0} tokens which is fairly large. On {1} this is projected to cost ~${2:.2f} USD".format(plan.input_tokens, model, plan.cost))
         selection = input("Choose one of the following options and press enter:\n\t(1) ignore files larger than 10k tokens \n\t(2) exit review\n\t(3) continue review without changes")
         while selection != "1" and selection != "2" and selection != "3":
             selection = input("Ehem... please select a valid option 1, 2, 3...")
         if selection == "1":
             print("Ignoring files larger than 10k tokens")
-            for file_path in list(file_paths_changed):
-                if file_size_dict.get(file_path, 0) > FILE_TOKENS_LIMIT:
-                    print(f"Ignoring {file_path} because it is {file_size_dict[file_path]} >= {FILE_TOKENS_LIMIT} tokens")
-                    file_paths_changed.remove(file_path)
-                    numTokens = numTokens - file_size_dict[file_path]
-            if numTokens > 30000: 
-                FILE_TOKENS_LIMIT = 10000
-                print("Heads up this change is still roughly {0} tokens which is fairly large. On GPT4 as of October 2023 this may cost >${1} USD?".format(numTokens, (numTokens/1000) * GPT4_PRICING_1K_TOKENS))
+            for file_path, num_tokens in plan.input_tokens_by_file.items():
+                if num_tokens > FILE_TOKENS_LIMIT:
+                    print(f"Ignoring {file_path} because it is {num_tokens} >= {FILE_TOKENS_LIMIT} tokens")
+                    review_jobs = [job for job in review_jobs if not any(chunk.file_path == file_path for chunk in job.chunks)]
+            plan = build_review_plan(get_review_requests(review_jobs, feedback_format), model, concurrency, num_files=len({chunk.file_path for job in review_jobs for chunk in job.chunks}))
+            if plan.input_tokens > LARGE_REVIEW_TOKENS: 
+                print("Heads up this change is still {0} tokens which is fairly large. On {1} this is projected to cost ~${2:.2f} USD".format(plan.input_tokens, model, plan.cost))
                 selection = input("Options enter one of the following and press enter:\n\t(1) continue review\n\t(2) exit review")
                 while selection != "1" and selection != "2":
                     selection = input("Ehem... please select a valid option 1, 2")
                 if selection == "2":
                     print("Probably for the best 👍")
-                    return
+                    return EXIT_OK
     
         if selection == "2":
             print("Probably for the best 👍")
-            return
- 
-    # Create a ThreadPoolExecutor with the maximum concurrency
-    with ThreadPoolExecutor(max_workers=MAX_CONCURRENCY) as executor:
-        # Submit the file review completion jobs to the executor
-        futures = []
-        for file_path in file_paths_changed:
-            try:
-                if onlyReviewThisFile != "" and onlyReviewThisFile not in file_path:
-                    continue
+            return EXIT_OK
 
-                    # check that onlyThisFile is in the file path or else skip 
-                if onlyReviewThisFile != "" and onlyReviewThisFile not in file_path:
-                    logging.debug(f"Skipping {file_path} because it does not match onlyReviewThisFile {onlyReviewThisFile}")
-                    continue
+    print (f"\nProcessing and generating feedback for {plan.num_requests} requests. This should take about {format_duration(plan.wall_time_seconds)}...\n")
 
-                content = diffs[file_path]
-                print(f"\n== Checking {file_path} ==")
+    # every run's findings are appended to the review history (see history.py)
+    history_writer = open_history_writer(get_git_root(), scope, model)
+    if history_writer is not None:
+        result_writers = list(result_writers) + [history_writer]
 
-                if content == "" or content == None:
-                    print(f"Skipping {file_path} because it is empty")
+    try:
+        PARSE_STATS.reset()
+        with TELEMETRY.stage("review"):
+            if batch:
+                feedback_items_by_file, failed_file_paths = run_batch_review(review_jobs, model, batch_backend, base_url, feedback_format, deadline)
+                for file_path in dict.fromkeys(chunk.file_path for job in review_jobs for chunk in job.chunks):
+                    if file_path not in failed_file_paths:
+                        for result_writer in result_writers:
+                            result_writer.write(file_path, feedback_items_by_file.get(file_path, []))
+            else:
+                feedback_items_by_file, failed_file_paths = stream_reviews(review_jobs, plan, concurrency, base_url, use_cache, feedback_format, request_timeout, deadline, result_writers)
+        print(f"\n=== 🧾 Feedback parsing: {PARSE_STATS.get_summary()} ===")
+        print(f"\n=== ⏱️ Run telemetry: {TELEMETRY.format_summary()} ===")
+
+        if incremental:
+            for file_path, file_feedback_items in feedback_items_by_file.items():
+                # a file is only marked reviewed once every one of its chunks came back
+                if file_path not in failed_file_paths:
+                    update_review_state(review_state, file_path, copy.deepcopy(file_feedback_items), blob_shas, git_root, review_fingerprint)
+            # empty files and files skipped by triage get no request: remember them too, so they aren't read again next time
+            for file_path in file_paths_changed:
+                if onlyReviewThisFile not in file_path:
                     continue
-
-                # Append imported local modules' code to the existing code
-                current_code_to_review = check_and_append_local_imports(content, file_paths)
-                full_file_content = None # read_file(file_path)
-                
-                import time
-                time.sleep(0.25)
-                futures.append(executor.submit(review_code, current_code_to_review, full_file_content, model))
-            except Exception as e:
-                logging.error(f"Error while reviewing {file_path}: {e}, skipping this file")
-
-
-        # Estimate number of minutes to run the scan. This varies based on the speed of the user's machine. w
-        estimated_num_minutes = numTokens / 2500
-        estimated_max_minutes = round(estimated_num_minutes * 1.4)
-        estimated_min_minutes = round(estimated_num_minutes * 0.6)
-        # print (f"\nProcessing and generating feedback for the files listed. This may take between {estimated_min_minutes} and {estimated_max_minutes} minutes...\n")
-        print ("\nProcessing and generating feedback for all files. This will take several minutes...\n")
-
-        # Wait for all the jobs to complete
-        for future in futures:
-            llm_response = future.result()
-
-            if llm_response is None:
-                continue
-
-            feedback_list.append(llm_response)
-
-    ########################################################
-    ## Format and Display the Results
-    ########################################################
-
-    if feedback_list == [] or feedback_list == None:
+                triage_decision = triage_decisions.get(file_path)
+                if triage_decision is not None and triage_decision.action == SKIP:
+                    update_review_state(review_state, file_path, [], blob_shas, git_root, review_fingerprint, skipped=True)
+                elif not diffs.get(file_path):
+                    update_review_state(review_state, file_path, [], blob_shas, git_root, review_fingerprint)
+            prune_review_state(review_state, blob_shas)
+            save_review_state(review_state_path, review_state)
+
+
+        # saved results of files unchanged since the last incremental review are reported like fresh ones
+        carried_over_feedback_items_by_file = {}
+        for item in carried_over_feedback_items:
+            carried_over_feedback_items_by_file.setdefault(item["filepath"], []).append(item)
+        for file_path, file_feedback_items in carried_over_feedback_items_by_file.items():
+            for result_writer in result_writers:
+                result_writer.write(file_path, file_feedback_items)
+
+        # get the organized *dictionary* of feedback items, plus saved ones for files unchanged since the last incremental review
+        organized_feedback_dict = [item for file_feedback_items in feedback_items_by_file.values() for item in file_feedback_items] + carried_over_feedback_items
+        # before display_and_save_results reformats the items for the webapp
+        exit_code = get_exit_code(organized_feedback_dict, fail_on, incomplete=bool(failed_file_paths))
+        if history_writer is not None:
+            history_writer.finish("incomplete" if failed_file_paths else "complete")
+            print(f"\n=== 🗂️ Saved this review as run {history_writer.run_id} in the review history, see `scanline history` ===")
+    finally:
+        # a no-op once the run was finished above; otherwise (an error, Ctrl-C) the run is saved as incomplete
+        if history_writer is not None:
+            history_writer.close()
+
+    with TELEMETRY.stage("rendering"):
+        display_and_save_results(organized_feedback_dict, open_webapp=not ci)
+    return exit_code
+
+########################################################
+## Format and Display the Results
+########################################################
+
+# `open_webapp`: also save the results for the webapp and open it in the browser
+def display_and_save_results(organized_feedback_dict, open_webapp=True):
+    if not organized_feedback_dict:
         print ("\n\n=== No feedback found. All done. ===\n")
         return
 
-    # get the organized *dictionary* of feedback items
-    organized_feedback_dict = organize_feedback_items(feedback_list)
+    # report the same issue found in many places once, with all its locations
+    if DEDUP_FINDINGS:
+        num_findings = len(organized_feedback_dict)
+        organized_feedback_dict = cluster_feedback_items(organized_feedback_dict)
+        if len(organized_feedback_dict) < num_findings:
+            print(f"\n=== 🧩 Merged {num_findings} findings into {len(organized_feedback_dict)} distinct issues ===")
 
     # get the *pretty print* for them for terminal 
     final_organized_issues_to_print = format_feedback_for_print(organized_feedback_dict)
 
     # get the list of files *to review*
     files_to_review_list = get_files_to_review(organized_feedback_dict)
-    okay_file_list = get_okay_files(directory_path=".", files_to_review_list=files_to_review_list)
+    okay_file_list = get_okay_files([entry.path for entry in list_files(".")], files_to_review_list=files_to_review_list)
 
     print (f"\n\n=== 💚 Final Organized Feedback 💚===\n{final_organized_issues_to_print}")
 
@@ -540,6 +879,9 @@ def run(scope, onlyReviewThisFile, model):
 
     print ("\n\n=== Done. ===\nSee above for code review. \nNow running the rest of your code...\n")
 
+    if not open_webapp:
+        return
+
     ############################
     ### Save this review for record-keeping and display
     ### Saves the organized feedback results into a local folder. This can be referenced and updated later, in terminal or the streamlit app 
@@ -562,8 +904,14 @@ def run(scope, onlyReviewThisFile, model):
     for feedback in organized_feedback_dict:
         feedback['error_category'] = f"{feedback['error_category']} {LIST_OF_ERROR_CATEGORIES[feedback['error_category']]}"
 
+    # List the other locations of merged findings in one column (the table's columns are those of its first row, so every row gets it)
+    if any('locations' in feedback for feedback in organized_feedback_dict):
+        for feedback in organized_feedback_dict:
+            locations = feedback.pop('locations', [])[1:]
+            feedback['also_found_at'] = ", ".join(f"{location['filepath']}:{location['line_number']}" for location in locations)
+
     # Re-order the columns
-    organized_feedback_dict = [{k: v for k, v in sorted(feedback.items(), key=lambda item: ['error_category', 'priority_score', 'filepath', 'function_name', 'line_number', 'fail', 'fix'].index(item[0]))} for feedback in organized_feedback_dict]
+    organized_feedback_dict = [{k: v for k, v in sorted(feedback.items(), key=lambda item: ['error_category', 'priority_score', 'filepath', 'function_name', 'line_number', 'fail', 'fix', 'also_found_at'].index(item[0]))} for feedback in organized_feedback_dict]
 
     # Rename the columns
     for feedback in organized_feedback_dict:
@@ -574,6 +922,8 @@ def run(scope, onlyReviewThisFile, model):
         feedback['Line Number'] = feedback.pop('line_number')
         feedback['Issue'] = feedback.pop('fail')
         feedback['Suggested Fix'] = feedback.pop('fix')
+        if 'also_found_at' in feedback:
+            feedback['Also Found At'] = feedback.pop('also_found_at')
 
     # Re-order the rows by priority. first high, then medium, then low
     priority_order = ["🔴 High", "🟠 Medium", "🟡 Low"]
@@ -587,9 +937,8 @@ def run(scope, onlyReviewThisFile, model):
     ## Save to JS file for webapp html 
     json_data = json.dumps(organized_feedback_dict)
     js_data = f"var data = {json_data};"
-    SAVED_REVIEWS_DIR = "/var/tmp/scanline"
-    os.makedirs(SAVED_REVIEWS_DIR, exist_ok=True)
-    absolute_js_file_path = os.path.join(SAVED_REVIEWS_DIR, f"data.js")
+    os.makedirs(WEBAPP_DIR, exist_ok=True)
+    absolute_js_file_path = os.path.join(WEBAPP_DIR, f"data.js")
     with open(absolute_js_file_path, 'w') as f:
         f.write(js_data)
 
@@ -603,17 +952,17 @@ def run(scope, onlyReviewThisFile, model):
     dir_path = get_install_dir()
     # copy index.html 
     src = os.path.join(dir_path, 'webapp-test/index.html')
-    index_html_file = '/var/tmp/scanline/index.html'
+    index_html_file = os.path.join(WEBAPP_DIR, 'index.html')
     shutil.copy2(src, index_html_file)
 
     # copy scripts.js
     src = os.path.join(dir_path, 'webapp-test/scripts.js')
-    dst = '/var/tmp/scanline/scripts.js'
+    dst = os.path.join(WEBAPP_DIR, 'scripts.js')
     shutil.copy2(src, dst)
 
     # copy styles.css
     src = os.path.join(dir_path, 'webapp-test/styles.css')
-    dst = '/var/tmp/scanline/styles.css'
+    dst = os.path.join(WEBAPP_DIR, 'styles.css')
     shutil.copy2(src, dst)
 
     ############################
@@ -621,6 +970,8 @@ def run(scope, onlyReviewThisFile, model):
     print (f"\n\n=== ✅ Opening the webapp in your browser... ===\n")
     print (f"index_html_file: {index_html_file}")
 
+    print ("Browse this and earlier reviews of this repo, with filters, with: scanline serve")
+
     import webbrowser
     webbrowser.open_new_tab(f"file://{index_html_file}")
 
@@ -0,0 +1,279 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from dataclasses import asdict
+from datetime import datetime
+
+from reviewme.ailinter.chunker import ReviewChunk
+from reviewme.ailinter.helpers import close_aiohttp_session, get_aiohttp_session, get_api_base, get_openai, load_config, ProviderTimeoutError, RateLimitedError
+from reviewme.ailinter.providers import complete_chat
+from reviewme.ailinter.ratelimit import get_rate_limiter
+from reviewme.ailinter.telemetry import TELEMETRY
+from reviewme.ailinter.tokenizer import count_message_tokens
+
+############################
+## Batch submission for large offline scans
+############################
+# Every request of a run is written to a JSONL batch file in the OpenAI batch format and
+# handed to a batch backend. All state (requests, which file/chunk each request belongs to,
+# the backend's batch id) lives in one run directory, so a run can be resumed later to poll,
+# download the results and turn them into feedback items.
+
+config = load_config()
+
+BATCH_DIR = os.path.join(config['SAVED_REVIEWS_DIR'], "scanline-batches")
+BATCH_POLL_SECONDS = config['BATCH_POLL_SECONDS']
+MAX_REVIEW_ATTEMPTS = config['MAX_REVIEW_ATTEMPTS']
+BATCH_TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+REQUESTS_FILENAME = "requests.jsonl"
+OUTPUT_FILENAME = "output.jsonl"
+STATE_FILENAME = "state.json"
+
+
+############################
+## Backends
+############################
+
+# OpenAI (or any server implementing the /v1/files and /v1/batches endpoints)
+class OpenAIBatchBackend:
+    def __init__(self, base_url=None):
+        self.base_url = base_url or get_api_base()
+
+    def _request(self, method, url, params=None):
+        requestor = get_openai().api_requestor.APIRequestor(api_base=self.base_url)
+        response, _, _ = requestor.request(method, url, params=params)
+        return response.data
+
+    def submit(self, run_dir):
+        with open(os.path.join(run_dir, REQUESTS_FILENAME), 'rb') as f:
+            uploaded = get_openai().File.create(file=f, purpose="batch", api_base=self.base_url)
+        batch = self._request("post", "/batches", {
+            "input_file_id": uploaded["id"],
+            "endpoint": "/v1/chat/completions",
+            "completion_window": "24h",
+        })
+        return batch["id"]
+
+    def poll(self, batch_id):
+        return self._request("get", f"/batches/{batch_id}")
+
+    def download(self, batch):
+        lines = []
+        # an expired batch still has output for the requests that finished
+        for file_key in ("output_file_id", "error_file_id"):
+            if batch.get(file_key):
+                content = get_openai().File.download(batch[file_key], api_base=self.base_url)
+                lines.extend(line for line in content.decode('utf-8').split("\n") if line.strip())
+        return lines
+
+
+# Local stand-in: runs the batch file itself against any OpenAI-compatible chat endpoint
+# (a mock server, llama.cpp, vLLM...), or the provider a "<provider>:<model>" name points at,
+# and writes output in the same format the batch API returns
+class LocalBatchBackend:
+    def __init__(self, base_url=None, concurrency=None):
+        self.base_url = base_url
+        self.concurrency = concurrency or config['DEFAULT_CONCURRENCY']
+
+    async def _run_requests(self, requests):
+        rate_limiter = get_rate_limiter()
+        semaphore = asyncio.Semaphore(max(1, self.concurrency))
+        get_aiohttp_session(pool_size = max(1, self.concurrency))
+
+        async def run_one(request):
+            body = request["body"]
+            num_tokens = count_message_tokens(body["messages"])
+            content = None
+            # one failed request is recorded in the output like any other, so it can't lose the rest of the run
+            error = "request failed"
+            async with semaphore:
+                for attempt in range(MAX_REVIEW_ATTEMPTS):
+                    await rate_limiter.aacquire(body["model"], num_tokens)
+                    requested_at = time.perf_counter()
+                    try:
+                        content = await complete_chat(body["messages"], body["model"], temperature=body["temperature"], base_url=self.base_url, response_format=body.get("response_format"))
+                        TELEMETRY.observe("llm_latency_seconds", time.perf_counter() - requested_at, {"model": body["model"]})
+                        TELEMETRY.increment("requests", labels={"model": body["model"], "outcome": "ok" if content is not None else "error"})
+                        break
+                    except RateLimitedError as e:
+                        logging.debug(f"{body['model']} rate limited on attempt {attempt + 1}/{MAX_REVIEW_ATTEMPTS}: {e}")
+                        TELEMETRY.increment("requests", labels={"model": body["model"], "outcome": "rate_limited"})
+                        rate_limiter.report_rate_limited(body["model"], retry_after=e.retry_after)
+                        error = f"rate limited: {e}"
+                    except ProviderTimeoutError as e:
+                        logging.debug(f"{body['model']} timed out on attempt {attempt + 1}/{MAX_REVIEW_ATTEMPTS}: {e}")
+                        TELEMETRY.increment("requests", labels={"model": body["model"], "outcome": "timeout"})
+                        rate_limiter.report_rate_limited(body["model"])
+                        error = f"timed out: {e}"
+                    except Exception as e:
+                        logging.error(f"{request['custom_id']}: request failed: {e}")
+                        TELEMETRY.increment("requests", labels={"model": body["model"], "outcome": "error"})
+                        error = f"request failed: {e}"
+                        break
+                else:
+                    logging.error(f"{request['custom_id']}: no response after {MAX_REVIEW_ATTEMPTS} attempts ({error}), giving up on it")
+            if content is None:
+                return {"custom_id": request["custom_id"], "response": None, "error": {"message": error}}
+            return {
+                "custom_id": request["custom_id"],
+                "response": {"status_code": 200, "body": {"choices": [{"message": {"role": "assistant", "content": content}}]}},
+                "error": None,
+            }
+
+        try:
+            return await asyncio.gather(*[run_one(request) for request in requests])
+        finally:
+            await close_aiohttp_session()
+
+    def submit(self, run_dir):
+        with open(os.path.join(run_dir, REQUESTS_FILENAME), 'r') as f:
+            requests = [json.loads(line) for line in f if line.strip()]
+        results = asyncio.run(self._run_requests(requests))
+        with open(os.path.join(run_dir, OUTPUT_FILENAME), 'w') as f:
+            for result in results:
+                f.write(json.dumps(result) + "\n")
+        return f"local:{run_dir}"
+
+    def poll(self, batch_id):
+        run_dir = batch_id[len("local:"):]
+        done = os.path.exists(os.path.join(run_dir, OUTPUT_FILENAME))
+        return {"id": batch_id, "status": "completed" if done else "failed", "run_dir": run_dir}
+
+    def download(self, batch):
+        with open(os.path.join(batch["run_dir"], OUTPUT_FILENAME), 'r') as f:
+            return [line for line in f if line.strip()]
+
+
+BATCH_BACKENDS = {
+    "openai": OpenAIBatchBackend,
+    "local": LocalBatchBackend,
+}
+
+
+def get_batch_backend(name, base_url=None):
+    if name not in BATCH_BACKENDS:
+        raise ValueError(f"Unknown batch backend {name}. Choose one of: {', '.join(BATCH_BACKENDS)}")
+    return BATCH_BACKENDS[name](base_url=base_url)
+
+
+############################
+## Run directory: requests, manifest and state
+############################
+
+def save_batch_state(run_dir, state):
+    tmp_path = os.path.join(run_dir, STATE_FILENAME + ".tmp")
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, os.path.join(run_dir, STATE_FILENAME))
+
+
+def load_batch_state(run_dir):
+    with open(os.path.join(run_dir, STATE_FILENAME), 'r') as f:
+        return json.load(f)
+
+
+# Write every review request to a new run directory.
+# `requests` is a list of ([chunks], messages, model, response_format or None), with several chunks for a
+# request packing small diffs; `model` is the run's default model.
+def get_chunk_info(chunk):
+    chunk_info = asdict(chunk)
+    chunk_info.pop("text")
+    return chunk_info
+
+
+def write_batch_run(requests, model, temperature, backend_name, base_url):
+    run_id = datetime.now().strftime("%Y%m%d-%H%M%S")
+    run_dir = os.path.join(BATCH_DIR, run_id)
+    os.makedirs(run_dir, exist_ok=True)
+
+    manifest = {}
+    with open(os.path.join(run_dir, REQUESTS_FILENAME), 'w') as f:
+        for request_index, (chunks, messages, request_model, response_format) in enumerate(requests):
+            custom_id = f"request-{request_index}"
+            manifest[custom_id] = [get_chunk_info(chunk) for chunk in chunks]
+            body = {"model": request_model, "messages": messages, "temperature": temperature}
+            if response_format:
+                body["response_format"] = response_format
+            f.write(json.dumps({
+                "custom_id": custom_id,
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": body,
+            }) + "\n")
+
+    save_batch_state(run_dir, {
+        "run_id": run_id,
+        "backend": backend_name,
+        "base_url": base_url,
+        "model": model,
+        "manifest": manifest,
+        "batch_id": None,
+        "status": "written",
+    })
+    return run_dir
+
+
+def submit_batch_run(run_dir):
+    state = load_batch_state(run_dir)
+    if state["batch_id"] is None:
+        backend = get_batch_backend(state["backend"], state["base_url"])
+        state["batch_id"] = backend.submit(run_dir)
+        state["status"] = "submitted"
+        save_batch_state(run_dir, state)
+    return state
+
+
+# The chunks of every request in the run, in request order
+def get_manifest_chunks(state):
+    manifest_chunks = []
+    for chunk_infos in state["manifest"].values():
+        # runs written before requests could be packed have one chunk per request
+        if isinstance(chunk_infos, dict):
+            chunk_infos = [chunk_infos]
+        manifest_chunks.append([ReviewChunk(text="", **chunk_info) for chunk_info in chunk_infos])
+    return manifest_chunks
+
+
+def find_latest_batch_run():
+    if not os.path.isdir(BATCH_DIR):
+        return None
+    for run_id in sorted(os.listdir(BATCH_DIR), reverse=True):
+        run_dir = os.path.join(BATCH_DIR, run_id)
+        if os.path.exists(os.path.join(run_dir, STATE_FILENAME)):
+            return run_dir
+    return None
+
+
+# Poll until the batch reaches a terminal status, then download its results.
+# Returns [([chunks], llm_response or None)] for every request in the run.
+# Polling stops at `deadline` (a time.monotonic() timestamp); the batch keeps running and can be resumed.
+def wait_for_batch_results(run_dir, poll_seconds=BATCH_POLL_SECONDS, deadline=None):
+    state = submit_batch_run(run_dir)
+    backend = get_batch_backend(state["backend"], state["base_url"])
+
+    batch = backend.poll(state["batch_id"])
+    while batch["status"] not in BATCH_TERMINAL_STATUSES:
+        counts = batch.get("request_counts") or {}
+        if deadline is not None and time.monotonic() + poll_seconds > deadline:
+            print(f"⏹️ Deadline reached while batch {state['batch_id']} is {batch['status']}. Collect its results later with: scanline resume-batch --run-dir {run_dir}")
+            return [(chunks, None) for chunks in get_manifest_chunks(state)]
+        print(f"⏳ Batch {state['batch_id']} is {batch['status']} ({counts.get('completed', 0)}/{counts.get('total', len(state['manifest']))} done). Checking again in {poll_seconds}s, Ctrl-C to stop and resume later.")
+        time.sleep(poll_seconds)
+        batch = backend.poll(state["batch_id"])
+
+    state["status"] = batch["status"]
+    save_batch_state(run_dir, state)
+    if batch["status"] != "completed":
+        logging.error(f"Batch {state['batch_id']} ended with status {batch['status']}, collecting whatever finished")
+
+    responses = {}
+    for line in backend.download(batch):
+        result = json.loads(line)
+        response = result.get("response") or {}
+        if response.get("status_code") == 200:
+            responses[result["custom_id"]] = response["body"]["choices"][0]["message"]["content"]
+
+    return [(chunks, responses.get(custom_id)) for custom_id, chunks in zip(state["manifest"], get_manifest_chunks(state))]
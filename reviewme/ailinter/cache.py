@@ -0,0 +1,124 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from reviewme.ailinter.helpers import load_config
+
+################################
+## On-disk review cache
+################################
+# Content-addressed store of LLM review responses. The key covers everything that
+# shapes a response (code, context, prompt text, model, temperature, and the endpoint
+# serving the model), so a hit is always safe to reuse. Entries are evicted least-recently-used once the cache grows
+# past REVIEW_CACHE_MAX_BYTES.
+
+config = load_config()
+
+REVIEW_CACHE_DIR = os.path.expanduser(config['REVIEW_CACHE_DIR'])
+REVIEW_CACHE_MAX_BYTES = config['REVIEW_CACHE_MAX_BYTES']
+
+
+# `endpoint`: the API base the model is called on (see providers.get_model_endpoint), so a response from
+# --base-url pointed at a local or mock server is never served as the hosted model's
+def get_review_cache_key(code, full_file_content, instructions, rule_guide, model, temperature, endpoint):
+    payload = json.dumps([code, full_file_content, instructions, rule_guide, model, temperature, endpoint])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ReviewCache:
+    def __init__(self, cache_dir=REVIEW_CACHE_DIR, max_bytes=REVIEW_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        # key -> (size, last_used); loaded lazily so runs that never touch the cache don't scan it
+        self.entries = None
+        self.total_bytes = 0
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + '.json')
+
+    def _load_index(self):
+        if self.entries is not None:
+            return
+        self.entries = {}
+        self.total_bytes = 0
+        if not os.path.isdir(self.cache_dir):
+            return
+        for shard in os.scandir(self.cache_dir):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if not entry.name.endswith('.json'):
+                    continue
+                stat = entry.stat()
+                self.entries[entry.name[:-len('.json')]] = (stat.st_size, stat.st_mtime)
+                self.total_bytes += stat.st_size
+
+    def get(self, key):
+        with self.lock:
+            path = self._path(key)
+            try:
+                with open(path, 'r') as f:
+                    response = json.load(f)['response']
+            except (OSError, ValueError, KeyError):
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            # bump the mtime so eviction treats this entry as recently used
+            now = time.time()
+            try:
+                os.utime(path, (now, now))
+            except OSError:
+                pass
+            if self.entries is not None and key in self.entries:
+                self.entries[key] = (self.entries[key][0], now)
+            return response
+
+    def put(self, key, response, model):
+        with self.lock:
+            self._load_index()
+            path = self._path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            data = json.dumps({"response": response, "model": model, "created_at": time.time()})
+
+            # write to a temp file and rename so a crash never leaves a half-written entry
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            try:
+                with open(tmp_path, 'w') as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                logging.debug(f"Could not write review cache entry {path}: {e}")
+                return
+
+            size = len(data.encode('utf-8'))
+            previous_size = self.entries.get(key, (0, 0))[0]
+            self.entries[key] = (size, time.time())
+            self.total_bytes += size - previous_size
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+
+    # Drop least-recently-used entries until the cache is back under 90% of its size budget
+    def _evict(self):
+        target = self.max_bytes * 0.9
+        for key, (size, _) in sorted(self.entries.items(), key=lambda item: item[1][1]):
+            if self.total_bytes <= target:
+                break
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+            del self.entries[key]
+            self.total_bytes -= size
+        logging.debug(f"Review cache evicted down to {self.total_bytes} bytes")
+
+    def get_summary(self):
+        total = self.hits + self.misses
+        hit_rate = (self.hits / total * 100) if total else 0
+        return f"{self.hits} hits, {self.misses} misses ({hit_rate:.0f}% hit rate)"
@@ -0,0 +1,195 @@
+import re
+from dataclasses import dataclass
+
+from reviewme.ailinter.helpers import load_config
+
+############################
+## Split large diffs and files into review chunks
+############################
+# A diff is split along hunk boundaries and a whole file along top-level
+# declarations, into windows that fit the model's context. Each chunk remembers
+# where it sits in the original file so feedback line numbers can be mapped back.
+
+config = load_config()
+
+MODEL_CONTEXT_WINDOWS = config['MODEL_CONTEXT_WINDOWS']
+REVIEW_OUTPUT_TOKENS = config['REVIEW_OUTPUT_TOKENS']
+CHUNK_OVERLAP_LINES = config['CHUNK_OVERLAP_LINES']
+
+# Lines that usually start a function/class/block at the top level in the languages we support
+DECLARATION_PATTERN = re.compile(
+    r"^(async def |def |class |function |export |func |fn |pub |impl |public |private |protected |static |"
+    r"module |sub |local function |interface |struct |enum |object |@)"
+)
+
+
+@dataclass
+class ReviewChunk:
+    file_path: str
+    text: str
+    # 1-based line range of the original file this chunk covers (diff chunks: the hunk range)
+    start_line: int
+    end_line: int
+    # added to line numbers the model reports for this chunk to get original file line numbers
+    line_offset: int = 0
+    index: int = 0
+    total: int = 1
+
+
+def get_context_window(model):
+    return MODEL_CONTEXT_WINDOWS.get(model, MODEL_CONTEXT_WINDOWS['default'])
+
+
+# Tokens left for code in one request once the prompt and the response are accounted for
+def get_chunk_token_budget(model, prompt_overhead_tokens):
+    return max(256, get_context_window(model) - prompt_overhead_tokens - REVIEW_OUTPUT_TOKENS)
+
+
+def get_declaration_boundaries(lines):
+    boundaries = set()
+    for i, line in enumerate(lines):
+        if not line or line[0].isspace():
+            continue
+        if DECLARATION_PATTERN.match(line) or (i > 0 and not lines[i - 1].strip()):
+            boundaries.add(i)
+    return boundaries
+
+
+# Greedily pack lines into [start, end) windows under `budget` tokens, preferring to cut at a boundary.
+# Consecutive windows share `overlap_lines` lines so issues spanning a cut are still seen whole.
+def split_lines(line_tokens, budget, boundaries=(), overlap_lines=0):
+    ranges = []
+    num_lines = len(line_tokens)
+    start = 0
+    while start < num_lines:
+        total = 0
+        end = start
+        last_boundary = None
+        while end < num_lines and total + line_tokens[end] <= budget:
+            total += line_tokens[end]
+            end += 1
+            if end < num_lines and end in boundaries:
+                last_boundary = end
+        if end == start:
+            # a single line larger than the budget still has to go somewhere
+            end = start + 1
+        elif end < num_lines and last_boundary is not None and last_boundary - start > (end - start) // 2:
+            end = last_boundary
+
+        ranges.append((start, end))
+        if end >= num_lines:
+            break
+        start = max(end - overlap_lines, start + 1)
+    return ranges
+
+
+def chunk_file(file_path, content, budget, count_tokens, overlap_lines=CHUNK_OVERLAP_LINES):
+    if count_tokens(content) <= budget:
+        return [ReviewChunk(file_path, content, 1, content.count("\n") + 1)]
+
+    lines = content.split("\n")
+    line_tokens = [count_tokens(line + "\n") for line in lines]
+    ranges = split_lines(line_tokens, budget, get_declaration_boundaries(lines), overlap_lines)
+
+    return [
+        ReviewChunk(
+            file_path=file_path,
+            text="\n".join(lines[start:end]),
+            start_line=start + 1,
+            end_line=end,
+            line_offset=start,
+            index=index,
+            total=len(ranges),
+        )
+        for index, (start, end) in enumerate(ranges)
+    ]
+
+
+# Split one oversized hunk into parts with their own accurate @@ headers
+def split_hunk(hunk, budget, count_tokens):
+    content = hunk.lines[1:]
+    line_tokens = [count_tokens(line + "\n") for line in content]
+    boundaries = get_declaration_boundaries([line[1:] for line in content])
+
+    parts = []
+    old_line, new_line = hunk.old_start, hunk.new_start
+    position = 0
+    for start, end in split_lines(line_tokens, budget, boundaries):
+        # advance the line counters over any lines between the previous part and this one
+        for line in content[position:start]:
+            old_line += line[:1] in ("-", " ")
+            new_line += line[:1] in ("+", " ")
+        part = content[start:end]
+        old_count = sum(line[:1] in ("-", " ") for line in part)
+        new_count = sum(line[:1] in ("+", " ") for line in part)
+        header = f"@@ -{old_line},{old_count} +{new_line},{new_count} @@"
+        parts.append(([header] + part, new_line, new_line + max(new_count, 1) - 1))
+        for line in part:
+            old_line += line[:1] in ("-", " ")
+            new_line += line[:1] in ("+", " ")
+        position = end
+    return parts
+
+
+def chunk_diff(file_diff, budget, count_tokens):
+    if count_tokens(file_diff.diff_text) <= budget or not file_diff.hunks:
+        return [ReviewChunk(file_diff.path, file_diff.diff_text, 1, 1)]
+
+    lines = file_diff.diff_text.split("\n")
+    header = "\n".join(lines[:next(i for i, line in enumerate(lines) if line.startswith("@@"))])
+    budget = max(1, budget - count_tokens(header))
+
+    # every piece is (lines, first new-file line, last new-file line); oversized hunks are split first
+    pieces = []
+    for hunk in file_diff.hunks:
+        if count_tokens("\n".join(hunk.lines)) <= budget:
+            pieces.append((hunk.lines, hunk.new_start, hunk.new_start + max(hunk.new_count, 1) - 1))
+        else:
+            pieces.extend(split_hunk(hunk, budget, count_tokens))
+
+    groups = []
+    group_tokens = 0
+    for piece in pieces:
+        piece_tokens = count_tokens("\n".join(piece[0]))
+        if not groups or group_tokens + piece_tokens > budget:
+            groups.append([])
+            group_tokens = 0
+        groups[-1].append(piece)
+        group_tokens += piece_tokens
+
+    return [
+        ReviewChunk(
+            file_path=file_diff.path,
+            text=header + "\n" + "\n".join(line for piece in group for line in piece[0]) + "\n",
+            start_line=group[0][1],
+            end_line=group[-1][2],
+            index=index,
+            total=len(groups),
+        )
+        for index, group in enumerate(groups)
+    ]
+
+
+# Map the line numbers in a chunk's parsed feedback items back to the original file
+def remap_feedback_items(feedback_items, chunk):
+    if chunk.total == 1:
+        return feedback_items
+
+    for item in feedback_items:
+        item["filepath"] = chunk.file_path
+        if chunk.line_offset and str(item["line_number"]).isdigit():
+            item["line_number"] = str(int(item["line_number"]) + chunk.line_offset)
+    return feedback_items
+
+
+# Overlapping chunks can report the same issue twice; keep the first
+def merge_chunk_feedback_items(feedback_items):
+    seen = set()
+    merged = []
+    for item in feedback_items:
+        key = (item["filepath"], item["line_number"], item["error_category"], item["fail"])
+        if key in seen:
+            continue
+        seen.add(key)
+        merged.append(item)
+    return merged
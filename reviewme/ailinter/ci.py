@@ -0,0 +1,164 @@
+import json
+import os
+import sys
+
+from reviewme.ailinter.format_results import DESCRIPTIONS_OF_ERROR_CATEGORIES, LIST_OF_ERROR_CATEGORIES, PRIORITY_MAP
+from reviewme.ailinter.helpers import load_config
+
+############################
+## Non-interactive CI runs: machine-readable results and exit codes
+############################
+# `scanline run --ci` never prompts and never opens the browser. Findings are written as JSON
+# Lines (one finding per line, flushed as each file finishes) and/or as one SARIF 2.1.0 log
+# (written when the run ends), to a file or to stdout ("-"). The exit code says whether any
+# finding reached the --fail-on priority.
+
+config = load_config()
+
+CI_FAIL_ON = config['CI_FAIL_ON']
+CI_MAX_COST_USD = config['CI_MAX_COST_USD']
+CI_FAIL_ON_INCOMPLETE = config['CI_FAIL_ON_INCOMPLETE']
+
+EXIT_OK = 0
+# a finding at or above the --fail-on priority
+EXIT_FINDINGS = 1
+# some files couldn't be reviewed (failed requests, --deadline, Ctrl-C)
+EXIT_INCOMPLETE = 2
+# the run was refused before reviewing: over the CI cost policy, or not runnable as configured
+EXIT_REFUSED = 3
+
+# "High", "Medium", "Low", most severe first
+PRIORITY_NAMES = [priority.split()[1] for priority in PRIORITY_MAP.values()]
+FAIL_ON_CHOICES = PRIORITY_NAMES + ["never"]
+SARIF_LEVELS = {"High": "error", "Medium": "warning", "Low": "note"}
+SARIF_SCHEMA = "https://json.schemastore.org/sarif-2.1.0.json"
+
+
+def get_priority_name(priority_score):
+    return priority_score.split()[-1]
+
+
+def get_rule_id(category_key):
+    return LIST_OF_ERROR_CATEGORIES[category_key].lower().replace(" issues", "").replace(" ", "-")
+
+
+def get_relative_path(file_path, root):
+    return os.path.relpath(os.path.abspath(file_path), root).replace(os.sep, "/")
+
+
+# A feedback item as reported to CI, at `path` (the reviewed file relative to the git root, whatever
+# path the model wrote), with plain category and priority names
+def get_finding(feedback_item, path):
+    return {
+        "path": path,
+        "line": int(feedback_item["line_number"]),
+        "function": feedback_item["function_name"],
+        "category": LIST_OF_ERROR_CATEGORIES[feedback_item["error_category"]],
+        "rule_id": get_rule_id(feedback_item["error_category"]),
+        "priority": get_priority_name(feedback_item["priority_score"]),
+        "fail": feedback_item["fail"],
+        "fix": feedback_item["fix"],
+    }
+
+
+def open_output(path):
+    return (sys.stdout, False) if path == "-" else (open(path, 'w'), True)
+
+
+# Both writers take each file's merged feedback items as soon as the file is done
+class JsonLinesWriter:
+    def __init__(self, path, root):
+        self.root = root
+        self.file, self.owns_file = open_output(path)
+
+    def write(self, file_path, feedback_items):
+        path = get_relative_path(file_path, self.root)
+        for item in feedback_items:
+            self.file.write(json.dumps(get_finding(item, path)) + "\n")
+        self.file.flush()
+
+    def close(self):
+        if self.owns_file:
+            self.file.close()
+
+
+class SarifWriter:
+    def __init__(self, path, root):
+        self.root = root
+        self.path = path
+        self.results = []
+
+    def write(self, file_path, feedback_items):
+        # converted right away: the feedback item dicts are reformatted for display later
+        path = get_relative_path(file_path, self.root)
+        self.results.extend(get_sarif_result(get_finding(item, path)) for item in feedback_items)
+
+    def close(self):
+        file, owns_file = open_output(self.path)
+        json.dump(get_sarif_log(self.results), file, indent=2)
+        file.write("\n")
+        file.flush()
+        if owns_file:
+            file.close()
+
+
+def get_sarif_rules():
+    return [
+        {
+            "id": get_rule_id(category_key),
+            "name": category_name.replace(" ", ""),
+            "shortDescription": {"text": category_name},
+            "fullDescription": {"text": DESCRIPTIONS_OF_ERROR_CATEGORIES[category_key]},
+        }
+        for category_key, category_name in LIST_OF_ERROR_CATEGORIES.items()
+    ]
+
+
+def get_sarif_result(finding):
+    return {
+        "ruleId": finding["rule_id"],
+        "level": SARIF_LEVELS[finding["priority"]],
+        "message": {"text": f"{finding['fail']} Fix: {finding['fix']}"},
+        "locations": [{
+            "physicalLocation": {
+                "artifactLocation": {"uri": finding["path"], "uriBaseId": "%SRCROOT%"},
+                # SARIF lines are 1-based; the model sometimes reports 0 for file-level issues
+                "region": {"startLine": max(1, finding["line"])},
+            },
+            "logicalLocations": [{"name": finding["function"], "kind": "function"}],
+        }],
+        "properties": {"priority": finding["priority"]},
+    }
+
+
+def get_sarif_log(results):
+    return {
+        "$schema": SARIF_SCHEMA,
+        "version": "2.1.0",
+        "runs": [{
+            "tool": {"driver": {"name": "scanline", "rules": get_sarif_rules()}},
+            "results": results,
+        }],
+    }
+
+
+# Writers for the requested outputs, relative to `root` (the git root). Opened before the run so "-"
+# binds to the real stdout even while the human-readable output is redirected to stderr.
+def open_result_writers(sarif_path=None, jsonl_path=None, root="."):
+    root = os.path.abspath(root)
+    writers = []
+    if jsonl_path:
+        writers.append(JsonLinesWriter(jsonl_path, root))
+    if sarif_path:
+        writers.append(SarifWriter(sarif_path, root))
+    return writers
+
+
+def get_exit_code(feedback_items, fail_on=CI_FAIL_ON, incomplete=False):
+    if fail_on != "never":
+        threshold = PRIORITY_NAMES.index(fail_on)
+        if any(PRIORITY_NAMES.index(get_priority_name(item["priority_score"])) <= threshold for item in feedback_items):
+            return EXIT_FINDINGS
+    if incomplete and CI_FAIL_ON_INCOMPLETE:
+        return EXIT_INCOMPLETE
+    return EXIT_OK
@@ -0,0 +1,260 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import signal
+import socket
+import time
+from datetime import datetime, timezone
+
+from reviewme.ailinter.ailinter import (
+    DEFAULT_CONCURRENCY, DEFAULT_FEEDBACK_FORMAT, SUPPORTED_FILE_EXTENSIONS,
+    collect_chunk_feedback, get_review_jobs, get_review_requests, pack_review_jobs, review_files,
+)
+from reviewme.ailinter.cache import ReviewCache
+from reviewme.ailinter.file_index import clear_file_list_cache, list_files
+from reviewme.ailinter.git_utils import collect_file_diffs, run_git
+from reviewme.ailinter.helpers import load_config
+from reviewme.ailinter.import_graph import ImportGraph
+from reviewme.ailinter.packer import PACK_SMALL_DIFFS
+from reviewme.ailinter.planner import build_review_plan
+from reviewme.ailinter.triage import TRIAGE_DIFFS, DiffTriage
+from reviewme.ailinter.usage import UsageStats
+
+############################
+## `scanline daemon`: review changes in the background
+############################
+# A long-running process per repo that polls the working tree, and once edits settle for
+# DAEMON_DEBOUNCE_SECONDS reviews the uncommitted changes exactly as `scanline --scope commit`
+# would (same chunks, packing, triage and routing), so the responses land in the review cache.
+# A later `scanline --scope commit`, or the post-commit hook, then gets them from the cache.
+# Clients talk to it over a Unix socket, one JSON line each way:
+#  - {"command": "review", "commit": "<rev>"}: the review of a commit against its parent
+#  - {"command": "status"}, {"command": "stop"}
+
+config = load_config()
+
+DAEMON_SOCKET_DIR = os.path.expanduser(config['DAEMON_SOCKET_DIR'])
+DAEMON_POLL_SECONDS = config['DAEMON_POLL_SECONDS']
+DAEMON_DEBOUNCE_SECONDS = config['DAEMON_DEBOUNCE_SECONDS']
+DAEMON_RESCAN_SECONDS = config['DAEMON_RESCAN_SECONDS']
+DAEMON_MAX_PASS_COST_USD = config['DAEMON_MAX_PASS_COST_USD']
+DAEMON_HOOK_TIMEOUT_SECONDS = config['DAEMON_HOOK_TIMEOUT_SECONDS']
+
+# git's empty tree, the "parent" of a root commit
+EMPTY_TREE = "4b825dc642cb6eb9a060e54bf8d69288fbee4904"
+HOOK_SCRIPT = """#!/bin/sh
+# Installed by `scanline daemon --install-hook`: show the review of each commit, pre-computed by `scanline daemon`
+scanline post-commit || true
+"""
+
+
+class DaemonNotRunning(Exception):
+    pass
+
+
+def get_daemon_socket_path(git_root):
+    return os.path.join(DAEMON_SOCKET_DIR, f"daemon-{hashlib.sha1(git_root.encode('utf-8')).hexdigest()[:12]}.sock")
+
+
+# Send one request to the daemon of `git_root` and return its response
+def request_daemon(git_root, request, timeout=DAEMON_HOOK_TIMEOUT_SECONDS):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(timeout)
+        try:
+            client.connect(get_daemon_socket_path(git_root))
+        except (FileNotFoundError, ConnectionRefusedError):
+            raise DaemonNotRunning(git_root)
+        client.sendall((json.dumps(request) + "\n").encode('utf-8'))
+        response = b""
+        while not response.endswith(b"\n"):
+            data = client.recv(65536)
+            if not data:
+                break
+            response += data
+    return json.loads(response)
+
+
+# Point the repo's post-commit hook at `scanline post-commit`. Returns the hook's path, or None if
+# there already is a post-commit hook that isn't ours.
+def install_post_commit_hook(git_root):
+    hooks_dir = run_git(["rev-parse", "--git-path", "hooks"], cwd=git_root).stdout.decode('utf-8').strip()
+    hook_path = os.path.join(git_root, hooks_dir, "post-commit")
+    if os.path.exists(hook_path):
+        with open(hook_path, 'r', errors='replace') as f:
+            if "scanline post-commit" not in f.read():
+                return None
+    os.makedirs(os.path.dirname(hook_path), exist_ok=True)
+    with open(hook_path, 'w') as f:
+        f.write(HOOK_SCRIPT)
+    os.chmod(hook_path, 0o755)
+    return hook_path
+
+
+class TreeWatcher:
+    def __init__(self, root):
+        self.root = root
+        self.file_paths = []
+        self.listed_at = None
+        # path -> (mtime, size) as of the last poll
+        self.snapshot = {}
+
+    def list_file_paths(self):
+        clear_file_list_cache()
+        self.file_paths = [entry.path for entry in list_files(self.root)]
+        self.listed_at = time.monotonic()
+
+    # Paths that changed, appeared or disappeared since the last poll. Stats the listed files
+    # every poll, and re-lists them every DAEMON_RESCAN_SECONDS to notice new ones.
+    def poll(self):
+        if self.listed_at is None or time.monotonic() - self.listed_at >= DAEMON_RESCAN_SECONDS:
+            self.list_file_paths()
+        snapshot = {}
+        for file_path in self.file_paths:
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                continue
+            snapshot[file_path] = (stat.st_mtime_ns, stat.st_size)
+        changed_file_paths = {file_path for file_path in snapshot.keys() | self.snapshot.keys() if snapshot.get(file_path) != self.snapshot.get(file_path)}
+        self.snapshot = snapshot
+        return changed_file_paths
+
+
+class ReviewDaemon:
+    def __init__(self, git_root, model, concurrency=DEFAULT_CONCURRENCY, base_url=None, feedback_format=DEFAULT_FEEDBACK_FORMAT, route=False, pack=PACK_SMALL_DIFFS, triage=TRIAGE_DIFFS):
+        self.git_root = git_root
+        self.model = model
+        self.concurrency = concurrency
+        self.base_url = base_url
+        self.feedback_format = feedback_format
+        self.route = route
+        self.pack = pack
+        self.triage = triage
+        self.socket_path = get_daemon_socket_path(git_root)
+        self.cache = ReviewCache()
+        self.watcher = TreeWatcher(git_root)
+        self.status = {"repo": git_root, "model": model, "started_at": datetime.now(timezone.utc).isoformat(), "passes": 0, "last_pass": None}
+
+    # The jobs `scanline --scope commit` would send for the same diff. Blocking: git, triage, chunking.
+    def get_review_jobs(self, target, new_target=None):
+        file_diffs = collect_file_diffs(target, SUPPORTED_FILE_EXTENSIONS, new_target=new_target)
+        triage_decisions = DiffTriage(self.git_root).triage_diffs(file_diffs, target, new_target) if self.triage else {}
+        import_graph = ImportGraph(self.watcher.file_paths, self.git_root)
+        diffs = {file_path: file_diff.diff_text for file_path, file_diff in file_diffs.items()}
+        review_jobs = get_review_jobs(list(file_diffs), diffs, file_diffs, import_graph, self.model, "", self.feedback_format, self.route, triage_decisions)
+        if self.pack and file_diffs:
+            review_jobs = pack_review_jobs(review_jobs, self.feedback_format)
+        return review_jobs
+
+    # Review a diff through the review cache. Passes projected to cost more than `max_cost` are skipped (None).
+    async def review(self, target, new_target=None, max_cost=None):
+        async with self.review_lock:
+            started_at = time.monotonic()
+            review_jobs = await asyncio.to_thread(self.get_review_jobs, target, new_target)
+            if max_cost is not None and review_jobs:
+                plan = await asyncio.to_thread(build_review_plan, get_review_requests(review_jobs, self.feedback_format), self.model, self.concurrency)
+                if plan.cost > max_cost:
+                    print(f"Skipping the background review of {plan.num_requests} requests: projected to cost ~${plan.cost:.2f} USD, over DAEMON_MAX_PASS_COST_USD (${max_cost:.2f})")
+                    return None
+            cache_hits = self.cache.hits
+            llm_responses = await review_files(review_jobs, self.concurrency, self.base_url, self.cache, usage_stats=UsageStats(), feedback_format=self.feedback_format)
+            feedback_items_by_file, failed_file_paths = collect_chunk_feedback((job.chunks, llm_response) for job, llm_response in zip(review_jobs, llm_responses))
+            return {
+                "files": len({chunk.file_path for job in review_jobs for chunk in job.chunks}),
+                "requests": len(review_jobs),
+                "cache_hits": self.cache.hits - cache_hits,
+                "failed_files": sorted(failed_file_paths),
+                "feedback_items": [item for file_feedback_items in feedback_items_by_file.values() for item in file_feedback_items],
+                "seconds": round(time.monotonic() - started_at, 3),
+            }
+
+    async def review_in_background(self):
+        try:
+            result = await self.review("HEAD~0", max_cost=DAEMON_MAX_PASS_COST_USD)
+        except Exception as e:
+            logging.error(f"scanline daemon: background review failed: {e}")
+            return
+        if result is None:
+            return
+        self.status["passes"] += 1
+        self.status["last_pass"] = {"finished_at": datetime.now(timezone.utc).isoformat(), **{key: value for key, value in result.items() if key != "feedback_items"}, "findings": len(result["feedback_items"])}
+        print(f"=== 🔁 Reviewed the uncommitted changes in {result['seconds']:.1f}s: {result['files']} files, {result['requests']} requests ({result['cache_hits']} from the cache), {len(result['feedback_items'])} findings ===")
+
+    # Poll the tree; review once no file has changed for DAEMON_DEBOUNCE_SECONDS
+    async def watch(self):
+        # what already changed before the daemon started is reviewed first
+        pending = True
+        last_change_at = time.monotonic()
+        while not self.stopped.is_set():
+            if await asyncio.to_thread(self.watcher.poll):
+                pending = True
+                last_change_at = time.monotonic()
+            if pending and time.monotonic() - last_change_at >= DAEMON_DEBOUNCE_SECONDS:
+                pending = False
+                await self.review_in_background()
+            try:
+                await asyncio.wait_for(self.stopped.wait(), DAEMON_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+    async def handle_request(self, request):
+        command = request.get("command")
+        if command == "status":
+            return {"ok": True, **self.status}
+        if command == "stop":
+            self.stopped.set()
+            return {"ok": True}
+        if command == "review":
+            commit = request.get("commit", "HEAD")
+            parent = await asyncio.to_thread(run_git, ["rev-parse", "--verify", "--quiet", f"{commit}^"], self.git_root)
+            target = parent.stdout.decode('utf-8').strip() if parent.returncode == 0 else EMPTY_TREE
+            return {"ok": True, "commit": commit, **await self.review(target, commit)}
+        return {"ok": False, "error": f"Unknown command: {command}"}
+
+    async def handle_connection(self, reader, writer):
+        try:
+            response = await self.handle_request(json.loads(await reader.readline()))
+        except Exception as e:
+            logging.error(f"scanline daemon: request failed: {e}")
+            response = {"ok": False, "error": str(e)}
+        try:
+            writer.write((json.dumps(response) + "\n").encode('utf-8'))
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self):
+        # one review at a time: a hook request waits for the background pass, then finds its responses in the cache
+        self.review_lock = asyncio.Lock()
+        self.stopped = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        loop.add_signal_handler(signal.SIGTERM, self.stopped.set)
+
+        os.makedirs(DAEMON_SOCKET_DIR, exist_ok=True)
+        server = await asyncio.start_unix_server(self.handle_connection, path=self.socket_path)
+        print(f"=== 👀 scanline daemon watching {self.git_root} with {self.model}, listening on {self.socket_path} (Ctrl-C to stop) ===")
+        try:
+            await self.watch()
+        finally:
+            server.close()
+            await server.wait_closed()
+
+    # Run until stopped. Returns False if this repo already has a running daemon.
+    def run(self):
+        if os.path.exists(self.socket_path):
+            try:
+                request_daemon(self.git_root, {"command": "status"}, timeout=5)
+                return False
+            except (DaemonNotRunning, OSError, ValueError):
+                # left behind by a daemon that didn't shut down cleanly
+                os.unlink(self.socket_path)
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+        return True
@@ -0,0 +1,131 @@
+import hashlib
+import random
+import re
+
+from reviewme.ailinter.format_results import PRIORITY_MAP
+from reviewme.ailinter.helpers import load_config
+
+############################
+## Cluster near-duplicate findings for the report
+############################
+# On repo scans the same issue (say, a missing timeout on subprocess.run) comes back once per
+# file. Findings of the same category are clustered by the similarity of their normalized fail
+# and fix text and function name, and each cluster is reported once, with all its locations.
+#  - features: word 3-shingles of the normalized text, plus the words of the function name
+#  - MinHash signatures of DEDUP_MINHASH_PERMUTATIONS hash functions estimate Jaccard similarity
+#  - LSH: signatures are cut into DEDUP_LSH_BANDS bands, and only findings sharing a band are
+#    compared, which keeps this near-linear in the number of findings
+#  - candidates at or above DEDUP_SIMILARITY estimated similarity are merged (union-find)
+# Only the report (terminal and web) is clustered; CI outputs and the review history keep every location.
+
+config = load_config()
+
+DEDUP_FINDINGS = config['DEDUP_FINDINGS']
+DEDUP_SIMILARITY = config['DEDUP_SIMILARITY']
+DEDUP_MINHASH_PERMUTATIONS = config['DEDUP_MINHASH_PERMUTATIONS']
+DEDUP_LSH_BANDS = config['DEDUP_LSH_BANDS']
+
+SHINGLE_SIZE = 3
+# Mersenne prime for the universal hash functions (a * x + b) mod p
+MINHASH_PRIME = (1 << 61) - 1
+MINHASH_SEED = 1
+
+QUOTED_PATTERN = re.compile(r"`[^`]*`|\"[^\"]*\"|'[^']*'")
+PATH_PATTERN = re.compile(r"\S+\.[a-z]{1,4}(?::\d+)?\b")
+NUMBER_PATTERN = re.compile(r"\b\d+(?:\.\d+)?\b")
+WORD_PATTERN = re.compile(r"[a-z_]+|<\w+>")
+NAME_PART_PATTERN = re.compile(r"[A-Z]?[a-z]+|[A-Z]+(?![a-z])|\d+")
+PRIORITY_ORDER = list(PRIORITY_MAP.values())
+
+
+# Words of a finding's text with what varies between locations of the same issue replaced by
+# placeholders: its function name, quoted code, file paths and numbers
+def normalize_text(text, function_name=""):
+    text = text.lower()
+    if function_name:
+        text = text.replace(function_name.lower(), " <function> ")
+    text = QUOTED_PATTERN.sub(" <code> ", text)
+    text = PATH_PATTERN.sub(" <path> ", text)
+    text = NUMBER_PATTERN.sub(" <number> ", text)
+    return WORD_PATTERN.findall(text)
+
+
+def get_features(feedback_item):
+    words = normalize_text(f"{feedback_item['fail']} {feedback_item['fix']}", feedback_item["function_name"])
+    features = {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(max(1, len(words) - SHINGLE_SIZE + 1))}
+    features.update(f"function:{part.lower()}" for part in NAME_PART_PATTERN.findall(feedback_item["function_name"]))
+    return features
+
+
+def get_feature_hash(feature):
+    return int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest(), "big")
+
+
+class MinHasher:
+    def __init__(self, num_permutations=DEDUP_MINHASH_PERMUTATIONS, seed=MINHASH_SEED):
+        rng = random.Random(seed)
+        self.permutations = [(rng.randrange(1, MINHASH_PRIME), rng.randrange(0, MINHASH_PRIME)) for _ in range(num_permutations)]
+
+    def get_signature(self, features):
+        hashes = [get_feature_hash(feature) for feature in features] or [0]
+        return tuple(min((a * x + b) % MINHASH_PRIME for x in hashes) for a, b in self.permutations)
+
+
+def get_estimated_similarity(signature_a, signature_b):
+    return sum(a == b for a, b in zip(signature_a, signature_b)) / len(signature_a)
+
+
+def find_root(parents, i):
+    while parents[i] != i:
+        parents[i] = parents[parents[i]]
+        i = parents[i]
+    return i
+
+
+# Lists of indices of near-duplicate findings, in order of first appearance
+def get_finding_clusters(feedback_items, similarity=DEDUP_SIMILARITY, num_permutations=DEDUP_MINHASH_PERMUTATIONS, num_bands=DEDUP_LSH_BANDS):
+    minhasher = MinHasher(num_permutations)
+    signatures = [minhasher.get_signature(get_features(item)) for item in feedback_items]
+    rows_per_band = max(1, num_permutations // num_bands)
+
+    parents = list(range(len(feedback_items)))
+    # band bucket -> one finding per cluster seen in it, so a cluster of 80 copies costs 80 comparisons, not 80²
+    buckets = {}
+    for i, signature in enumerate(signatures):
+        for band in range(num_bands):
+            key = (feedback_items[i]["error_category"], band, signature[band * rows_per_band:(band + 1) * rows_per_band])
+            representatives = buckets.setdefault(key, [])
+            clustered = False
+            for j in representatives:
+                root_i, root_j = find_root(parents, i), find_root(parents, j)
+                if root_i == root_j:
+                    clustered = True
+                elif get_estimated_similarity(signatures[i], signatures[j]) >= similarity:
+                    parents[max(root_i, root_j)] = min(root_i, root_j)
+                    clustered = True
+            if not clustered:
+                representatives.append(i)
+
+    clusters = {}
+    for i in range(len(feedback_items)):
+        clusters.setdefault(find_root(parents, i), []).append(i)
+    return list(clusters.values())
+
+
+# One item per cluster: its highest-priority finding, with a "locations" list of every place the
+# issue was reported ({filepath, line_number, function_name}, the item's own location first).
+# Items of a cluster of one are returned as they are.
+def cluster_feedback_items(feedback_items, similarity=DEDUP_SIMILARITY):
+    clustered_items = []
+    for cluster in get_finding_clusters(feedback_items, similarity):
+        if len(cluster) == 1:
+            clustered_items.append(feedback_items[cluster[0]])
+            continue
+        members = sorted((feedback_items[i] for i in cluster), key=lambda item: PRIORITY_ORDER.index(item["priority_score"]))
+        locations = []
+        for item in members:
+            location = {"filepath": item["filepath"], "line_number": item["line_number"], "function_name": item["function_name"]}
+            if location not in locations:
+                locations.append(location)
+        clustered_items.append({**members[0], "locations": locations})
+    return clustered_items
@@ -0,0 +1,258 @@
+import logging
+import os
+import re
+import stat
+import subprocess
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import List, Optional
+
+from reviewme.ailinter.helpers import load_config
+
+############################
+## File enumeration
+############################
+# One listing of the files under the directory scanline runs in, shared by every scope, the
+# demo file picker and the "okay files" report. Files come from the git index
+# (`git ls-files -z`, tracked plus untracked-but-not-ignored) when possible, otherwise from a
+# scandir walk that applies .gitignore files itself. Every file is stat'ed exactly once and
+# the stats are done in parallel. Binary sniffing reads a file's first bytes only when a
+# caller asks.
+
+config = load_config()
+
+EXCLUDE_GLOBS = config['FILE_INDEX_EXCLUDE_GLOBS']
+INCLUDE_GLOBS = config['FILE_INDEX_INCLUDE_GLOBS']
+MAX_FILE_BYTES = config['MAX_FILE_BYTES']
+# git treats a file as binary if it has a NUL byte in its first 8000 bytes
+BINARY_SNIFF_BYTES = 8000
+STAT_BATCH_SIZE = 1024
+MAX_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+
+
+@dataclass
+class FileEntry:
+    # path as the rest of scanline uses it: relative to the listing root, prefixed with it ("./src/app.py")
+    path: str
+    # posix path relative to the listing root, used for glob matching
+    relative_path: str
+    size: int
+    mtime: float
+    _is_binary: Optional[bool] = None
+
+    @property
+    def is_binary(self):
+        if self._is_binary is None:
+            try:
+                with open(self.path, 'rb') as f:
+                    self._is_binary = b"\0" in f.read(BINARY_SNIFF_BYTES)
+            except OSError:
+                self._is_binary = True
+        return self._is_binary
+
+    @property
+    def extension(self):
+        return os.path.splitext(self.path)[1]
+
+
+############################
+## Glob matching (gitignore syntax)
+############################
+
+def glob_to_pattern(pattern):
+    # a pattern without a slash (other than a trailing one) matches at any depth
+    anchored = "/" in pattern.rstrip("/")
+    pattern = pattern.strip("/")
+    result = ""
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith("**/", i):
+            result += "(?:.*/)?"
+            i += 3
+        elif pattern.startswith("**", i):
+            result += ".*"
+            i += 2
+        elif pattern[i] == "*":
+            result += "[^/]*"
+            i += 1
+        elif pattern[i] == "?":
+            result += "[^/]"
+            i += 1
+        elif pattern[i] == "[":
+            end = pattern.find("]", i + 1)
+            if end == -1:
+                result += re.escape(pattern[i])
+                i += 1
+            else:
+                result += "[" + pattern[i + 1:end].replace("!", "^", 1) + "]"
+                i = end + 1
+        else:
+            result += re.escape(pattern[i])
+            i += 1
+    prefix = "" if anchored else "(?:.*/)?"
+    # matching a directory also matches everything inside it
+    return f"{prefix}{result}(?:/.*)?"
+
+def glob_to_regex(pattern):
+    return re.compile(f"^{glob_to_pattern(pattern)}$")
+
+
+# All patterns compiled into one alternation, so a path is matched in a single regex call
+class GlobSet:
+    def __init__(self, patterns):
+        self.regex = re.compile("^(?:" + "|".join(f"(?:{glob_to_pattern(pattern)})" for pattern in patterns) + ")$") if patterns else None
+
+    def matches(self, relative_path):
+        return self.regex is not None and self.regex.match(relative_path) is not None
+
+
+@dataclass
+class GitignoreRule:
+    # directory of the .gitignore, relative to the listing root ("" at the root)
+    base: str
+    regex: re.Pattern
+    negate: bool
+    dir_only: bool
+
+
+def parse_gitignore(path, base):
+    rules = []
+    try:
+        with open(path, 'r', errors='replace') as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return rules
+    for line in lines:
+        line = line.rstrip()
+        if not line or line.startswith("#"):
+            continue
+        negate = line.startswith("!")
+        if negate:
+            line = line[1:]
+        rules.append(GitignoreRule(base=base, regex=glob_to_regex(line), negate=negate, dir_only=line.endswith("/")))
+    return rules
+
+
+# The last matching rule wins, as in git
+def is_gitignored(relative_path, is_dir, rules):
+    ignored = False
+    for rule in rules:
+        if rule.base:
+            if not relative_path.startswith(rule.base + "/"):
+                continue
+            path = relative_path[len(rule.base) + 1:]
+        else:
+            path = relative_path
+        if rule.dir_only and not is_dir:
+            continue
+        if rule.regex.match(path):
+            ignored = not rule.negate
+    return ignored
+
+
+############################
+## Listing
+############################
+
+def list_git_paths(root):
+    try:
+        output = subprocess.run(
+            ["git", "ls-files", "-z", "--cached", "--others", "--exclude-standard"],
+            cwd=root, capture_output=True, check=True,
+        ).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    # a file with unmerged changes is listed once per stage
+    return list(dict.fromkeys(path for path in output.decode('utf-8', errors='surrogateescape').split("\0") if path))
+
+
+def stat_paths(root, relative_paths):
+    entries = []
+    for relative_path in relative_paths:
+        path = os.path.join(root, relative_path)
+        try:
+            file_stat = os.stat(path)
+        except OSError:
+            # deleted from the working tree but still in the index
+            continue
+        if stat.S_ISREG(file_stat.st_mode):
+            entries.append(FileEntry(path=path, relative_path=relative_path, size=file_stat.st_size, mtime=file_stat.st_mtime))
+    return entries
+
+
+def list_git_entries(root, relative_paths):
+    batches = [relative_paths[i:i + STAT_BATCH_SIZE] for i in range(0, len(relative_paths), STAT_BATCH_SIZE)]
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        return [entry for batch in executor.map(lambda batch: stat_paths(root, batch), batches) for entry in batch]
+
+
+# Lists one directory: returns its files and the subdirectories still to walk, with the
+# .gitignore rules that apply inside each
+def scan_directory(root, relative_dir, rules, exclude):
+    directory = os.path.join(root, relative_dir) if relative_dir else root
+    gitignore_path = os.path.join(directory, ".gitignore")
+    if os.path.isfile(gitignore_path):
+        rules = rules + parse_gitignore(gitignore_path, relative_dir)
+
+    entries = []
+    subdirectories = []
+    try:
+        with os.scandir(directory) as scanned:
+            for dir_entry in scanned:
+                relative_path = f"{relative_dir}/{dir_entry.name}" if relative_dir else dir_entry.name
+                try:
+                    if dir_entry.is_dir(follow_symlinks=False):
+                        if dir_entry.name != ".git" and not is_gitignored(relative_path, True, rules) and not exclude.matches(relative_path):
+                            subdirectories.append((relative_path, rules))
+                    elif dir_entry.is_file() and not is_gitignored(relative_path, False, rules) and not exclude.matches(relative_path):
+                        file_stat = dir_entry.stat()
+                        entries.append(FileEntry(path=os.path.join(root, relative_path), relative_path=relative_path, size=file_stat.st_size, mtime=file_stat.st_mtime))
+                except OSError:
+                    continue
+    except OSError as e:
+        logging.debug(f"Skipping unreadable directory {directory}: {e}")
+    return entries, subdirectories
+
+
+# Walks directories in parallel: each finished directory queues its subdirectories
+def walk_entries(root, exclude):
+    entries = []
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        pending = {executor.submit(scan_directory, root, "", [], exclude)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                directory_entries, subdirectories = future.result()
+                entries.extend(directory_entries)
+                for relative_dir, rules in subdirectories:
+                    pending.add(executor.submit(scan_directory, root, relative_dir, rules, exclude))
+    return entries
+
+
+@lru_cache(maxsize=None)
+def _list_files(absolute_root, root, exclude_globs, include_globs, max_file_bytes):
+    exclude = GlobSet(exclude_globs)
+    include = GlobSet(include_globs)
+
+    relative_paths = list_git_paths(root)
+    if relative_paths is not None:
+        entries = list_git_entries(root, [path for path in relative_paths if not exclude.matches(path)])
+    else:
+        entries = walk_entries(root, exclude)
+
+    entries = [
+        entry for entry in entries
+        if entry.size <= max_file_bytes and (not include_globs or include.matches(entry.relative_path))
+    ]
+    entries.sort(key=lambda entry: entry.relative_path)
+    return entries
+
+# Forget the memoized listings, so a long-running process (`scanline daemon`) sees new and deleted files
+def clear_file_list_cache():
+    _list_files.cache_clear()
+
+# Every file under `root` that passes .gitignore, the include/exclude globs and the size cap.
+# Memoized per directory, so all code paths in a run share one listing.
+def list_files(root=".", exclude_globs=tuple(EXCLUDE_GLOBS), include_globs=tuple(INCLUDE_GLOBS), max_file_bytes=MAX_FILE_BYTES) -> List[FileEntry]:
+    return _list_files(os.path.abspath(root), root, tuple(exclude_globs), tuple(include_globs), max_file_bytes)
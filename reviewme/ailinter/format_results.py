@@ -1,3 +1,4 @@
+import json
 import re
 import os
 from collections import defaultdict
@@ -39,55 +40,211 @@ PRIORITY_MAP = {
     "🟡": "🟡 Low"
 }
 
+FEEDBACK_ITEM_FIELDS = ("filepath", "function_name", "line_number", "error_category", "priority", "fail", "fix")
+
+# JSON contract for structured-output mode. Validated by hand in validate_feedback_item.
+FEEDBACK_ITEM_SCHEMA = {
+    "type": "object",
+    "required": ["feedback_items"],
+    "properties": {
+        "feedback_items": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "required": list(FEEDBACK_ITEM_FIELDS),
+                "properties": {
+                    "filepath": {"type": "string"},
+                    "function_name": {"type": "string"},
+                    "line_number": {"type": "integer"},
+                    "error_category": {"type": "string", "enum": list(LIST_OF_ERROR_CATEGORIES.values())},
+                    "priority": {"type": "string", "enum": ["High", "Medium", "Low"]},
+                    "fail": {"type": "string"},
+                    "fix": {"type": "string"},
+                },
+            },
+        },
+    },
+}
+
+# Category and priority lookups by any token the model may use: the emoji or the first word of the name
+def strip_variation_selector(text):
+    return text.replace("\ufe0f", "")
+
+CATEGORY_KEY_BY_TOKEN = {}
+for _key, _name in LIST_OF_ERROR_CATEGORIES.items():
+    CATEGORY_KEY_BY_TOKEN[strip_variation_selector(_key)] = _key
+    CATEGORY_KEY_BY_TOKEN[_name.split()[0].lower()] = _key
+
+PRIORITY_BY_TOKEN = {}
+for _emoji, _fullname in PRIORITY_MAP.items():
+    PRIORITY_BY_TOKEN[_emoji] = _fullname
+    PRIORITY_BY_TOKEN[_fullname.split()[1].lower()] = _fullname
+
+# Precompiled line patterns for the text format, see FEEDBACK_ITEM_FORMAT_TEMPLATE
+# The line number is the last `:L?<digits>` before the closing `**`, so function names can contain `::`;
+# Fail/Fix text may follow the header on the same line
+HEADER_LINE_PATTERN = re.compile(r"^\s*\*\*\s*(?P<location>[^*]*?)\s*:\s*L?(?P<line_number>\d+)(?![^*]*:\s*L?\d)\s*(?P<category>[^*]*?)\s*(?:\*\*\s*(?P<rest>.*))?$")
+INLINE_FIX_PATTERN = re.compile(r"\s+-?\s*Fix:\s*")
+FAIL_LINE_PATTERN = re.compile(r"^\s*(?:\[(?P<priority>[^\]]*)\]\s*)?-?\s*Fail:\s*(?P<fail>.*)$")
+FIX_LINE_PATTERN = re.compile(r"^\s*-?\s*Fix:\s*(?P<fix>.*)$")
+JSON_FENCE_PATTERN = re.compile(r"^\s*```(?:json)?\s*\n(?P<body>.*)\n\s*```\s*$", re.DOTALL)
+TOKEN_PATTERN = re.compile(r"[^\s\[\]()]+")
+
+
+class ParseStats:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.json_responses = 0
+        self.text_responses = 0
+        self.items_parsed = 0
+        self.malformed_items = 0
+        self.unknown_categories = 0
+        self.unknown_priorities = 0
+        # items of a packed response whose filepath matched none of the packed files
+        self.unattributed_items = 0
+
+    def get_summary(self):
+        failures = self.malformed_items + self.unknown_categories + self.unknown_priorities + self.unattributed_items
+        return (
+            f"{self.items_parsed} items parsed from {self.json_responses} JSON and {self.text_responses} text responses, "
+            f"{failures} dropped ({self.malformed_items} malformed, {self.unknown_categories} unknown category, {self.unknown_priorities} unknown priority, "
+            f"{self.unattributed_items} unattributed in packed requests)"
+        )
+
+# Counters for the current run
+PARSE_STATS = ParseStats()
+
+
+def lookup_token(text, table):
+    for token in TOKEN_PATTERN.findall(strip_variation_selector(text)):
+        value = table.get(token) or table.get(token.lower())
+        if value is not None:
+            return value
+    return None
+
+# Returns a normalized feedback item dict, or None (and counts why) if the item can't be used
+def validate_feedback_item(item):
+    if not isinstance(item, dict) or any(item.get(field) is None for field in FEEDBACK_ITEM_FIELDS) or not str(item["line_number"]).strip().isdigit():
+        PARSE_STATS.malformed_items += 1
+        return None
+
+    category_key = lookup_token(str(item["error_category"]), CATEGORY_KEY_BY_TOKEN)
+    if category_key is None:
+        PARSE_STATS.unknown_categories += 1
+        return None
+
+    priority = lookup_token(str(item["priority"]), PRIORITY_BY_TOKEN)
+    if priority is None:
+        PARSE_STATS.unknown_priorities += 1
+        return None
+
+    PARSE_STATS.items_parsed += 1
+    return {
+        "filepath": str(item["filepath"]).strip(),
+        "function_name": str(item["function_name"]).strip(),
+        "line_number": str(item["line_number"]).strip(),
+        "error_category": category_key,
+        "priority_score": priority,
+        "fail": str(item["fail"]).strip(),
+        "fix": str(item["fix"]).strip(),
+    }
+
+# Structured-output responses: {"feedback_items": [...]}, optionally inside a ```json fence. None if not JSON.
+def parse_json_feedback(feedback_string):
+    text = feedback_string.strip()
+    fenced = JSON_FENCE_PATTERN.match(text)
+    if fenced:
+        text = fenced.group("body")
+    if not text.startswith(("{", "[")):
+        return None
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return None
+
+    raw_items = data.get("feedback_items") if isinstance(data, dict) else data
+    if not isinstance(raw_items, list):
+        return None
+    PARSE_STATS.json_responses += 1
+    return raw_items
+
+# Fill the item's fields from one line of its body; returns the field filled last
+def parse_item_line(item, line, last_field):
+    fail = FAIL_LINE_PATTERN.match(line) if "Fail:" in line else None
+    fix = FIX_LINE_PATTERN.match(line) if "Fix:" in line else None
+    if fail:
+        item["priority"] = fail.group("priority") or item["priority"]
+        # `Fail: ... Fix: ...` on one line
+        fail_text, *fix_text = INLINE_FIX_PATTERN.split(fail.group("fail"), maxsplit=1)
+        item["fail"] = fail_text
+        if fix_text:
+            item["fix"] = fix_text[0]
+            return "fix"
+        return "fail"
+    if fix:
+        item["fix"] = fix.group("fix")
+        return "fix"
+    if item["priority"] is None and line.strip().startswith("["):
+        # `[🔴 High]` on its own line, with Fail: on the next one
+        item["priority"] = line.strip().strip("[]")
+    elif last_field is not None and line.strip():
+        item[last_field] += " " + line.strip()
+    return last_field
+
+# Text responses: one pass over the lines. A header line opens an item, Fail/Fix lines fill it,
+# and any other line continues whichever field was filled last. `**` lines that aren't headers
+# are counted as malformed items.
+def parse_text_feedback(feedback_string):
+    PARSE_STATS.text_responses += 1
+    raw_items = []
+    current = None
+    last_field = None
+    for line in feedback_string.split("\n"):
+        is_header_line = line.lstrip().startswith("**")
+        header = HEADER_LINE_PATTERN.match(line) if is_header_line else None
+        if header:
+            filepath, _, function_name = header.group("location").partition(":")
+            current = {
+                "filepath": filepath.strip(),
+                "function_name": function_name.strip(),
+                "line_number": header.group("line_number"),
+                "error_category": header.group("category"),
+                "priority": None,
+                "fail": None,
+                "fix": None,
+            }
+            raw_items.append(current)
+            last_field = parse_item_line(current, header.group("rest"), None) if header.group("rest") else None
+            continue
+        if is_header_line:
+            PARSE_STATS.malformed_items += 1
+            current = None
+            continue
+        if current is None:
+            continue
+        last_field = parse_item_line(current, line, last_field)
+    return raw_items
+
 # Functions
+def parse_feedback(feedback_string):
+    raw_items = parse_json_feedback(feedback_string)
+    if raw_items is None:
+        raw_items = parse_text_feedback(feedback_string)
+    return [item for item in (validate_feedback_item(raw_item) for raw_item in raw_items) if item is not None]
+
 def extract_feedback_items(feedback_string):
-    segments = feedback_string.split("**")[1:]
-    feedback_items = []
-    pattern = r"(.*?):(.*?):(\d+) (.*?)\s+\[(.*?)\] Fail: (.*?)\s+Fix: (.*?)(?=\*\*|$)"
-    
-    for i in range(0, len(segments), 2):
-        if i+1 < len(segments):
-            combined_item = segments[i] + segments[i+1]
-            match = re.match(pattern, combined_item.strip(), re.MULTILINE | re.DOTALL)
-            if match:
-                feedback_items.append(match.groups())
-            
-    return feedback_items
+    return [
+        (item["filepath"], item["function_name"], item["line_number"], item["error_category"], item["priority_score"], item["fail"], item["fix"])
+        for item in parse_feedback(feedback_string)
+    ]
 
 # Function to organize feedback items
 def organize_feedback_items(feedback_list):
     organized_feedback = []
-    
     for feedback_string in feedback_list:
-        items = extract_feedback_items(feedback_string)
-        
-        for item in items:
-            filepath, function_name, line_number, category, priority, fail, fix = item
-            
-            # Convert category to emoji-based key
-            category_key = None
-            for key, value in LIST_OF_ERROR_CATEGORIES.items():
-                # if value.split()[0] in category.upper():
-                if value.split()[0] in category:
-                    category_key = key
-                    break
-            
-            if not category_key:
-                continue
-            
-            # Create a dictionary for each feedback item
-            feedback_item = {
-                "filepath": filepath,
-                "function_name": function_name,
-                "line_number": line_number,
-                "error_category": category_key,
-                "priority_score": priority,
-                "fail": fail,
-                "fix": fix
-            }
-            
-            organized_feedback.append(feedback_item)
-
+        organized_feedback.extend(parse_feedback(feedback_string))
     return organized_feedback
 
 # Function to format feedback for print
@@ -118,10 +275,25 @@ def format_feedback_for_print(organized_feedback, max_items_per_category=MAX_RES
             
             for item in category_feedback[priority_fullname][:max_items_per_category]:
                 filepath, function_name, line_number, fail, fix = item["filepath"], item["function_name"], item["line_number"], item["fail"], item["fix"]
-                result += f"* {filepath}:{line_number} {function_name}\n- Fail: {fail}\n- Fix: {fix}\n\n"
+                result += f"* {filepath}:{line_number} {function_name}\n- Fail: {fail}\n- Fix: {fix}\n"
+                # the other locations of a finding merged by dedup.py
+                other_locations = item.get("locations", [])[1:]
+                if other_locations:
+                    result += "- Also found at: " + ", ".join(f"{location['filepath']}:{location['line_number']}" for location in other_locations) + "\n"
+                result += "\n"
     
     return result
 
+# Function to format one file's feedback as soon as its review completes
+def format_file_feedback_for_stream(file_path, feedback_items):
+    if not feedback_items:
+        return f"\n💚 {file_path}: no issues found\n"
+
+    result = f"\n🔍 {file_path}: {len(feedback_items)} issue{'s' if len(feedback_items) != 1 else ''}\n"
+    for item in feedback_items:
+        result += f"  {item['error_category']} {item['priority_score']} line {item['line_number']} {item['function_name']}\n  - Fail: {item['fail']}\n  - Fix: {item['fix']}\n"
+    return result
+
 def get_files_to_review(organized_feedback):
     files_to_review_set = set()  # Using a set to avoid duplicates
     
@@ -132,17 +304,7 @@ def get_files_to_review(organized_feedback):
     return list(files_to_review_set)
 
 
-# 2. Creating the okay_file_list
-def get_okay_files(directory_path, files_to_review_list):
-    excluded_dirs = ["bin", "lib", "include", "env"]
-    okay_file_list = []
-    
-    # Use os.walk to get all files in the directory
-    for dirpath, dirnames, filenames in os.walk(directory_path):
-        for filename in filenames:
-            full_filepath = os.path.join(dirpath, filename)
-            if full_filepath not in files_to_review_list and full_filepath.endswith(".py"):
-                if not any([excluded_dir in full_filepath for excluded_dir in excluded_dirs]):
-                    okay_file_list.append(full_filepath)
-                
-    return okay_file_list
+# 2. Creating the okay_file_list from the run's file listing (see file_index.list_files)
+def get_okay_files(file_paths, files_to_review_list):
+    files_to_review_set = set(files_to_review_list)
+    return [file_path for file_path in file_paths if file_path.endswith(".py") and file_path not in files_to_review_set]
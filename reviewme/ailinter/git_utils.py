@@ -0,0 +1,257 @@
+import logging
+import os
+import re
+import subprocess
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import List, Optional
+
+############################
+## Git access layer
+############################
+# Every changed file's diff comes out of a single `git diff` stream that is split
+# into per-file FileDiff objects here, instead of forking one git process per file.
+
+HUNK_HEADER_PATTERN = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+C_ESCAPES = {'a': 7, 'b': 8, 't': 9, 'n': 10, 'v': 11, 'f': 12, 'r': 13, '"': 34, '\\': 92}
+
+
+@dataclass
+class Hunk:
+    old_start: int
+    old_count: int
+    new_start: int
+    new_count: int
+    lines: List[str] = field(default_factory=list)
+
+
+@dataclass
+class FileDiff:
+    # absolute path of the file in the working tree (the new path for renames)
+    path: str
+    # repo-relative paths on each side; None for added / deleted files
+    old_path: Optional[str]
+    new_path: Optional[str]
+    # the raw `git diff` text for this file, headers included
+    diff_text: str
+    hunks: List[Hunk] = field(default_factory=list)
+    is_binary: bool = False
+
+    @property
+    def is_new(self):
+        return self.old_path is None
+
+    @property
+    def is_deleted(self):
+        return self.new_path is None
+
+    @property
+    def is_rename(self):
+        return self.old_path is not None and self.new_path is not None and self.old_path != self.new_path
+
+
+def run_git(args, cwd=None, input=None):
+    return subprocess.run(
+        ["git"] + args,
+        cwd=cwd,
+        input=input,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+
+
+@lru_cache(maxsize=None)
+def get_git_root():
+    try:
+        root = run_git(["rev-parse", "--show-toplevel"]).stdout.decode('utf-8').strip()
+    except Exception as e:
+        logging.error(f"Error while getting git root: {e}. Setting root to None")
+        root = None
+
+    return root
+
+
+def get_current_branch():
+    # use git cli to figure out which branch we're on
+    result = run_git(["branch", "--show-current"])
+    branch = result.stdout.decode('utf-8').strip()
+    if result.returncode == 0 and branch:
+        return branch
+    return None
+
+
+def get_main_branch_name():
+    # Get the name of the main branch (either main or master) from local refs, without touching the network.
+    # origin/HEAD is the remote's default branch as of the last clone/fetch
+    result = run_git(["symbolic-ref", "--quiet", "--short", "refs/remotes/origin/HEAD"])
+    default_branch = result.stdout.decode('utf-8').strip()
+    if result.returncode == 0 and default_branch.startswith("origin/"):
+        return default_branch[len("origin/"):]
+
+    result = run_git(["for-each-ref", "--format=%(refname)", "refs/remotes/origin/main", "refs/heads/main"])
+    if result.stdout.strip():
+        return "main"
+    return "master"
+
+
+# Undo git's C-style quoting of unusual paths, e.g. "b/\303\251.py"
+def unquote_git_path(path):
+    if not (len(path) >= 2 and path[0] == '"' and path[-1] == '"'):
+        return path
+
+    raw = bytearray()
+    chars = path[1:-1]
+    i = 0
+    while i < len(chars):
+        char = chars[i]
+        if char != '\\':
+            raw.extend(char.encode('utf-8'))
+            i += 1
+        elif chars[i + 1] in C_ESCAPES:
+            raw.append(C_ESCAPES[chars[i + 1]])
+            i += 2
+        else:
+            raw.append(int(chars[i + 1:i + 4], 8))
+            i += 4
+    return raw.decode('utf-8', errors='replace')
+
+
+def parse_diff_path(value, prefix):
+    # `+++ b/path with space.py\t` has a trailing tab that isn't part of the name
+    value = unquote_git_path(value.rstrip('\t'))
+    if value == "/dev/null":
+        return None
+    return value[len(prefix):] if value.startswith(prefix) else value
+
+
+def parse_header_paths(header):
+    # `diff --git a/P b/P` -- only used when the diff has no ---/+++ lines (binary or mode-only changes)
+    rest = header[len("diff --git "):]
+    if rest.startswith('"'):
+        old, _, new = rest.partition('" ')
+        return parse_diff_path(old + '"', "a/"), parse_diff_path(new, "b/")
+    half = (len(rest) - 1) // 2
+    return parse_diff_path(rest[:half], "a/"), parse_diff_path(rest[half + 1:], "b/")
+
+
+def parse_file_diff(lines, git_root):
+    old_path, new_path = parse_header_paths(lines[0])
+    is_new = is_deleted = is_binary = False
+    hunks = []
+
+    for line in lines[1:]:
+        if line.startswith("@@"):
+            match = HUNK_HEADER_PATTERN.match(line)
+            if match:
+                old_start, old_count, new_start, new_count = match.groups()
+                hunks.append(Hunk(
+                    int(old_start), 1 if old_count is None else int(old_count),
+                    int(new_start), 1 if new_count is None else int(new_count),
+                    [line],
+                ))
+        elif hunks and line.startswith(("+", "-", " ", "\\")):
+            # once hunks start, +/- lines are content, never file headers
+            hunks[-1].lines.append(line)
+        elif line.startswith("--- "):
+            old_path = parse_diff_path(line[4:], "a/")
+        elif line.startswith("+++ "):
+            new_path = parse_diff_path(line[4:], "b/")
+        elif line.startswith("new file mode"):
+            is_new = True
+        elif line.startswith("deleted file mode"):
+            is_deleted = True
+        elif line.startswith("rename from "):
+            old_path = unquote_git_path(line[len("rename from "):])
+        elif line.startswith("rename to "):
+            new_path = unquote_git_path(line[len("rename to "):])
+        elif line.startswith("Binary files"):
+            is_binary = True
+
+    if is_new:
+        old_path = None
+    if is_deleted:
+        new_path = None
+
+    path = os.path.join(git_root, new_path if new_path is not None else old_path)
+    return FileDiff(
+        path=path,
+        old_path=old_path,
+        new_path=new_path,
+        diff_text="\n".join(lines) + "\n",
+        hunks=hunks,
+        is_binary=is_binary,
+    )
+
+
+def split_diff_stream(diff_output):
+    sections = []
+    for line in diff_output.split("\n"):
+        if line.startswith("diff --git "):
+            sections.append([line])
+        elif sections:
+            sections[-1].append(line)
+
+    # drop the empty line left by the stream's trailing newline
+    for section in sections:
+        while section and section[-1] == "":
+            section.pop()
+    return sections
+
+
+# Get every changed file's diff against `target` from one `git diff` call: from `target` to the
+# working tree, or to `new_target` when given (e.g. a commit against its parent).
+# Returns {absolute path: FileDiff}, limited to `extensions` when given.
+def collect_file_diffs(target, extensions=None, include_deleted=False, new_target=None):
+    git_root = get_git_root()
+    result = run_git(
+        ["-c", "core.quotepath=off", "diff", "-z", "--unified=0", "--no-color", "--no-ext-diff",
+         "--src-prefix=a/", "--dst-prefix=b/", target] + ([new_target] if new_target else []) + ["--"],
+        cwd=git_root,
+    )
+    if result.returncode != 0:
+        logging.error(f"git diff against {target} failed: {result.stderr.decode('utf-8', errors='replace').strip()}")
+        return {}
+
+    file_diffs = {}
+    for section in split_diff_stream(result.stdout.decode('utf-8', errors='replace')):
+        file_diff = parse_file_diff(section, git_root)
+        if file_diff.is_deleted and not include_deleted:
+            continue
+        if extensions is not None and os.path.splitext(file_diff.path)[1] not in extensions:
+            continue
+        file_diffs[file_diff.path] = file_diff
+
+    return file_diffs
+
+
+# Contents of `paths` (repo-relative) as of `target`, read by one `git cat-file --batch` call.
+# Returns {path: text}, without the paths that don't exist in `target` or aren't text.
+def get_blob_contents(target, paths, git_root):
+    paths = list(dict.fromkeys(paths))
+    if not paths:
+        return {}
+    result = run_git(["cat-file", "--batch"], cwd=git_root, input="".join(f"{target}:{path}\n" for path in paths).encode('utf-8'))
+    if result.returncode != 0:
+        logging.error(f"git cat-file failed: {result.stderr.decode('utf-8', errors='replace').strip()}")
+        return {}
+
+    contents = {}
+    output = result.stdout
+    position = 0
+    for path in paths:
+        header_end = output.index(b"\n", position)
+        header = output[position:header_end].split()
+        position = header_end + 1
+        # "<object> missing", or "<sha> <type> <size>" followed by the contents and a newline
+        if len(header) != 3:
+            continue
+        size = int(header[2])
+        blob = output[position:position + size]
+        position += size + 1
+        if header[1] != b"blob":
+            continue
+        try:
+            contents[path] = blob.decode('utf-8')
+        except UnicodeDecodeError:
+            pass
+    return contents
@@ -1,29 +1,56 @@
+import asyncio
 import os
-import yaml
-from dotenv import load_dotenv
+from functools import lru_cache
 from pprint import pprint 
-import openai
 
 ################################
 ## Misc Helpers  
 ################################
+# Nothing here runs at import time: the config, the .env file and the openai client are
+# loaded the first time they're needed and then reused, so `scanline --help` and the
+# early exits in the CLI stay fast.
 
-# load the local config.yaml 
+# load the local config.yaml, once per process
+@lru_cache(maxsize=None)
 def load_config():
+    import yaml
     dir_path = os.path.dirname(os.path.realpath(__file__))
     config_path = os.path.join(dir_path, 'config.yaml')
     with open(config_path, 'r') as f:
         return yaml.safe_load(f)
 
-config = load_config()
+# Load .env file, once per process
+@lru_cache(maxsize=None)
+def load_environment():
+  from dotenv import load_dotenv
+  load_dotenv()
 
 ################################
 ## LLMs
 ################################
-# Load .env file
-load_dotenv()
-# ANTRHOPIC_API_KEY = os.getenv('ANTHROPIC_API_KEY')
-openai.api_key = os.getenv("OPENAI_API_KEY")
+
+@lru_cache(maxsize=None)
+def get_openai():
+  import openai
+  load_environment()
+  openai.api_key = os.getenv("OPENAI_API_KEY")
+  return openai
+
+# Raised when the provider rejects a call with a rate limit (HTTP 429), so the caller can back off
+class RateLimitedError(Exception):
+  def __init__(self, message, retry_after=None):
+    super().__init__(message)
+    self.retry_after = retry_after
+
+# Raised when a call doesn't complete within its timeout, so the caller can fail over to another model
+class ProviderTimeoutError(Exception):
+  pass
+
+def get_retry_after(error):
+  try:
+    return float(error.headers.get("retry-after"))
+  except Exception:
+    return None
 
 #######
 ## OpenAI: ChatCompletion
@@ -31,8 +58,9 @@ openai.api_key = os.getenv("OPENAI_API_KEY")
 
 def create_openai_chat_completion (messages, 
                                    model = "gpt-3.5-turbo-16k",
-                                   temperature = config['DEFAULT_TEMPERATURE']): 
-  
+                                   temperature = None): 
+  openai = get_openai()
+  temperature = load_config()['DEFAULT_TEMPERATURE'] if temperature is None else temperature
   try: 
     completion = openai.ChatCompletion.create(
     model=model, 
@@ -40,65 +68,81 @@ def create_openai_chat_completion (messages,
     temperature=temperature,
     )
     return completion.choices[0].message.content
+  except openai.error.RateLimitError as e:
+    raise RateLimitedError(str(e), retry_after=get_retry_after(e)) from e
   except Exception as e:
       print(f"An error occurred: {e}")
   
-def create_simple_openai_chat_completion(
-      system_message, user_message):
-  return create_openai_chat_completion(
-      messages=[
-          {"role": "system",
-              "content": system_message,},
-          {"role": "user","content": user_message,},
-      ],
-  )
-
-
 #######
-## OpenAI: Completion
+## OpenAI: async ChatCompletion over one pooled keep-alive HTTP session
 #######
+_aiohttp_session = None
 
-def create_openai_completion (prompt, 
-                              model = "text-davinci-003", 
-                              temperature = config['DEFAULT_TEMPERATURE']): 
-  
+# All async calls in a run share this session, so TLS/TCP setup is paid once per connection
+# instead of once per file. Must be called from inside the running event loop.
+def get_aiohttp_session(pool_size = None):
+  global _aiohttp_session
+  import aiohttp
+  if _aiohttp_session is None or _aiohttp_session.closed:
+    config = load_config()
+    from reviewme.ailinter.telemetry import get_trace_config
+    connector = aiohttp.TCPConnector(limit = pool_size or config['HTTP_POOL_SIZE'], keepalive_timeout = config['HTTP_KEEPALIVE_SECONDS'])
+    # time to first byte of every request on the session goes into the run telemetry
+    _aiohttp_session = aiohttp.ClientSession(connector = connector, trace_configs = [get_trace_config()])
+  return _aiohttp_session
+
+async def close_aiohttp_session():
+  global _aiohttp_session
+  if _aiohttp_session is not None:
+    await _aiohttp_session.close()
+    _aiohttp_session = None
+
+async def acreate_chat_completion (messages, 
+                                   model = "gpt-3.5-turbo-16k",
+                                   temperature = None,
+                                   base_url = None,
+                                   usage_stats = None,
+                                   response_format = None,
+                                   api_key = None,
+                                   timeout = None): 
+  openai = get_openai()
+  temperature = load_config()['DEFAULT_TEMPERATURE'] if temperature is None else temperature
+  # base_url points the call at any OpenAI-compatible server, e.g. a local mock
+  openai.aiosession.set(get_aiohttp_session())
+  # only sent when set: older models reject the parameter
+  extra_params = {"response_format": response_format} if response_format else {}
+  if api_key is not None:
+    extra_params["api_key"] = api_key
+  if timeout is not None:
+    extra_params["request_timeout"] = timeout
   try: 
-    completion_object = openai.Completion.create(
+    completion = await openai.ChatCompletion.acreate(
     model=model, 
-    prompt=prompt, 
-    temperature=config['DEFAULT_TEMPERATURE'],
+    messages = messages,
+    temperature=temperature,
+    api_base=base_url or get_api_base(),
+    **extra_params,
     )
-    return completion_object.choices[0].text
+    if usage_stats is not None:
+      usage_stats.record(model, completion.get("usage"))
+    return completion.choices[0].message.content
+  except openai.error.RateLimitError as e:
+    raise RateLimitedError(str(e), retry_after=get_retry_after(e)) from e
+  except (openai.error.Timeout, asyncio.TimeoutError) as e:
+    raise ProviderTimeoutError(f"{model} did not respond within {timeout}s") from e
   except Exception as e:
-    print(f"An error occurred: {e}")
-  
-
-################################
-## Anthropic : Completion 
-################################
-
-# def create_anthropic_completion(prompt):
-#   anthropic = Anthropic(
-#       # defaults to os.environ.get("ANTHROPIC_API_KEY")
-#       api_key=ANTRHOPIC_API_KEY,
-#   )
-#   try: 
-#     completion = anthropic.completions.create(
-#     model="claude-2",
-#     prompt=f"{HUMAN_PROMPT}{prompt}{AI_PROMPT}",
-#   )
-#     return completion.completion
-#   except Exception as e:
-#     print(f"An error occurred: {e}")
-  
+      print(f"An error occurred: {e}")
 
-################################
-## LLM MAP 
-################################
+def get_api_base():
+  return os.getenv("OPENAI_API_BASE") or get_openai().api_base
 
-MODEL_MAP = {
-   "text-davinci-003": create_openai_completion,
-   "gpt-4-turbo": create_openai_completion, 
-  #  "claude-2": create_anthropic_completion
-}
+def create_simple_openai_chat_completion(
+      system_message, user_message):
+  return create_openai_chat_completion(
+      messages=[
+          {"role": "system",
+              "content": system_message,},
+          {"role": "user","content": user_message,},
+      ],
+  )
 
@@ -0,0 +1,344 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+from datetime import datetime, timezone
+
+from reviewme.ailinter.ci import PRIORITY_NAMES, get_finding, get_relative_path
+from reviewme.ailinter.git_utils import get_current_branch, run_git
+from reviewme.ailinter.helpers import load_config
+
+############################
+## Review history: every run's findings in one SQLite store
+############################
+# Append-only: a run is a row in `runs` (repo, commit, branch, scope, model, status), every file it
+# reviewed a row in `run_files`, and every finding a row in `findings`, with repo-relative paths.
+# Rows are written in bulk transactions as files finish, so an interrupted run keeps what it found.
+# A finding's fingerprint (repo, file, category, function and issue text, but not the line number)
+# identifies the same issue across runs: diffs between runs and open issues are built on it.
+# An issue is open if it was found by the latest run that reviewed its file.
+
+config = load_config()
+
+REVIEW_HISTORY_PATH = os.path.join(config['SAVED_REVIEWS_DIR'], "scanline-history.sqlite3")
+SAVE_REVIEW_HISTORY = config['SAVE_REVIEW_HISTORY']
+REVIEW_HISTORY_FLUSH_ITEMS = config['REVIEW_HISTORY_FLUSH_ITEMS']
+
+REVIEW_HISTORY_SCHEMA_VERSION = 1
+REVIEW_HISTORY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    repo TEXT NOT NULL,
+    commit_sha TEXT,
+    branch TEXT,
+    scope TEXT,
+    model TEXT,
+    started_at TEXT NOT NULL,
+    finished_at TEXT,
+    -- "running" until the run ends, then "complete" or "incomplete" (failed or unfinished files)
+    status TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS run_files (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    file_path TEXT NOT NULL,
+    PRIMARY KEY (run_id, file_path)
+);
+CREATE TABLE IF NOT EXISTS findings (
+    id INTEGER PRIMARY KEY,
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    file_path TEXT NOT NULL,
+    line_number INTEGER,
+    function_name TEXT,
+    category TEXT NOT NULL,
+    priority TEXT NOT NULL,
+    fail TEXT,
+    fix TEXT,
+    fingerprint TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_repo ON runs(repo, id);
+CREATE INDEX IF NOT EXISTS run_files_file_path ON run_files(file_path, run_id);
+CREATE INDEX IF NOT EXISTS findings_run ON findings(run_id, fingerprint);
+CREATE INDEX IF NOT EXISTS findings_file_path ON findings(file_path);
+CREATE INDEX IF NOT EXISTS findings_category ON findings(category);
+CREATE INDEX IF NOT EXISTS findings_priority ON findings(priority);
+CREATE INDEX IF NOT EXISTS findings_fingerprint ON findings(fingerprint, run_id);
+"""
+
+FINDING_COLUMNS = ("run_id", "file_path", "line_number", "function_name", "category", "priority", "fail", "fix", "fingerprint")
+# "High" first
+PRIORITY_ORDER_SQL = "CASE priority " + " ".join(f"WHEN '{name}' THEN {index}" for index, name in enumerate(PRIORITY_NAMES)) + " END"
+
+
+# The repo a run belongs to: its origin URL, so clones share a history, or else its root directory
+def get_repo_id(git_root):
+    origin_url = run_git(["config", "--get", "remote.origin.url"], cwd=git_root).stdout.decode('utf-8').strip()
+    return origin_url or os.path.abspath(git_root)
+
+
+def get_head_commit(git_root):
+    result = run_git(["rev-parse", "HEAD"], cwd=git_root)
+    return result.stdout.decode('utf-8').strip() if result.returncode == 0 else None
+
+
+def get_fingerprint(repo, finding):
+    issue_text = re.sub(r"\s+", " ", finding["fail"]).strip().lower()
+    payload = json.dumps([repo, finding["path"], finding["category"], finding["function"], issue_text])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32]
+
+
+def get_timestamp():
+    return datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+
+class ReviewHistory:
+    # `check_same_thread=False` lets a threaded server share one connection, behind its own lock
+    def __init__(self, path=REVIEW_HISTORY_PATH, check_same_thread=True):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=check_same_thread)
+        self.connection.row_factory = sqlite3.Row
+        # readers (`scanline history`) don't block a run that is writing
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(REVIEW_HISTORY_SCHEMA)
+        self.connection.execute(f"PRAGMA user_version = {REVIEW_HISTORY_SCHEMA_VERSION}")
+
+    def close(self):
+        self.connection.close()
+
+    ############################
+    ## Writing
+    ############################
+
+    def start_run(self, repo, commit_sha, branch, scope, model):
+        with self.connection:
+            cursor = self.connection.execute(
+                "INSERT INTO runs (repo, commit_sha, branch, scope, model, started_at, status) VALUES (?, ?, ?, ?, ?, ?, 'running')",
+                (repo, commit_sha, branch, scope, model, get_timestamp()),
+            )
+        return cursor.lastrowid
+
+    # One transaction for a batch of reviewed files and their findings
+    def add_results(self, run_id, file_paths, finding_rows):
+        with self.connection:
+            self.connection.executemany("INSERT OR IGNORE INTO run_files (run_id, file_path) VALUES (?, ?)", [(run_id, file_path) for file_path in file_paths])
+            self.connection.executemany(f"INSERT INTO findings ({', '.join(FINDING_COLUMNS)}) VALUES ({', '.join('?' * len(FINDING_COLUMNS))})", finding_rows)
+
+    def finish_run(self, run_id, status):
+        with self.connection:
+            self.connection.execute("UPDATE runs SET finished_at = ?, status = ? WHERE id = ?", (get_timestamp(), status, run_id))
+
+    ############################
+    ## Queries
+    ############################
+
+    # The latest runs of a repo, newest first, with their finding counts by priority and by category
+    def get_runs(self, repo, limit=20):
+        runs = [dict(row) for row in self.connection.execute(
+            f"""
+            SELECT runs.*,
+                (SELECT COUNT(*) FROM run_files WHERE run_files.run_id = runs.id) AS files,
+                COUNT(findings.id) AS findings,
+                {", ".join(f"SUM(findings.priority = '{name}') AS {name.lower()}" for name in PRIORITY_NAMES)}
+            FROM runs LEFT JOIN findings ON findings.run_id = runs.id
+            WHERE runs.repo = ?
+            GROUP BY runs.id
+            ORDER BY runs.id DESC
+            LIMIT ?
+            """,
+            (repo, limit),
+        )]
+        for run in runs:
+            for name in PRIORITY_NAMES:
+                run[name.lower()] = run[name.lower()] or 0
+            run["categories"] = {}
+        runs_by_id = {run["id"]: run for run in runs}
+        if runs_by_id:
+            for row in self.connection.execute(
+                f"SELECT run_id, category, COUNT(*) AS count FROM findings WHERE run_id IN ({', '.join('?' * len(runs_by_id))}) GROUP BY run_id, category",
+                list(runs_by_id),
+            ):
+                runs_by_id[row["run_id"]]["categories"][row["category"]] = row["count"]
+        return runs
+
+    # Ids of the latest `count` finished runs of a repo, oldest first
+    def get_latest_run_ids(self, repo, count=2):
+        rows = self.connection.execute("SELECT id FROM runs WHERE repo = ? AND status != 'running' ORDER BY id DESC LIMIT ?", (repo, count)).fetchall()
+        return [row["id"] for row in reversed(rows)]
+
+    # Findings new in `new_run_id`, and findings of `old_run_id` gone from it. Only files the new
+    # run reviewed count as fixed: a file it didn't look at keeps its issues.
+    def diff_runs(self, old_run_id, new_run_id):
+        new_findings = self.connection.execute(
+            f"""
+            SELECT * FROM findings
+            WHERE run_id = :new AND NOT EXISTS (SELECT 1 FROM findings old WHERE old.run_id = :old AND old.fingerprint = findings.fingerprint)
+            GROUP BY fingerprint
+            ORDER BY {PRIORITY_ORDER_SQL}, file_path, line_number
+            """,
+            {"old": old_run_id, "new": new_run_id},
+        ).fetchall()
+        fixed_findings = self.connection.execute(
+            f"""
+            SELECT * FROM findings
+            WHERE run_id = :old
+                AND EXISTS (SELECT 1 FROM run_files WHERE run_files.run_id = :new AND run_files.file_path = findings.file_path)
+                AND NOT EXISTS (SELECT 1 FROM findings new WHERE new.run_id = :new AND new.fingerprint = findings.fingerprint)
+            GROUP BY fingerprint
+            ORDER BY {PRIORITY_ORDER_SQL}, file_path, line_number
+            """,
+            {"old": old_run_id, "new": new_run_id},
+        ).fetchall()
+        return {"old_run_id": old_run_id, "new_run_id": new_run_id, "new": [dict(row) for row in new_findings], "fixed": [dict(row) for row in fixed_findings]}
+
+    # One page of deduplicated findings and the total number of them, in priority order: the open
+    # issues of a repo (with the run each was first seen in), or the findings of run `run_id`.
+    # `file_path` matches path prefixes, `category` the start of the category name ("Logic", "Security"...).
+    def get_findings(self, repo, run_id=None, file_path=None, category=None, priorities=None, offset=0, limit=None):
+        filters = []
+        params = {"repo": repo, "run_id": run_id, "offset": offset, "limit": -1 if limit is None else limit}
+        if file_path:
+            filters.append("findings.file_path LIKE :file_path ESCAPE '\\'")
+            params["file_path"] = file_path.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        if category:
+            filters.append("findings.category LIKE :category")
+            params["category"] = category + "%"
+        if priorities:
+            filters.append(f"findings.priority IN ({', '.join(f':priority_{i}' for i in range(len(priorities)))})")
+            params.update({f"priority_{i}": priority for i, priority in enumerate(priorities)})
+
+        if run_id is None:
+            findings_sql = f"""
+                WITH latest AS (
+                    SELECT run_files.file_path, MAX(run_files.run_id) AS run_id
+                    FROM run_files JOIN runs ON runs.id = run_files.run_id
+                    WHERE runs.repo = :repo
+                    GROUP BY run_files.file_path
+                )
+                SELECT findings.*, (SELECT MIN(seen.run_id) FROM findings seen WHERE seen.fingerprint = findings.fingerprint) AS first_seen_run_id
+                FROM findings JOIN latest ON latest.file_path = findings.file_path AND latest.run_id = findings.run_id
+                {"WHERE " + " AND ".join(filters) if filters else ""}
+                GROUP BY findings.fingerprint
+            """
+        else:
+            findings_sql = f"""
+                SELECT findings.* FROM findings
+                WHERE {" AND ".join(["findings.run_id = :run_id"] + filters)}
+                GROUP BY findings.fingerprint
+            """
+        total = self.connection.execute(f"SELECT COUNT(*) FROM ({findings_sql})", params).fetchone()[0]
+        rows = self.connection.execute(
+            f"SELECT * FROM ({findings_sql}) ORDER BY {PRIORITY_ORDER_SQL}, file_path, line_number LIMIT :limit OFFSET :offset",
+            params,
+        ).fetchall()
+        return total, [dict(row) for row in rows]
+
+    def get_open_issues(self, repo, file_path=None, category=None, priority=None):
+        return self.get_findings(repo, None, file_path, category, [priority] if priority else None)[1]
+
+    # The repo of the latest run, for browsing the history from outside a repo
+    def get_latest_repo(self):
+        row = self.connection.execute("SELECT repo FROM runs ORDER BY id DESC LIMIT 1").fetchone()
+        return row["repo"] if row else None
+
+
+# Result writer (see ci.py) that records the run in the review history. Findings are buffered and
+# written in one transaction per REVIEW_HISTORY_FLUSH_ITEMS rows, and at the end of the run.
+class HistoryWriter:
+    def __init__(self, history, run_id, repo, root, flush_items=REVIEW_HISTORY_FLUSH_ITEMS):
+        self.history = history
+        self.run_id = run_id
+        self.repo = repo
+        self.root = root
+        self.flush_items = flush_items
+        self.file_paths = []
+        self.finding_rows = []
+        self.finished = False
+
+    def write(self, file_path, feedback_items):
+        relative_path = get_relative_path(file_path, self.root)
+        self.file_paths.append(relative_path)
+        for item in feedback_items:
+            finding = get_finding(item, relative_path)
+            self.finding_rows.append((
+                self.run_id, finding["path"], finding["line"], finding["function"], finding["category"],
+                finding["priority"], finding["fail"], finding["fix"], get_fingerprint(self.repo, finding),
+            ))
+        if len(self.file_paths) + len(self.finding_rows) >= self.flush_items:
+            self.flush()
+
+    def flush(self):
+        if not self.file_paths and not self.finding_rows:
+            return
+        try:
+            self.history.add_results(self.run_id, self.file_paths, self.finding_rows)
+        except sqlite3.Error as e:
+            logging.error(f"Could not save results to the review history {self.history.path}: {e}")
+        self.file_paths = []
+        self.finding_rows = []
+
+    def finish(self, status):
+        if self.finished:
+            return
+        self.finished = True
+        self.flush()
+        try:
+            self.history.finish_run(self.run_id, status)
+        except sqlite3.Error as e:
+            logging.error(f"Could not save results to the review history {self.history.path}: {e}")
+        self.history.close()
+
+    def close(self):
+        self.finish("incomplete")
+
+
+# A HistoryWriter for a new run of the repo at `git_root`, or None when the history is off or can't be opened
+def open_history_writer(git_root, scope, model, path=REVIEW_HISTORY_PATH):
+    if not SAVE_REVIEW_HISTORY or git_root is None:
+        return None
+    repo = get_repo_id(git_root)
+    try:
+        history = ReviewHistory(path)
+        run_id = history.start_run(repo, get_head_commit(git_root), get_current_branch(), scope, model)
+    except sqlite3.Error as e:
+        logging.error(f"Could not open the review history {path}: {e}, this run won't be saved to it")
+        return None
+    return HistoryWriter(history, run_id, repo, git_root)
+
+
+############################
+## Formatting for `scanline history`
+############################
+
+def format_history_runs(runs):
+    if not runs:
+        return "No reviews of this repo in the history yet."
+    result = f"{'Run':>5}  {'Started (UTC)':<19}  {'Scope':<7} {'Model':<18} {'Commit':<8} {'Status':<10} {'Files':>5} {'High':>5} {'Med':>5} {'Low':>5}\n"
+    for run in runs:
+        result += (
+            f"{run['id']:>5}  {run['started_at'][:19].replace('T', ' '):<19}  {run['scope'] or '':<7} {run['model'] or '':<18.18} {(run['commit_sha'] or '')[:8]:<8} "
+            f"{run['status']:<10} {run['files']:>5} {run['high']:>5} {run['medium']:>5} {run['low']:>5}\n"
+        )
+    return result
+
+
+def format_history_finding(finding):
+    return f"[{finding['priority']}] {finding['category']}: {finding['file_path']}:{finding['line_number']} {finding['function_name']}\n\t{finding['fail']}\n\tFix: {finding['fix']}\n"
+
+
+def format_history_diff(diff):
+    result = f"=== Run {diff['old_run_id']} -> run {diff['new_run_id']}: {len(diff['new'])} new, {len(diff['fixed'])} fixed ===\n"
+    for title, findings in (("New", diff["new"]), ("Fixed", diff["fixed"])):
+        if findings:
+            result += f"\n--- {title} ---\n" + "".join(format_history_finding(finding) for finding in findings)
+    return result
+
+
+def format_open_issues(issues):
+    if not issues:
+        return "No open issues."
+    result = f"=== {len(issues)} open issues ===\n"
+    for issue in issues:
+        result += format_history_finding(issue).replace("\n\t", f" (since run {issue['first_seen_run_id']})\n\t", 1)
+    return result
@@ -0,0 +1,328 @@
+import ast
+import logging
+import os
+import re
+import sys
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from reviewme.ailinter.tokenizer import count_tokens
+
+############################
+## Repo import graph for prompt context
+############################
+# Built once per run over the repo's files. Each file is read and parsed at most once
+# (Python with ast, JS/TS and Go with regex resolvers). For a file under review we attach
+# the definitions of the local symbols it imports and the reviewed code actually uses,
+# in order of use, until the token budget runs out.
+
+JS_EXTENSIONS = (".js", ".jsx", ".ts", ".tsx", ".mjs", ".cjs")
+JS_IMPORT_PATTERN = re.compile(
+    r"""import\s+(?:type\s+)?(?:(?P<default>[\w$]+)\s*,?\s*)?(?:\{(?P<named>[^}]*)\}|\*\s+as\s+(?P<namespace>[\w$]+))?\s*from\s*['"](?P<source>[^'"]+)['"]"""
+)
+JS_REQUIRE_PATTERN = re.compile(
+    r"""(?:const|let|var)\s+(?:\{(?P<named>[^}]*)\}|(?P<namespace>[\w$]+))\s*=\s*require\(\s*['"](?P<source>[^'"]+)['"]\s*\)"""
+)
+JS_DEFINITION_PATTERN = re.compile(
+    r"^[ \t]*(?:export\s+)?(?P<default>default\s+)?(?:async\s+)?(?:function\*?\s+(?P<function>[\w$]+)|class\s+(?P<class>[\w$]+)|(?:const|let|var)\s+(?P<variable>[\w$]+)\s*=|(?:interface|type|enum)\s+(?P<type>[\w$]+))",
+    re.MULTILINE,
+)
+GO_IMPORT_BLOCK_PATTERN = re.compile(r"^import\s*\((.*?)\)", re.MULTILINE | re.DOTALL)
+GO_IMPORT_LINE_PATTERN = re.compile(r"^import\s+(?:([\w.]+)\s+)?\"([^\"]+)\"", re.MULTILINE)
+GO_IMPORT_SPEC_PATTERN = re.compile(r"^\s*(?:([\w.]+)\s+)?\"([^\"]+)\"", re.MULTILINE)
+GO_DEFINITION_PATTERN = re.compile(r"^(?:func\s+(?P<function>\w+)\s*[\[(]|type\s+(?P<type>\w+)\b|(?:var|const)\s+(?P<variable>\w+)\b)", re.MULTILINE)
+# Python 3.10+; on older versions standard library imports fall through to the suffix match
+STDLIB_MODULE_NAMES = getattr(sys, "stdlib_module_names", frozenset())
+
+
+@dataclass
+class ImportedModule:
+    # path of the local module/package this import resolves to
+    path: str
+    # local name -> name defined in the target module (from x import a as b -> {"b": "a"})
+    names: Dict[str, str] = field(default_factory=dict)
+    # local alias the whole module is bound to, used as `alias.symbol`
+    alias: Optional[str] = None
+    # Go packages span every file in the directory
+    package_paths: List[str] = field(default_factory=list)
+
+
+@dataclass
+class ParsedFile:
+    imports: List[ImportedModule] = field(default_factory=list)
+    # symbol name -> source text of its definition
+    definitions: Dict[str, str] = field(default_factory=dict)
+    # Python re-exports: name -> ImportedModule it was imported from
+    reexports: Dict[str, ImportedModule] = field(default_factory=dict)
+
+
+def read_source(path):
+    try:
+        with open(path, 'r', encoding='utf-8', errors='replace') as f:
+            return f.read()
+    except OSError as e:
+        logging.debug(f"Could not read {path} for import context: {e}")
+        return None
+
+
+def parse_js_named_imports(named):
+    names = {}
+    for name in named.split(","):
+        name = name.strip()
+        if not name:
+            continue
+        # `a as b` in ES imports, `a: b` in destructured requires
+        parts = re.split(r"\s+as\s+|\s*:\s*", name)
+        names[parts[-1].strip()] = re.sub(r"^type\s+", "", parts[0].strip())
+    return names
+
+
+# Slice from `start` through the brace that closes the first `{` on the definition, or to the end of the line
+def extract_braced_block(source, start):
+    line_end = source.find("\n", start)
+    line_end = len(source) if line_end == -1 else line_end
+    open_brace = source.find("{", start)
+    next_semicolon = source.find(";", start, line_end)
+    if open_brace == -1 or (next_semicolon != -1 and next_semicolon < open_brace) or source.count("\n", start, open_brace) > 3:
+        return source[start:line_end]
+
+    depth = 0
+    for i in range(open_brace, len(source)):
+        if source[i] == "{":
+            depth += 1
+        elif source[i] == "}":
+            depth -= 1
+            if depth == 0:
+                return source[start:i + 1]
+    return source[start:]
+
+
+class ImportGraph:
+    def __init__(self, file_paths, root):
+        self.root = os.path.abspath(root)
+        self.files = {os.path.abspath(path) for path in file_paths}
+        self.parsed = {}
+        self.python_modules = {}
+        self.python_modules_by_leaf = {}
+        for path in self.files:
+            if path.endswith(".py"):
+                self._index_python_module(path)
+        self.go_module = self._read_go_module()
+
+    ############################
+    ## Python
+    ############################
+    def _index_python_module(self, path):
+        relative = os.path.relpath(path, self.root)
+        if relative.startswith(".."):
+            return
+        parts = relative[:-len(".py")].split(os.sep)
+        if parts[-1] == "__init__":
+            parts = parts[:-1]
+        if not parts:
+            return
+        dotted = ".".join(parts)
+        self.python_modules[dotted] = path
+        self.python_modules_by_leaf.setdefault(parts[-1], []).append(dotted)
+
+    # Resolve a dotted module name imported by `path` against the repo: as is, then against the
+    # packages `path` is in (deepest first, like running a script puts its directory on sys.path),
+    # then by suffix to allow for src/ style layouts. Standard library names are only resolved as is,
+    # so `import json` doesn't pull in some local */json.py.
+    def _resolve_python_module(self, dotted, path=None):
+        if dotted in self.python_modules:
+            return self.python_modules[dotted]
+        if dotted.split(".", 1)[0] in STDLIB_MODULE_NAMES:
+            return None
+        if path is not None:
+            package = self._get_python_package(path)
+            for depth in range(len(package), 0, -1):
+                candidate = ".".join(package[:depth] + [dotted])
+                if candidate in self.python_modules:
+                    return self.python_modules[candidate]
+        leaf = dotted.rsplit(".", 1)[-1]
+        for candidate in self.python_modules_by_leaf.get(leaf, []):
+            if candidate.endswith("." + dotted):
+                return self.python_modules[candidate]
+        return None
+
+    def _get_python_package(self, path):
+        relative = os.path.relpath(path, self.root)
+        parts = relative[:-len(".py")].split(os.sep)
+        # a package's __init__ is its own package; a module belongs to its directory's package
+        return parts[:-1]
+
+    def _parse_python(self, path, source):
+        parsed = ParsedFile()
+        try:
+            tree = ast.parse(source)
+        except (SyntaxError, ValueError) as e:
+            logging.debug(f"Could not parse {path} for import context: {e}")
+            return parsed
+
+        lines = source.split("\n")
+        for node in tree.body:
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                start = min([node.lineno] + [decorator.lineno for decorator in node.decorator_list])
+                parsed.definitions[node.name] = "\n".join(lines[start - 1:node.end_lineno])
+            elif isinstance(node, (ast.Assign, ast.AnnAssign)):
+                targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+                for target in targets:
+                    if isinstance(target, ast.Name):
+                        parsed.definitions[target.id] = "\n".join(lines[node.lineno - 1:node.end_lineno])
+
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                for alias in node.names:
+                    target = self._resolve_python_module(alias.name, path)
+                    if target is not None:
+                        # `import a.b` binds `a`, so uses look like `a.b.symbol`
+                        parsed.imports.append(ImportedModule(target, alias=alias.asname or alias.name))
+            elif isinstance(node, ast.ImportFrom):
+                if node.level:
+                    package = self._get_python_package(path)
+                    base = package[:len(package) - (node.level - 1)] if node.level > 1 else package
+                    dotted = ".".join(base + ([node.module] if node.module else []))
+                else:
+                    dotted = node.module or ""
+                target = self._resolve_python_module(dotted, path) if dotted else None
+                names = {}
+                for alias in node.names:
+                    # `from pkg import submodule` imports a module, not a symbol
+                    submodule = self._resolve_python_module(f"{dotted}.{alias.name}" if dotted else alias.name, path)
+                    if submodule is not None:
+                        parsed.imports.append(ImportedModule(submodule, alias=alias.asname or alias.name))
+                    elif alias.name != "*":
+                        names[alias.asname or alias.name] = alias.name
+                if target is not None and names:
+                    imported = ImportedModule(target, names=names)
+                    parsed.imports.append(imported)
+                    for local_name in names:
+                        parsed.reexports[local_name] = imported
+        return parsed
+
+    ############################
+    ## JavaScript / TypeScript
+    ############################
+    def _resolve_js_module(self, path, source):
+        if not source.startswith("."):
+            return None
+        base = os.path.normpath(os.path.join(os.path.dirname(path), source))
+        candidates = [base] + [base + extension for extension in JS_EXTENSIONS] + [os.path.join(base, "index" + extension) for extension in JS_EXTENSIONS]
+        for candidate in candidates:
+            if candidate in self.files:
+                return candidate
+        return None
+
+    def _parse_js(self, path, source):
+        parsed = ParsedFile()
+        for pattern in (JS_IMPORT_PATTERN, JS_REQUIRE_PATTERN):
+            for match in pattern.finditer(source):
+                target = self._resolve_js_module(path, match.group("source"))
+                if target is None:
+                    continue
+                names = parse_js_named_imports(match.group("named") or "")
+                default = match.groupdict().get("default")
+                if default:
+                    names[default] = "default"
+                parsed.imports.append(ImportedModule(target, names=names, alias=match.group("namespace")))
+
+        for match in JS_DEFINITION_PATTERN.finditer(source):
+            name = match.group("function") or match.group("class") or match.group("variable") or match.group("type")
+            block = extract_braced_block(source, match.start())
+            if name:
+                parsed.definitions.setdefault(name, block)
+            if match.group("default"):
+                parsed.definitions.setdefault("default", block)
+        return parsed
+
+    ############################
+    ## Go
+    ############################
+    def _read_go_module(self):
+        source = read_source(os.path.join(self.root, "go.mod"))
+        if source is None:
+            return None
+        match = re.search(r"^module\s+(\S+)", source, re.MULTILINE)
+        return match.group(1) if match else None
+
+    def _parse_go(self, path, source):
+        parsed = ParsedFile()
+        specs = GO_IMPORT_LINE_PATTERN.findall(source)
+        for block in GO_IMPORT_BLOCK_PATTERN.findall(source):
+            specs.extend(GO_IMPORT_SPEC_PATTERN.findall(block))
+
+        for alias, import_path in specs:
+            if self.go_module is None or not import_path.startswith(self.go_module):
+                continue
+            package_dir = os.path.join(self.root, import_path[len(self.go_module):].lstrip("/"))
+            package_paths = sorted(p for p in self.files if os.path.dirname(p) == package_dir and p.endswith(".go") and not p.endswith("_test.go"))
+            if package_paths and alias not in ("_", "."):
+                parsed.imports.append(ImportedModule(package_paths[0], alias=alias or import_path.rsplit("/", 1)[-1], package_paths=package_paths))
+
+        for match in GO_DEFINITION_PATTERN.finditer(source):
+            name = match.group("function") or match.group("type") or match.group("variable")
+            parsed.definitions.setdefault(name, extract_braced_block(source, match.start()))
+        return parsed
+
+    ############################
+    ## Context for a file under review
+    ############################
+    def get_parsed(self, path):
+        path = os.path.abspath(path)
+        if path not in self.parsed:
+            source = read_source(path)
+            if source is None:
+                self.parsed[path] = ParsedFile()
+            elif path.endswith(".py"):
+                self.parsed[path] = self._parse_python(path, source)
+            elif path.endswith(JS_EXTENSIONS):
+                self.parsed[path] = self._parse_js(path, source)
+            elif path.endswith(".go"):
+                self.parsed[path] = self._parse_go(path, source)
+            else:
+                self.parsed[path] = ParsedFile()
+        return self.parsed[path]
+
+    def _find_definition(self, imported, name, depth=0):
+        for path in imported.package_paths or [imported.path]:
+            parsed = self.get_parsed(path)
+            if name in parsed.definitions:
+                return path, parsed.definitions[name]
+            # follow `from .impl import name` re-exports in package __init__ files
+            if name in parsed.reexports and depth < 3:
+                reexported = parsed.reexports[name]
+                return self._find_definition(reexported, reexported.names[name], depth + 1)
+        return None
+
+    # (path, symbol) pairs the reviewed code uses from local imports, in order of first use
+    def get_used_symbols(self, file_path, code):
+        used = []
+        for imported in self.get_parsed(file_path).imports:
+            for local_name, name in imported.names.items():
+                match = re.search(r"(?<![\w$.])" + re.escape(local_name) + r"(?![\w$])", code)
+                if match:
+                    used.append((match.start(), imported, name))
+            if imported.alias:
+                for match in re.finditer(r"(?<![\w$.])" + re.escape(imported.alias) + r"\.([\w$]+)", code):
+                    used.append((match.start(), imported, match.group(1)))
+        used.sort(key=lambda item: item[0])
+        return [(imported, name) for _, imported, name in used]
+
+    def get_import_context(self, file_path, code, token_budget):
+        context = ""
+        used_tokens = 0
+        seen = set()
+        for imported, name in self.get_used_symbols(file_path, code):
+            definition = self._find_definition(imported, name)
+            if definition is None or definition in seen:
+                continue
+            seen.add(definition)
+            path, source = definition
+            snippet = f"# {os.path.relpath(path, self.root)}: {name}\n{source}\n"
+            snippet_tokens = count_tokens(snippet)
+            if used_tokens + snippet_tokens > token_budget:
+                continue
+            context += snippet
+            used_tokens += snippet_tokens
+        return context
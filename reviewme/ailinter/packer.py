@@ -0,0 +1,90 @@
+import posixpath
+
+from reviewme.ailinter.format_results import PARSE_STATS
+from reviewme.ailinter.helpers import load_config
+
+############################
+## Pack small diffs into shared review requests
+############################
+# Commit-sized reviews are mostly diffs of a few lines, and each of them would otherwise pay for
+# the whole static system prompt (instructions + rule guide) in its own request. Small diffs are
+# bin-packed into one request per group, each under a "=== FILE: <path> ===" header, and the
+# feedback is split back per file using the <FILEPATH> of each feedback item.
+
+config = load_config()
+
+PACK_SMALL_DIFFS = config['PACK_SMALL_DIFFS']
+PACK_MAX_DIFF_TOKENS = config['PACK_MAX_DIFF_TOKENS']
+PACK_TOKEN_BUDGET = config['PACK_TOKEN_BUDGET']
+PACK_MAX_FILES = config['PACK_MAX_FILES']
+
+PACKED_FILE_HEADER = "=== FILE: {file_path} ==="
+
+# Goes in the user message ahead of the code, so the system prompt stays the shared cached prefix
+PACKED_REVIEW_INSTRUCTIONS = (
+    "The code below contains {num_files} separate files, each starting with a \"=== FILE: <path> ===\" line. "
+    "Review each file on its own, and use the path from its FILE line as the <FILEPATH> (\"filepath\") of every feedback item about it."
+)
+
+
+def render_packed_code(sections):
+    return "\n\n".join(f"{PACKED_FILE_HEADER.format(file_path=file_path)}\n{code}" for file_path, code in sections)
+
+
+# First-fit decreasing: group item indices so every group stays under `budget` tokens and
+# `max_items` items. Items larger than `max_item_tokens` are left alone. Returns (groups, unpacked indices).
+def get_pack_groups(item_tokens, budget=PACK_TOKEN_BUDGET, max_items=PACK_MAX_FILES, max_item_tokens=PACK_MAX_DIFF_TOKENS):
+    packable = sorted((i for i, tokens in enumerate(item_tokens) if tokens <= max_item_tokens), key=lambda i: item_tokens[i], reverse=True)
+    unpacked = [i for i, tokens in enumerate(item_tokens) if tokens > max_item_tokens]
+
+    groups = []
+    group_tokens = []
+    for i in packable:
+        for group_index, group in enumerate(groups):
+            if len(group) < max_items and group_tokens[group_index] + item_tokens[i] <= budget:
+                group.append(i)
+                group_tokens[group_index] += item_tokens[i]
+                break
+        else:
+            groups.append([i])
+            group_tokens.append(item_tokens[i])
+
+    # a group of one gains nothing from packing
+    unpacked.extend(group[0] for group in groups if len(group) == 1)
+    return [sorted(group) for group in groups if len(group) > 1], sorted(unpacked)
+
+
+def normalize_feedback_path(path):
+    path = str(path).strip().strip("`'\"").replace("\\", "/")
+    if path.startswith(("a/", "b/")):
+        # copied from a "diff --git a/... b/..." header
+        path = path[2:]
+    return posixpath.normpath(path).lstrip("/")
+
+
+# The packed file a reported path refers to: an exact match, or else the only file whose path
+# ends with the reported one (or the other way around), comparing whole path segments
+def match_packed_file(reported_path, normalized_paths):
+    reported_path = normalize_feedback_path(reported_path)
+    if reported_path in normalized_paths:
+        return normalized_paths[reported_path]
+    matches = {
+        file_path for normalized_path, file_path in normalized_paths.items()
+        if normalized_path.endswith("/" + reported_path) or reported_path.endswith("/" + normalized_path)
+    }
+    return matches.pop() if len(matches) == 1 else None
+
+
+# Split the feedback items of a packed response by file. Items that can't be attributed to
+# exactly one packed file are dropped and counted.
+def demultiplex_feedback_items(feedback_items, file_paths):
+    normalized_paths = {normalize_feedback_path(file_path): file_path for file_path in file_paths}
+    feedback_items_by_file = {file_path: [] for file_path in file_paths}
+    for item in feedback_items:
+        file_path = match_packed_file(item["filepath"], normalized_paths)
+        if file_path is None:
+            PARSE_STATS.unattributed_items += 1
+            continue
+        item["filepath"] = file_path
+        feedback_items_by_file[file_path].append(item)
+    return feedback_items_by_file
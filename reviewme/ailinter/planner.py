@@ -0,0 +1,125 @@
+import math
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+from reviewme.ailinter.helpers import load_config
+from reviewme.ailinter.tokenizer import count_message_tokens, is_exact
+
+############################
+## Review planning: tokens, cost and time before anything is sent
+############################
+# The plan counts the prompts that will actually be sent (instructions, rule guide, code and
+# appended imports), not the raw files, so the estimate matches what the provider will bill.
+
+config = load_config()
+
+MODEL_PRICING_1K_TOKENS = config['MODEL_PRICING_1K_TOKENS']
+MODEL_OUTPUT_TOKENS_PER_SECOND = config['MODEL_OUTPUT_TOKENS_PER_SECOND']
+EXPECTED_OUTPUT_TOKENS_PER_REQUEST = config['EXPECTED_OUTPUT_TOKENS_PER_REQUEST']
+REQUEST_OVERHEAD_SECONDS = config['REQUEST_OVERHEAD_SECONDS']
+MAX_FILES_IN_PLAN_REPORT = 25
+
+
+@dataclass
+class ReviewPlan:
+    model: str
+    concurrency: int
+    num_requests: int = 0
+    num_files: int = 0
+    input_tokens_by_file: Dict[str, int] = field(default_factory=dict)
+    # requests per model, when requests are routed to different models
+    requests_by_model: Dict[str, int] = field(default_factory=dict)
+    # input tokens of each request, in request order
+    request_input_tokens: List[int] = field(default_factory=list)
+    input_tokens: int = 0
+    output_tokens: int = 0
+    cost: float = 0.0
+    wall_time_seconds: float = 0.0
+    exact_token_counts: bool = True
+
+
+def get_model_entry(table, model):
+    return table.get(model, table['default'])
+
+
+def estimate_cost(model, input_tokens, output_tokens):
+    pricing = get_model_entry(MODEL_PRICING_1K_TOKENS, model)
+    return input_tokens / 1000 * pricing['input'] + output_tokens / 1000 * pricing['output']
+
+
+def get_request_latency_seconds(model):
+    return REQUEST_OVERHEAD_SECONDS + EXPECTED_OUTPUT_TOKENS_PER_REQUEST / get_model_entry(MODEL_OUTPUT_TOKENS_PER_SECOND, model)
+
+
+# Wall time is bounded by whichever is slowest: the request latency at this concurrency,
+# or any model's requests-per-minute / tokens-per-minute limits
+def estimate_wall_time_seconds(request_models, request_input_tokens, concurrency, rate_limits):
+    if not request_input_tokens:
+        return 0.0
+
+    latencies = [get_request_latency_seconds(model) for model in request_models]
+    if len(set(latencies)) == 1:
+        latency_bound = math.ceil(len(latencies) / max(1, concurrency)) * latencies[0]
+    else:
+        latency_bound = max(sum(latencies) / max(1, concurrency), max(latencies))
+
+    rate_bound = 0.0
+    for model in set(request_models):
+        model_input_tokens = [num_tokens for request_model, num_tokens in zip(request_models, request_input_tokens) if request_model == model]
+        limit = rate_limits.get(model, rate_limits['default'])
+        total_tokens = sum(model_input_tokens) + EXPECTED_OUTPUT_TOKENS_PER_REQUEST * len(model_input_tokens)
+        # the first minute's worth of each bucket is available immediately
+        tokens_bound = max(0.0, total_tokens - limit['tpm']) / limit['tpm'] * 60
+        requests_bound = max(0.0, len(model_input_tokens) - limit['rpm']) / limit['rpm'] * 60
+        rate_bound = max(rate_bound, tokens_bound, requests_bound)
+
+    return max(latency_bound, rate_bound)
+
+
+# `requests` is a list of (file_path, messages, model) for every request the run would send;
+# `model` is the run's default model. `num_files` defaults to the number of distinct file paths
+# (a request packing several files is listed under one label).
+def build_review_plan(requests, model, concurrency, num_files=None):
+    plan = ReviewPlan(model=model, concurrency=concurrency, exact_token_counts=is_exact())
+    request_input_tokens = []
+    request_models = []
+    for file_path, messages, request_model in requests:
+        num_tokens = count_message_tokens(messages)
+        request_input_tokens.append(num_tokens)
+        request_models.append(request_model)
+        plan.input_tokens_by_file[file_path] = plan.input_tokens_by_file.get(file_path, 0) + num_tokens
+        plan.requests_by_model[request_model] = plan.requests_by_model.get(request_model, 0) + 1
+
+    plan.request_input_tokens = request_input_tokens
+    plan.num_requests = len(request_input_tokens)
+    plan.num_files = len(plan.input_tokens_by_file) if num_files is None else num_files
+    plan.input_tokens = sum(request_input_tokens)
+    plan.output_tokens = EXPECTED_OUTPUT_TOKENS_PER_REQUEST * plan.num_requests
+    plan.cost = sum(estimate_cost(request_model, num_tokens, EXPECTED_OUTPUT_TOKENS_PER_REQUEST) for request_model, num_tokens in zip(request_models, request_input_tokens))
+    plan.wall_time_seconds = estimate_wall_time_seconds(request_models, request_input_tokens, concurrency, config['RATE_LIMITS'])
+    return plan
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    return f"{minutes}m {seconds:02d}s" if minutes else f"{seconds}s"
+
+
+def format_review_plan(plan):
+    result = f"\n=== 📋 Review plan: {plan.model}, concurrency {plan.concurrency} ===\n\n"
+
+    files_by_size = sorted(plan.input_tokens_by_file.items(), key=lambda item: item[1], reverse=True)
+    for file_path, num_tokens in files_by_size[:MAX_FILES_IN_PLAN_REPORT]:
+        result += f"{num_tokens:>10,} tokens  {file_path}\n"
+    if len(files_by_size) > MAX_FILES_IN_PLAN_REPORT:
+        result += f"{'':>10}  ... and {len(files_by_size) - MAX_FILES_IN_PLAN_REPORT} more files\n"
+
+    approximate = "" if plan.exact_token_counts else " (approximate, tokenizer vocabulary unavailable)"
+    result += f"\nFiles: {plan.num_files}, requests: {plan.num_requests}\n"
+    if len(plan.requests_by_model) > 1:
+        result += "Requests per model: " + ", ".join(f"{request_model} {num_requests}" for request_model, num_requests in sorted(plan.requests_by_model.items())) + "\n"
+    result += f"Input tokens: {plan.input_tokens:,}{approximate}\n"
+    result += f"Expected output tokens: ~{plan.output_tokens:,}\n"
+    result += f"Projected cost: ${plan.cost:.2f} USD\n"
+    result += f"Projected time: ~{format_duration(plan.wall_time_seconds)}\n"
+    return result
@@ -0,0 +1,78 @@
+import json
+import os
+import sys
+import time
+
+from reviewme.ailinter.planner import format_duration
+
+############################
+## Live progress and streamed results
+############################
+
+class ReviewProgress:
+    def __init__(self, total_files, total_requests, stream=None):
+        self.total_files = total_files
+        self.total_requests = total_requests
+        self.finished_files = 0
+        self.finished_requests = 0
+        self.tokens_used = 0
+        self.started_at = time.monotonic()
+        # looked up per run, so a redirected stdout (--ci writing results to stdout) is honored
+        self.stream = stream or sys.stdout
+        # only redraw a single status line on a terminal; in logs print one line per update
+        self.is_tty = self.stream.isatty()
+        self.line_shown = False
+
+    def get_eta_seconds(self):
+        if self.finished_requests == 0:
+            return None
+        elapsed = time.monotonic() - self.started_at
+        return elapsed / self.finished_requests * (self.total_requests - self.finished_requests)
+
+    def format_line(self):
+        eta = self.get_eta_seconds()
+        eta_text = "--" if eta is None else format_duration(eta)
+        return f"⏳ {self.finished_files}/{self.total_files} files reviewed | {self.tokens_used:,} tokens | ETA {eta_text}"
+
+    def clear(self):
+        if self.is_tty and self.line_shown:
+            self.stream.write("\r\033[K")
+            self.stream.flush()
+            self.line_shown = False
+
+    def render(self):
+        if self.is_tty:
+            self.stream.write("\r\033[K" + self.format_line())
+            self.line_shown = True
+        else:
+            self.stream.write(self.format_line() + "\n")
+        self.stream.flush()
+
+    def request_done(self, num_tokens):
+        self.finished_requests += 1
+        self.tokens_used += num_tokens
+
+    def file_done(self):
+        self.finished_files += 1
+
+    def finish(self):
+        self.clear()
+        elapsed = time.monotonic() - self.started_at
+        self.stream.write(f"✅ {self.finished_files}/{self.total_files} files reviewed in {format_duration(elapsed)}, {self.tokens_used:,} tokens\n")
+        self.stream.flush()
+
+
+# Appends one JSON line per reviewed file as soon as it completes, so partial results survive a long run
+class ResultStreamWriter:
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # start a fresh stream for every run
+        self.file = open(path, 'w')
+
+    def write(self, file_path, feedback_items):
+        self.file.write(json.dumps({"filepath": file_path, "feedback_items": feedback_items}) + "\n")
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
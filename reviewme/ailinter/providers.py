@@ -0,0 +1,234 @@
+import asyncio
+import os
+import re
+from functools import lru_cache
+
+from reviewme.ailinter.file_index import GlobSet
+from reviewme.ailinter.helpers import acreate_chat_completion, get_aiohttp_session, get_api_base, load_config, load_environment, ProviderTimeoutError, RateLimitedError
+
+############################
+## LLM providers, routing and fallback chains
+############################
+# Models are named "<provider>:<model>", e.g. "anthropic:claude-3-5-sonnet-latest" or "local:llama3".
+# A name without a configured provider prefix (including fine-tuned OpenAI names like
+# "ft:gpt-3.5-turbo:org::id") goes to the openai provider. Every provider has the same call
+# signature and reports 429s as RateLimitedError and timeouts as ProviderTimeoutError, so
+# review_code can move a request down its fallback chain whichever provider failed.
+
+config = load_config()
+
+PROVIDERS = config['PROVIDERS']
+DEFAULT_PROVIDER = "openai"
+PROVIDER_TIMEOUT_SECONDS = config['PROVIDER_TIMEOUT_SECONDS']
+FALLBACK_CHAINS = config['FALLBACK_CHAINS']
+FALLBACK_MAX_WAIT_SECONDS = config['FALLBACK_MAX_WAIT_SECONDS']
+MODEL_ROUTES = config['MODEL_ROUTES']
+MODEL_CONTEXT_WINDOWS = config['MODEL_CONTEXT_WINDOWS']
+REVIEW_OUTPUT_TOKENS = config['REVIEW_OUTPUT_TOKENS']
+
+# Extra time a provider gets past its own timeout before the call is cancelled outright
+REQUEST_TIMEOUT_GRACE_SECONDS = 5
+
+ANTHROPIC_API_VERSION = "2023-06-01"
+# Anthropic returns 529 when it is overloaded; treat it like a 429
+ANTHROPIC_RETRYABLE_STATUSES = (429, 529)
+
+
+def split_model_spec(model):
+    provider_name, separator, provider_model = model.partition(":")
+    if separator and provider_name in PROVIDERS:
+        return provider_name, provider_model
+    return DEFAULT_PROVIDER, model
+
+
+def get_api_key(provider_config):
+    api_key_env = provider_config.get('api_key_env')
+    return os.getenv(api_key_env) if api_key_env else None
+
+
+# OpenAI, or any server implementing the OpenAI chat completions API
+class OpenAIProvider:
+    def __init__(self, base_url=None, api_key=None, timeout=PROVIDER_TIMEOUT_SECONDS):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.timeout = timeout
+
+    async def complete(self, messages, model, temperature=None, usage_stats=None, response_format=None, timeout=None):
+        return await acreate_chat_completion(
+            messages, model=model, temperature=temperature, base_url=self.base_url, usage_stats=usage_stats,
+            response_format=response_format, api_key=self.api_key, timeout=timeout or self.timeout,
+        )
+
+
+# Self-hosted OpenAI-compatible server (llama.cpp, vLLM, ...). These usually don't check the key,
+# but the openai client refuses to send a request without one.
+class LocalProvider(OpenAIProvider):
+    def __init__(self, base_url=None, api_key=None, timeout=PROVIDER_TIMEOUT_SECONDS):
+        super().__init__(base_url=base_url, api_key=api_key or "local", timeout=timeout)
+
+
+# Anthropic Messages API, called over the shared aiohttp session
+class AnthropicProvider:
+    def __init__(self, base_url=None, api_key=None, timeout=PROVIDER_TIMEOUT_SECONDS):
+        self.base_url = (base_url or "https://api.anthropic.com/v1").rstrip("/")
+        self.api_key = api_key
+        self.timeout = timeout
+
+    def get_request_body(self, messages, model, temperature):
+        system = "\n\n".join(message["content"] for message in messages if message["role"] == "system")
+        body = {
+            "model": model,
+            "max_tokens": REVIEW_OUTPUT_TOKENS,
+            "temperature": temperature,
+            "messages": [{"role": message["role"], "content": message["content"]} for message in messages if message["role"] != "system"],
+        }
+        if system:
+            # the system prompt is the static prefix shared by every request, so mark it cacheable
+            body["system"] = [{"type": "text", "text": system, "cache_control": {"type": "ephemeral"}}]
+        return body
+
+    # Report usage in the OpenAI shape UsageStats expects
+    @staticmethod
+    def get_openai_usage(usage):
+        cached_tokens = usage.get("cache_read_input_tokens") or 0
+        prompt_tokens = (usage.get("input_tokens") or 0) + cached_tokens + (usage.get("cache_creation_input_tokens") or 0)
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": usage.get("output_tokens") or 0,
+            "prompt_tokens_details": {"cached_tokens": cached_tokens},
+        }
+
+    async def complete(self, messages, model, temperature=None, usage_stats=None, response_format=None, timeout=None):
+        import aiohttp
+        timeout = timeout or self.timeout
+        temperature = config['DEFAULT_TEMPERATURE'] if temperature is None else temperature
+        headers = {
+            "x-api-key": self.api_key or "",
+            "anthropic-version": ANTHROPIC_API_VERSION,
+            "content-type": "application/json",
+        }
+        try:
+            async with get_aiohttp_session().post(
+                f"{self.base_url}/messages", json=self.get_request_body(messages, model, temperature),
+                headers=headers, timeout=aiohttp.ClientTimeout(total=timeout),
+            ) as response:
+                if response.status in ANTHROPIC_RETRYABLE_STATUSES:
+                    retry_after = response.headers.get("retry-after")
+                    raise RateLimitedError(f"{model} returned {response.status}", retry_after=float(retry_after) if retry_after else None)
+                data = await response.json(content_type=None)
+                if response.status != 200:
+                    print(f"An error occurred: {model} returned {response.status}: {data.get('error', data)}")
+                    return None
+        except asyncio.TimeoutError as e:
+            raise ProviderTimeoutError(f"{model} did not respond within {timeout}s") from e
+        except aiohttp.ClientError as e:
+            print(f"An error occurred: {e}")
+            return None
+
+        if usage_stats is not None:
+            usage_stats.record(f"anthropic:{model}", self.get_openai_usage(data.get("usage") or {}))
+        return "".join(block.get("text", "") for block in data.get("content", []) if block.get("type") == "text")
+
+
+PROVIDER_TYPES = {
+    "openai": OpenAIProvider,
+    "local": LocalProvider,
+    "anthropic": AnthropicProvider,
+}
+
+
+# `base_url` overrides the configured one (--base-url applies to the openai provider)
+@lru_cache(maxsize=None)
+def get_provider(provider_name, base_url=None):
+    load_environment()
+    provider_config = PROVIDERS[provider_name]
+    if provider_config['type'] not in PROVIDER_TYPES:
+        raise ValueError(f"Unknown provider type {provider_config['type']} for {provider_name}. Choose one of: {', '.join(PROVIDER_TYPES)}")
+    return PROVIDER_TYPES[provider_config['type']](
+        base_url=base_url or provider_config.get('base_url'),
+        api_key=get_api_key(provider_config),
+        timeout=provider_config.get('timeout_seconds', PROVIDER_TIMEOUT_SECONDS),
+    )
+
+
+# Where requests for `model` are sent, e.g. to tell responses of a local or mock server from the real model's
+def get_model_endpoint(model, base_url=None):
+    provider_name, _ = split_model_spec(model)
+    provider = get_provider(provider_name, base_url if provider_name == DEFAULT_PROVIDER else None)
+    return provider.base_url or get_api_base()
+
+
+# `timeout` overrides the provider's configured one. Providers enforce it on the HTTP call; the
+# call is also cancelled outright shortly after, so a request can never hang a run.
+async def complete_chat(messages, model, temperature=None, base_url=None, usage_stats=None, response_format=None, timeout=None):
+    provider_name, provider_model = split_model_spec(model)
+    provider = get_provider(provider_name, base_url if provider_name == DEFAULT_PROVIDER else None)
+    timeout = timeout or provider.timeout
+    try:
+        return await asyncio.wait_for(
+            provider.complete(messages, provider_model, temperature=temperature, usage_stats=usage_stats, response_format=response_format, timeout=timeout),
+            timeout + REQUEST_TIMEOUT_GRACE_SECONDS,
+        )
+    except asyncio.TimeoutError as e:
+        raise ProviderTimeoutError(f"{model} did not respond within {timeout}s") from e
+
+
+############################
+## Fallback chains
+############################
+
+def get_fallback_chain(model):
+    fallbacks = FALLBACK_CHAINS.get(model, FALLBACK_CHAINS['default'])
+    return [model] + [fallback for fallback in fallbacks if fallback != model]
+
+
+# The first model in the chain that can be called without waiting more than FALLBACK_MAX_WAIT_SECONDS
+# on its rate limiter, skipping models that already failed this request. If every model is that
+# busy, the one that frees up soonest.
+def pick_model(chain, rate_limiter, num_tokens, failed_models=()):
+    candidates = [model for model in chain if model not in failed_models] or chain
+    waits = [(rate_limiter.get_wait_seconds(model, num_tokens), model) for model in candidates]
+    for wait, model in waits:
+        if wait <= FALLBACK_MAX_WAIT_SECONDS:
+            return model
+    return min(waits, key=lambda item: item[0])[1]
+
+
+############################
+## Routing
+############################
+
+class ModelRoute:
+    def __init__(self, route):
+        self.name = route.get('name', route['model'])
+        self.model = route['model']
+        self.min_code_tokens = route.get('min_code_tokens', 0)
+        self.max_code_tokens = route.get('max_code_tokens')
+        self.paths = GlobSet(route['paths']) if route.get('paths') else None
+        self.content_patterns = re.compile("|".join(f"(?:{pattern})" for pattern in route['content_patterns']), re.IGNORECASE) if route.get('content_patterns') else None
+
+    def fits(self, request_tokens):
+        context_window = MODEL_CONTEXT_WINDOWS.get(self.model, MODEL_CONTEXT_WINDOWS['default'])
+        return request_tokens + REVIEW_OUTPUT_TOKENS <= context_window
+
+    def matches(self, file_path, code, code_tokens):
+        if code_tokens < self.min_code_tokens or (self.max_code_tokens is not None and code_tokens > self.max_code_tokens):
+            return False
+        if self.paths is None and self.content_patterns is None:
+            return True
+        relative_path = os.path.relpath(file_path).replace(os.sep, "/")
+        return (self.paths is not None and self.paths.matches(relative_path)) or (self.content_patterns is not None and self.content_patterns.search(code) is not None)
+
+
+@lru_cache(maxsize=None)
+def get_model_routes():
+    return [ModelRoute(route) for route in MODEL_ROUTES]
+
+
+# Model for one request: the first route that matches and whose model can fit the whole request,
+# otherwise `default_model`. Returns (model, route name or None).
+def route_model(default_model, file_path, code, code_tokens, request_tokens):
+    for route in get_model_routes():
+        if route.matches(file_path, code, code_tokens) and route.fits(request_tokens):
+            return route.model, route.name
+    return default_model, None
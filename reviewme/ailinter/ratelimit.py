@@ -0,0 +1,125 @@
+import asyncio
+import random
+import threading
+import time
+import logging
+
+from reviewme.ailinter.helpers import load_config
+
+################################
+## Shared rate limiter
+################################
+# One limiter is shared by every review worker in a run. For each model it keeps
+# two token buckets (requests per minute and tokens per minute) and a shared
+# backoff window that is pushed out whenever any worker gets rate limited.
+
+config = load_config()
+
+DEFAULT_RATE_LIMIT = config['RATE_LIMITS']['default']
+BACKOFF_BASE_SECONDS = config['RATE_LIMIT_BACKOFF']['base_seconds']
+BACKOFF_MAX_SECONDS = config['RATE_LIMIT_BACKOFF']['max_seconds']
+
+
+class TokenBucket:
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.level = self.capacity
+        self.updated_at = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    # Take `amount` from the bucket and return how long the caller must wait for it.
+    # The level is allowed to go negative so that callers are served in reservation order.
+    def reserve(self, amount, now):
+        self.refill(now)
+        amount = min(float(amount), self.capacity)
+        self.level -= amount
+        if self.level >= 0:
+            return 0.0
+        return -self.level / self.rate
+
+    # How long a reservation of `amount` would wait, without making it
+    def peek(self, amount, now):
+        level = min(self.capacity, self.level + (now - self.updated_at) * self.rate) - min(float(amount), self.capacity)
+        return 0.0 if level >= 0 else -level / self.rate
+
+
+class ModelRateLimit:
+    def __init__(self, rpm, tpm):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.backoff_until = 0.0
+        self.backoff_delay = 0.0
+
+
+class RateLimiter:
+    def __init__(self, limits=None):
+        self.limits = limits if limits is not None else config['RATE_LIMITS']
+        self.lock = threading.Lock()
+        self.models = {}
+
+    def _get_model(self, model):
+        if model not in self.models:
+            limit = self.limits.get(model, self.limits.get('default', DEFAULT_RATE_LIMIT))
+            self.models[model] = ModelRateLimit(limit['rpm'], limit['tpm'])
+        return self.models[model]
+
+    # Reserve one request and `num_tokens` tokens for `model`; returns seconds to wait before sending
+    def reserve(self, model, num_tokens):
+        with self.lock:
+            now = time.monotonic()
+            state = self._get_model(model)
+            wait = max(state.requests.reserve(1, now), state.tokens.reserve(num_tokens, now))
+            return max(wait, state.backoff_until - now)
+
+    # Seconds a request would wait right now, used to pick the least busy model of a fallback chain
+    def get_wait_seconds(self, model, num_tokens):
+        with self.lock:
+            now = time.monotonic()
+            state = self._get_model(model)
+            wait = max(state.requests.peek(1, now), state.tokens.peek(num_tokens, now))
+            return max(wait, state.backoff_until - now)
+
+    def acquire(self, model, num_tokens):
+        wait = self.reserve(model, num_tokens)
+        if wait > 0:
+            logging.debug(f"Rate limiter: waiting {wait:.2f}s before calling {model}")
+            time.sleep(wait)
+
+    async def aacquire(self, model, num_tokens):
+        wait = self.reserve(model, num_tokens)
+        if wait > 0:
+            logging.debug(f"Rate limiter: waiting {wait:.2f}s before calling {model}")
+            await asyncio.sleep(wait)
+
+    # Called by any worker that got a 429. Every worker using this model waits out the same window.
+    def report_rate_limited(self, model, retry_after=None):
+        with self.lock:
+            now = time.monotonic()
+            state = self._get_model(model)
+            state.backoff_delay = min(BACKOFF_MAX_SECONDS, max(BACKOFF_BASE_SECONDS, state.backoff_delay * 2))
+            delay = retry_after if retry_after is not None else state.backoff_delay * random.uniform(0.8, 1.2)
+            state.backoff_until = max(state.backoff_until, now + delay)
+            # drain the buckets so queued reservations don't all fire the moment the window ends
+            state.requests.level = min(state.requests.level, 0.0)
+            logging.debug(f"Rate limiter: {model} rate limited, backing off {delay:.2f}s")
+
+    def report_success(self, model):
+        with self.lock:
+            state = self._get_model(model)
+            state.backoff_delay = state.backoff_delay / 2 if state.backoff_delay > BACKOFF_BASE_SECONDS else 0.0
+
+
+_rate_limiter = None
+_rate_limiter_lock = threading.Lock()
+
+# Process-wide limiter shared by all review workers, whether they run on threads or as asyncio tasks
+def get_rate_limiter():
+    global _rate_limiter
+    with _rate_limiter_lock:
+        if _rate_limiter is None:
+            _rate_limiter = RateLimiter()
+        return _rate_limiter
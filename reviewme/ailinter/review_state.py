@@ -0,0 +1,122 @@
+import json
+import logging
+import os
+import subprocess
+
+################################
+## Persistent review state for incremental repo scans
+################################
+# For every reviewed file we remember the git blob SHA of the content that was
+# reviewed and the feedback items parsed from the response. On the next
+# `--scope repo --incremental` run only files whose blob changed are sent to the model;
+# the stored feedback is reused for the rest.
+
+REVIEW_STATE_VERSION = 1
+REVIEW_STATE_FILENAME = "review_state.json"
+
+
+def get_review_state_path():
+    git_dir = subprocess.run(
+        ["git", "rev-parse", "--absolute-git-dir"],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True
+    ).stdout.strip()
+    return os.path.join(git_dir, "scanline", REVIEW_STATE_FILENAME)
+
+
+def load_review_state(path):
+    try:
+        with open(path, 'r') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return {"version": REVIEW_STATE_VERSION, "files": {}}
+
+    if state.get("version") != REVIEW_STATE_VERSION:
+        logging.debug(f"Ignoring review state {path} written by an older version")
+        return {"version": REVIEW_STATE_VERSION, "files": {}}
+    return state
+
+
+def save_review_state(path, state):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+# Map repo-relative path -> blob SHA of the working tree content, from a single `git ls-files -s`.
+# Files modified in the working tree are re-hashed in one `git hash-object` call, since the
+# index SHA would describe the staged content rather than what we're about to review.
+def get_blob_shas(git_root):
+    output = subprocess.run(
+        ["git", "ls-files", "-s", "-z", "--full-name"],
+        cwd=git_root,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    ).stdout.decode('utf-8', errors='replace')
+
+    blob_shas = {}
+    for entry in output.split('\0'):
+        if not entry:
+            continue
+        # <mode> <sha> <stage>\t<path>
+        meta, path = entry.split('\t', 1)
+        blob_shas[path] = meta.split(' ')[1]
+
+    modified = subprocess.run(
+        ["git", "ls-files", "-m", "-z", "--full-name"],
+        cwd=git_root,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    ).stdout.decode('utf-8', errors='replace').split('\0')
+    modified = [path for path in modified if path and os.path.isfile(os.path.join(git_root, path))]
+
+    if modified:
+        hashes = subprocess.run(
+            ["git", "hash-object", "--stdin-paths"],
+            cwd=git_root,
+            input="\n".join(modified) + "\n",
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True
+        ).stdout.split()
+        blob_shas.update(zip(modified, hashes))
+
+    return blob_shas
+
+
+# Split `file_paths` into files that need a fresh review and stored feedback items for the rest.
+# `review_fingerprint` identifies the model/prompt: stored results from a different one are not reused.
+# Files stored as skipped by triage are only carried over while `triage` is on.
+def partition_by_review_state(file_paths, state, blob_shas, git_root, review_fingerprint, triage=True):
+    files_to_review = []
+    carried_over_items = []
+    for file_path in file_paths:
+        repo_path = os.path.relpath(os.path.abspath(file_path), git_root)
+        stored = state["files"].get(repo_path)
+        blob_sha = blob_shas.get(repo_path)
+        if stored is not None and blob_sha is not None and stored["blob"] == blob_sha and stored["fingerprint"] == review_fingerprint and (triage or not stored.get("skipped")):
+            carried_over_items.extend(stored["feedback_items"])
+        else:
+            files_to_review.append(file_path)
+    return files_to_review, carried_over_items
+
+
+# `skipped`: the file was skipped by triage rather than reviewed
+def update_review_state(state, file_path, feedback_items, blob_shas, git_root, review_fingerprint, skipped=False):
+    repo_path = os.path.relpath(os.path.abspath(file_path), git_root)
+    if repo_path not in blob_shas:
+        # untracked files have no blob to compare against next time
+        return
+    state["files"][repo_path] = {
+        "blob": blob_shas[repo_path],
+        "fingerprint": review_fingerprint,
+        "feedback_items": feedback_items,
+        "skipped": skipped,
+    }
+
+
+def prune_review_state(state, blob_shas):
+    state["files"] = {path: stored for path, stored in state["files"].items() if path in blob_shas}
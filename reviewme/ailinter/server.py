@@ -0,0 +1,149 @@
+import json
+import logging
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from reviewme.ailinter.ci import PRIORITY_NAMES
+from reviewme.ailinter.format_results import LIST_OF_ERROR_CATEGORIES, PRIORITY_MAP
+from reviewme.ailinter.git_utils import get_git_root
+from reviewme.ailinter.helpers import load_config
+from reviewme.ailinter.history import REVIEW_HISTORY_PATH, ReviewHistory, get_repo_id
+
+############################
+## `scanline serve`: the web report, backed by the review history
+############################
+# Serves the report page (webapp-test) and a JSON API over the review history (see history.py):
+#  - GET /api/runs: the repo's latest runs, with finding counts
+#  - GET /api/findings?run=<id>|open&priority=High&priority=Medium&category=&file=&offset=&limit=
+#    one page of findings plus the total, so the page only fetches the rows it is about to show
+# The page's data.js is served empty: the findings come from the API instead.
+
+config = load_config()
+
+REVIEW_SERVER_PORT = config['REVIEW_SERVER_PORT']
+WEBAPP_SOURCE_DIR = os.path.join(getattr(sys, '_MEIPASS', os.path.dirname(os.path.abspath(__file__))), 'webapp-test')
+STATIC_FILES = {
+    "/": ("index.html", "text/html; charset=utf-8"),
+    "/index.html": ("index.html", "text/html; charset=utf-8"),
+    "/scripts.js": ("scripts.js", "text/javascript; charset=utf-8"),
+    "/styles.css": ("styles.css", "text/css; charset=utf-8"),
+}
+MAX_PAGE_SIZE = 500
+CATEGORY_KEY_BY_NAME = {name: key for key, name in LIST_OF_ERROR_CATEGORIES.items()}
+PRIORITY_BY_NAME = {fullname.split()[1]: fullname for fullname in PRIORITY_MAP.values()}
+
+
+# A finding with the columns of the report table, as display_and_save_results writes them to data.js
+def get_report_row(finding):
+    category_key = CATEGORY_KEY_BY_NAME.get(finding["category"], "")
+    row = {
+        "Error Category": f"{category_key} {finding['category']}".strip().replace(" Issues", ""),
+        "Priority": PRIORITY_BY_NAME.get(finding["priority"], finding["priority"]),
+        "Filepath": finding["file_path"],
+        "Function Name": finding["function_name"],
+        "Line Number": finding["line_number"],
+        "Issue": finding["fail"],
+        "Suggested Fix": finding["fix"],
+    }
+    if finding.get("first_seen_run_id") is not None:
+        row["First Seen In Run"] = finding["first_seen_run_id"]
+    return row
+
+
+class BadRequest(Exception):
+    pass
+
+
+def get_int_param(params, name, default, minimum=0, maximum=None):
+    try:
+        value = int(params.get(name, [default])[0])
+    except ValueError:
+        raise BadRequest(f"{name} must be an integer")
+    if value < minimum or (maximum is not None and value > maximum):
+        raise BadRequest(f"{name} must be between {minimum} and {maximum}")
+    return value
+
+
+def make_handler(review_history, repo, lock):
+    class ReviewRequestHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            logging.debug(f"scanline serve: {format % args}")
+
+        def send_body(self, status, body, content_type):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("Cache-Control", "no-store")
+            self.end_headers()
+            self.wfile.write(body)
+
+        def send_json(self, status, payload):
+            self.send_body(status, json.dumps(payload).encode('utf-8'), "application/json")
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            params = parse_qs(url.query)
+            try:
+                if url.path == "/api/runs":
+                    with lock:
+                        runs = review_history.get_runs(repo, get_int_param(params, "limit", 50, minimum=1, maximum=MAX_PAGE_SIZE))
+                    self.send_json(200, {"repo": repo, "runs": runs})
+                elif url.path == "/api/findings":
+                    self.send_json(200, self.get_findings_page(params))
+                elif url.path == "/data.js":
+                    self.send_body(200, b"var data = null;", "text/javascript; charset=utf-8")
+                elif url.path in STATIC_FILES:
+                    filename, content_type = STATIC_FILES[url.path]
+                    with open(os.path.join(WEBAPP_SOURCE_DIR, filename), 'rb') as f:
+                        self.send_body(200, f.read(), content_type)
+                else:
+                    self.send_json(404, {"error": f"Not found: {url.path}"})
+            except BadRequest as e:
+                self.send_json(400, {"error": str(e)})
+
+        def get_findings_page(self, params):
+            run = params.get("run", ["open"])[0]
+            if run != "open" and not run.isdigit():
+                raise BadRequest("run must be a run id or \"open\"")
+            priorities = params.get("priority")
+            if priorities and not set(priorities) <= set(PRIORITY_NAMES):
+                raise BadRequest(f"priority must be one of {', '.join(PRIORITY_NAMES)}")
+            offset = get_int_param(params, "offset", 0)
+            limit = get_int_param(params, "limit", 100, minimum=1, maximum=MAX_PAGE_SIZE)
+            with lock:
+                total, findings = review_history.get_findings(
+                    repo, None if run == "open" else int(run), params.get("file", [None])[0], params.get("category", [None])[0],
+                    priorities, offset, limit,
+                )
+            return {"total": total, "offset": offset, "limit": limit, "items": [get_report_row(finding) for finding in findings]}
+
+    return ReviewRequestHandler
+
+
+# Serve the reviews of the current repo (or of the latest reviewed repo outside of one) until Ctrl-C
+def serve_reviews(host="127.0.0.1", port=REVIEW_SERVER_PORT, open_browser=True, history_path=REVIEW_HISTORY_PATH):
+    review_history = ReviewHistory(history_path, check_same_thread=False)
+    git_root = get_git_root()
+    repo = get_repo_id(git_root) if git_root else review_history.get_latest_repo()
+    if repo is None:
+        print("No reviews in the history yet. Run a review first, e.g. scanline --scope commit")
+        review_history.close()
+        return
+
+    server = ThreadingHTTPServer((host, port), make_handler(review_history, repo, threading.Lock()))
+    server.daemon_threads = True
+    url = f"http://{host}:{server.server_address[1]}/"
+    print(f"=== 🌐 Serving the reviews of {repo} at {url} (Ctrl-C to stop) ===")
+    if open_browser:
+        import webbrowser
+        webbrowser.open_new_tab(url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        review_history.close()
@@ -0,0 +1,240 @@
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+############################
+## Run telemetry: stage timings, counters and latency histograms
+############################
+# One RunTelemetry per run (TELEMETRY, reset at the start of `run`), filled in by every stage:
+#  - stages: wall time of file discovery, git, prompt building, the review itself, parsing, rendering...
+#    (stages can nest: "parsing" and "rendering" also happen inside "review")
+#  - histograms: queue wait, rate limiter wait, LLM latency per model, HTTP time to first byte per host
+#  - counters: requests by outcome, retries by reason, fallbacks, cache hits
+#  - token usage, from the `usage` block of every completion (see usage.py)
+# It is written as a JSON run report and optionally in OpenMetrics text format, to tell whether a
+# slow run was spent in git, at the provider, or waiting on rate limits.
+
+LATENCY_BUCKETS_SECONDS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+METRIC_PREFIX = "scanline_"
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS_SECONDS):
+        self.buckets = buckets
+        # counts[i]: observations <= buckets[i] and > buckets[i - 1]; the last one is +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    # Upper bound of the bucket holding the q-quantile (the max for the +Inf bucket)
+    def get_quantile(self, q):
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for bucket, count in zip(self.buckets, self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return min(bucket, self.max)
+        return self.max
+
+    def get_cumulative_counts(self):
+        cumulative = 0
+        result = []
+        for count in self.counts:
+            cumulative += count
+            result.append(cumulative)
+        return result
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "min": self.min,
+            "max": self.max,
+            "p50": self.get_quantile(0.5),
+            "p95": self.get_quantile(0.95),
+            "buckets": {str(bucket): count for bucket, count in zip(list(self.buckets) + ["+Inf"], self.get_cumulative_counts())},
+        }
+
+
+def get_series_key(name, labels):
+    return name, tuple(sorted((labels or {}).items()))
+
+
+class RunTelemetry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self, **info):
+        self.started_at = datetime.now(timezone.utc)
+        self.started_monotonic = time.monotonic()
+        # what was run: scope, model, concurrency...
+        self.info = info
+        self.stages = {}
+        self.counters = {}
+        self.histograms = {}
+        self.usage = None
+
+    def add_stage_time(self, name, seconds):
+        with self.lock:
+            stage = self.stages.setdefault(name, {"seconds": 0.0, "count": 0})
+            stage["seconds"] += seconds
+            stage["count"] += 1
+
+    @contextmanager
+    def stage(self, name):
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage_time(name, time.perf_counter() - started_at)
+
+    def increment(self, name, amount=1, labels=None):
+        key = get_series_key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, value, labels=None):
+        key = get_series_key(name, labels)
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(value)
+
+    def set_usage(self, usage_stats):
+        with usage_stats.lock:
+            self.usage = {
+                "requests": usage_stats.requests,
+                "prompt_tokens": usage_stats.prompt_tokens,
+                "completion_tokens": usage_stats.completion_tokens,
+                "cached_tokens": usage_stats.cached_tokens,
+                "by_model": {model: dict(totals) for model, totals in usage_stats.by_model.items()},
+            }
+
+    # Histograms of one metric merged across its labels
+    def get_merged_histogram(self, name):
+        merged = Histogram()
+        with self.lock:
+            histograms = [histogram for (series_name, _), histogram in self.histograms.items() if series_name == name]
+        for histogram in histograms:
+            merged.counts = [a + b for a, b in zip(merged.counts, histogram.counts)]
+            merged.count += histogram.count
+            merged.sum += histogram.sum
+            merged.min = histogram.min if merged.min is None else min(merged.min, histogram.min)
+            merged.max = histogram.max if merged.max is None else max(merged.max, histogram.max)
+        return merged
+
+    def get_report(self):
+        with self.lock:
+            counters = {}
+            for (name, labels), value in sorted(self.counters.items()):
+                counters.setdefault(name, []).append({"labels": dict(labels), "value": value})
+            histograms = {}
+            for (name, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+                histograms.setdefault(name, []).append({"labels": dict(labels), **histogram.to_dict()})
+            return {
+                "started_at": self.started_at.isoformat(),
+                "wall_seconds": round(time.monotonic() - self.started_monotonic, 6),
+                "info": self.info,
+                "stages": {name: {"seconds": round(stage["seconds"], 6), "count": stage["count"]} for name, stage in self.stages.items()},
+                "counters": counters,
+                "histograms": histograms,
+                "usage": self.usage,
+            }
+
+    def format_summary(self):
+        with self.lock:
+            stages = ", ".join(f"{name} {stage['seconds']:.1f}s" for name, stage in self.stages.items())
+        summary = f"stages: {stages or 'none'}"
+        latency = self.get_merged_histogram("llm_latency_seconds")
+        if latency.count:
+            summary += f". LLM latency p50 ≤{latency.get_quantile(0.5):.1f}s, p95 ≤{latency.get_quantile(0.95):.1f}s over {latency.count} calls"
+        rate_limit_wait = self.get_merged_histogram("rate_limit_wait_seconds")
+        if rate_limit_wait.count:
+            summary += f". Rate limiter wait {rate_limit_wait.sum:.1f}s in total"
+        return summary
+
+    def to_openmetrics(self):
+        lines = []
+        with self.lock:
+            lines.append(f"# TYPE {METRIC_PREFIX}run_seconds gauge")
+            lines.append(f"{METRIC_PREFIX}run_seconds {time.monotonic() - self.started_monotonic:.6f}")
+            lines.append(f"# TYPE {METRIC_PREFIX}stage_seconds counter")
+            for name, stage in self.stages.items():
+                lines.append(f"{METRIC_PREFIX}stage_seconds_total{format_labels({'stage': name})} {stage['seconds']:.6f}")
+
+            for metric_name in sorted({name for name, _ in self.counters}):
+                lines.append(f"# TYPE {METRIC_PREFIX}{metric_name} counter")
+                for (name, labels), value in sorted(self.counters.items()):
+                    if name == metric_name:
+                        lines.append(f"{METRIC_PREFIX}{name}_total{format_labels(dict(labels))} {value}")
+
+            for metric_name in sorted({name for name, _ in self.histograms}):
+                lines.append(f"# TYPE {METRIC_PREFIX}{metric_name} histogram")
+                for (name, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+                    if name != metric_name:
+                        continue
+                    labels = dict(labels)
+                    for bucket, cumulative in zip([repr(float(bucket)) for bucket in histogram.buckets] + ["+Inf"], histogram.get_cumulative_counts()):
+                        lines.append(f"{METRIC_PREFIX}{name}_bucket{format_labels({**labels, 'le': bucket})} {cumulative}")
+                    lines.append(f"{METRIC_PREFIX}{name}_count{format_labels(labels)} {histogram.count}")
+                    lines.append(f"{METRIC_PREFIX}{name}_sum{format_labels(labels)} {histogram.sum:.6f}")
+
+            if self.usage is not None:
+                lines.append(f"# TYPE {METRIC_PREFIX}tokens counter")
+                for model, totals in sorted(self.usage["by_model"].items()):
+                    for kind in ("prompt_tokens", "completion_tokens", "cached_tokens"):
+                        lines.append(f"{METRIC_PREFIX}tokens_total{format_labels({'model': model, 'kind': kind.replace('_tokens', '')})} {totals[kind]}")
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for value in labels.values())
+    return "{" + ",".join(f"{key}=\"{value}\"" for key, value in zip(labels, escaped)) + "}"
+
+
+# Telemetry of the current run
+TELEMETRY = RunTelemetry()
+
+
+def write_run_report(report_path=None, metrics_path=None, telemetry=TELEMETRY):
+    for path, content in ((report_path, lambda: json.dumps(telemetry.get_report(), indent=2)), (metrics_path, telemetry.to_openmetrics)):
+        if not path:
+            continue
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(content())
+
+
+# aiohttp tracing for the shared session: time from sending a request to its response headers
+def get_trace_config(telemetry=TELEMETRY):
+    import aiohttp
+
+    async def on_request_start(session, trace_config_ctx, params):
+        trace_config_ctx.started_at = time.perf_counter()
+
+    async def on_request_end(session, trace_config_ctx, params):
+        telemetry.observe("http_ttfb_seconds", time.perf_counter() - trace_config_ctx.started_at, {"host": params.url.host})
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(on_request_start)
+    trace_config.on_request_end.append(on_request_end)
+    return trace_config
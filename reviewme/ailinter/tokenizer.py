@@ -0,0 +1,91 @@
+import hashlib
+import logging
+import os
+import sys
+from functools import lru_cache
+
+from reviewme.ailinter.helpers import load_config
+
+############################
+## Token counting
+############################
+# Counts tokens with the cl100k_base BPE used by gpt-4 / gpt-3.5-turbo, loaded from the
+# vocabulary file shipped with scanline (tokenizers/, package data) so no network access is
+# needed, or else from tiktoken's own download cache if it has one. If tiktoken or both of
+# those are missing we fall back to the old chars/4 estimate and say so in the plan.
+
+config = load_config()
+
+ESTIMATED_AVG_CHARS_PER_TOKEN = 4
+# Every chat message costs a few tokens of framing, and the reply is primed with 3 more
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_REPLY = 3
+
+# Where tiktoken downloads cl100k_base from, which is also its cache key
+CL100K_VOCAB_URL = "https://openaipublic.blob.core.windows.net/encodings/cl100k_base.tiktoken"
+CL100K_PATTERN = r"""(?i:'s|'t|'re|'ve|'m|'ll|'d)|[^\r\n\p{L}\p{N}]?\p{L}+|\p{N}{1,3}| ?[^\s\p{L}\p{N}]+[\r\n]*|\s*[\r\n]+|\s+(?!\S)|\s+"""
+CL100K_SPECIAL_TOKENS = {
+    "<|endoftext|>": 100257,
+    "<|fim_prefix|>": 100258,
+    "<|fim_middle|>": 100259,
+    "<|fim_suffix|>": 100260,
+    "<|endofprompt|>": 100276,
+}
+
+
+def get_vocab_path():
+    dir_path = getattr(sys, '_MEIPASS', None)
+    if dir_path is not None:
+        return os.path.join(dir_path, 'reviewme/ailinter', config['TOKENIZER_VOCAB'])
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), config['TOKENIZER_VOCAB'])
+
+
+# The file tiktoken.get_encoding("cl100k_base") caches its download in, as tiktoken.load names it
+def get_tiktoken_cache_path():
+    cache_dir = os.environ.get("TIKTOKEN_CACHE_DIR", os.environ.get("DATA_GYM_CACHE_DIR"))
+    if cache_dir is None:
+        import tempfile
+        cache_dir = os.path.join(tempfile.gettempdir(), "data-gym-cache")
+    if not cache_dir:
+        return None
+    return os.path.join(cache_dir, hashlib.sha1(CL100K_VOCAB_URL.encode()).hexdigest())
+
+
+@lru_cache(maxsize=None)
+def get_encoding():
+    try:
+        import tiktoken
+        from tiktoken.load import load_tiktoken_bpe
+    except ImportError:
+        logging.warning("tiktoken is not installed, token counts are estimated at 4 characters per token")
+        return None
+
+    vocab_path = get_vocab_path()
+    if not os.path.isfile(vocab_path):
+        vocab_path = get_tiktoken_cache_path()
+    if vocab_path is None or not os.path.isfile(vocab_path):
+        logging.warning(f"Tokenizer vocabulary {get_vocab_path()} not found, token counts are estimated at 4 characters per token")
+        return None
+
+    return tiktoken.Encoding(
+        name="cl100k_base",
+        pat_str=CL100K_PATTERN,
+        mergeable_ranks=load_tiktoken_bpe(vocab_path),
+        special_tokens=CL100K_SPECIAL_TOKENS,
+    )
+
+
+def is_exact():
+    return get_encoding() is not None
+
+
+def count_tokens(text):
+    encoding = get_encoding()
+    if encoding is None:
+        return len(text) // ESTIMATED_AVG_CHARS_PER_TOKEN + 1
+    # review input is untrusted source code, so special-token text is counted as plain text
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def count_message_tokens(messages):
+    return sum(TOKENS_PER_MESSAGE + count_tokens(message["content"]) for message in messages) + TOKENS_PER_REPLY
@@ -0,0 +1,238 @@
+import ast
+import os
+import re
+from collections import Counter
+from dataclasses import dataclass
+
+from reviewme.ailinter.file_index import GlobSet
+from reviewme.ailinter.git_utils import get_blob_contents
+from reviewme.ailinter.helpers import load_config
+
+############################
+## Triage diffs before they are sent for review
+############################
+# Much of a commit is formatting churn that a model review can't find anything in. Each changed
+# file is triaged locally, from the diff already collected by git_utils, and is either:
+#  - skipped: vendored or generated files, renames / mode changes without content changes,
+#    whitespace-only or comment-only changes, and Python files whose AST is unchanged or only
+#    has its imports reordered
+#  - sent to TRIAGE_CHEAP_MODEL: Python changes that only touch docstrings, and changes of
+#    import lines only
+#  - reviewed in full with the run's model: everything else
+# Whole files (repo scope) are only checked for being vendored or generated.
+
+config = load_config()
+
+TRIAGE_DIFFS = config['TRIAGE_DIFFS']
+TRIAGE_CHEAP_MODEL = config['TRIAGE_CHEAP_MODEL']
+TRIAGE_VENDORED_GLOBS = config['TRIAGE_VENDORED_GLOBS']
+TRIAGE_GENERATED_GLOBS = config['TRIAGE_GENERATED_GLOBS']
+TRIAGE_GENERATED_MARKERS = config['TRIAGE_GENERATED_MARKERS']
+# generated-file markers are only looked for in the first lines of a file
+GENERATED_MARKER_LINES = 10
+
+SKIP = "skip"
+CHEAP = "cheap"
+REVIEW = "review"
+
+LINE_COMMENT_PREFIXES = {
+    ".py": ("#",), ".sh": ("#",), ".bash": ("#",), ".rb": ("#",), ".pl": ("#",), ".pm": ("#",), ".r": ("#",),
+    ".lua": ("--",), ".php": ("//", "#"),
+}
+DEFAULT_LINE_COMMENT_PREFIXES = ("//",)
+IMPORT_LINE_PATTERN = re.compile(r"^\s*(?:import\b|from\s+\S+\s+import\b|#include\b|using\s+[\w.]+\s*;|use\s+[\w:\\{}, ]+;|(?:const|let|var)\s+[\w${}\s,:]+=\s*require\(|require(?:_relative)?\s+['\"]|library\(|package\s+[\w.]+;?\s*$)")
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+@dataclass
+class TriageDecision:
+    # SKIP, CHEAP or REVIEW
+    action: str
+    # why, for the run summary; None when the file is reviewed in full
+    reason: str = None
+
+
+# The (removed lines, added lines) of each run of changed lines between context lines, in order
+def get_changes(file_diff):
+    changes = []
+    for hunk in file_diff.hunks:
+        removed, added = [], []
+        for line in hunk.lines[1:] + [" "]:
+            if line.startswith("-"):
+                removed.append(line[1:])
+            elif line.startswith("+"):
+                added.append(line[1:])
+            elif line.startswith(" ") and (removed or added):
+                changes.append((removed, added))
+                removed, added = [], []
+    return changes
+
+
+def normalize_whitespace(lines):
+    return [WHITESPACE_PATTERN.sub(" ", line).strip() for line in lines if line.strip()]
+
+
+# Same as `git diff -b --ignore-blank-lines` finding nothing: each run of changed lines is the same
+# lines in the same order once runs of whitespace are collapsed. Lines that moved are changes.
+def is_whitespace_only(changes):
+    return all(normalize_whitespace(removed) == normalize_whitespace(added) for removed, added in changes)
+
+
+# Like is_whitespace_only, with the comment lines of each run left out
+def is_comment_only(changes, extension):
+    prefixes = LINE_COMMENT_PREFIXES.get(extension, DEFAULT_LINE_COMMENT_PREFIXES)
+    is_code = lambda line: not line.strip().startswith(prefixes)
+    return is_whitespace_only([([line for line in removed if is_code(line)], [line for line in added if is_code(line)]) for removed, added in changes])
+
+
+def is_import_only(changes):
+    return all(not line.strip() or IMPORT_LINE_PATTERN.match(line) for removed, added in changes for line in removed + added)
+
+
+# Docstrings are the first statement of a module, class or function body: only statements are walked, not expressions
+def strip_docstrings(node):
+    for name in ("body", "orelse", "finalbody", "handlers", "cases"):
+        statements = getattr(node, name, None)
+        if isinstance(statements, list):
+            for statement in statements:
+                strip_docstrings(statement)
+    if isinstance(node, (ast.Module, ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef)) and node.body:
+        first = node.body[0]
+        if isinstance(first, ast.Expr) and isinstance(first.value, ast.Constant) and isinstance(first.value.value, str):
+            node.body = node.body[1:] or [ast.Pass()]
+    return node
+
+
+# Like comparing ast.dump() of both trees, but stops at the first difference and builds no strings
+def is_same_tree(a, b):
+    if type(a) is not type(b):
+        return False
+    if isinstance(a, ast.AST):
+        return all(is_same_tree(getattr(a, name, None), getattr(b, name, None)) for name in a._fields)
+    if isinstance(a, list):
+        return len(a) == len(b) and all(map(is_same_tree, a, b))
+    return a == b
+
+
+# Top-level imports as an unordered multiset (with the names of each import sorted), and the rest of the module
+def split_imports(tree):
+    imports = Counter()
+    body = []
+    for node in tree.body:
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            node.names.sort(key=lambda alias: (alias.name, alias.asname or ""))
+            imports[ast.dump(node)] += 1
+        else:
+            body.append(node)
+    return imports, body
+
+
+# Classify a Python change by comparing the ASTs of both sides; None when they differ in code
+def triage_python_change(old_source, new_source):
+    try:
+        old_tree, new_tree = ast.parse(old_source), ast.parse(new_source)
+    except (SyntaxError, ValueError):
+        return None
+    if is_same_tree(old_tree, new_tree):
+        return TriageDecision(SKIP, "Python AST unchanged (formatting or comments)")
+    (old_imports, old_body), (new_imports, new_body) = split_imports(old_tree), split_imports(new_tree)
+    if old_imports == new_imports and is_same_tree(old_body, new_body):
+        return TriageDecision(SKIP, "imports reordered")
+    if is_same_tree(strip_docstrings(old_tree), strip_docstrings(new_tree)):
+        return TriageDecision(CHEAP, "docstrings changed only")
+    return None
+
+
+def read_head(file_path, num_lines=GENERATED_MARKER_LINES):
+    try:
+        with open(file_path, 'r', errors='replace') as f:
+            return "".join(line for _, line in zip(range(num_lines), f))
+    except OSError:
+        return ""
+
+
+def read_source(file_path):
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            return f.read()
+    except (OSError, UnicodeDecodeError):
+        return None
+
+
+class DiffTriage:
+    def __init__(self, git_root, vendored_globs=TRIAGE_VENDORED_GLOBS, generated_globs=TRIAGE_GENERATED_GLOBS, generated_markers=TRIAGE_GENERATED_MARKERS):
+        self.git_root = git_root
+        self.vendored = GlobSet(vendored_globs)
+        self.generated = GlobSet(generated_globs)
+        self.generated_markers = [marker.lower() for marker in generated_markers]
+
+    def get_path_decision(self, file_path, head):
+        relative_path = os.path.relpath(file_path, self.git_root).replace(os.sep, "/")
+        if self.vendored.matches(relative_path):
+            return TriageDecision(SKIP, "vendored")
+        if self.generated.matches(relative_path):
+            return TriageDecision(SKIP, "generated file")
+        head = head.lower()
+        if any(marker in head for marker in self.generated_markers):
+            return TriageDecision(SKIP, "generated file (header)")
+        return None
+
+    # {file path: TriageDecision} for the diffs of a commit or branch review.
+    # `target`: what the diffs are against, to read the old side of Python files from;
+    # `new_target`: where to read the new side from, when it isn't the working tree
+    def triage_diffs(self, file_diffs, target, new_target=None):
+        decisions = {}
+        python_changes = {}
+        for file_path, file_diff in file_diffs.items():
+            # indentation is code in Python: whitespace and comment changes are told apart by the AST instead
+            is_python_change = file_path.endswith(".py") and file_diff.old_path is not None
+            decision = self.get_path_decision(file_path, read_head(file_path)) or self.triage_diff(file_diff, check_whitespace=not is_python_change)
+            if is_python_change and (decision is None or decision.action == CHEAP):
+                python_changes[file_path] = file_diff
+            decisions[file_path] = decision or TriageDecision(REVIEW)
+
+        # old sides of all the Python files left, from one git process
+        old_sources = get_blob_contents(target, [file_diff.old_path for file_diff in python_changes.values()], self.git_root)
+        new_sources = get_blob_contents(new_target, [file_diff.new_path for file_diff in python_changes.values()], self.git_root) if new_target else {}
+        for file_path, file_diff in python_changes.items():
+            old_source = old_sources.get(file_diff.old_path)
+            new_source = new_sources.get(file_diff.new_path) if new_target else read_source(file_path)
+            if old_source is None or new_source is None:
+                continue
+            decisions[file_path] = triage_python_change(old_source, new_source) or decisions[file_path]
+        return decisions
+
+    def triage_diff(self, file_diff, check_whitespace=True):
+        if file_diff.is_binary:
+            return TriageDecision(SKIP, "binary")
+        if not file_diff.hunks:
+            return TriageDecision(SKIP, "renamed without changes" if file_diff.is_rename else "no content changes")
+        changes = get_changes(file_diff)
+        if check_whitespace and is_whitespace_only(changes):
+            return TriageDecision(SKIP, "whitespace-only changes")
+        if check_whitespace and is_comment_only(changes, os.path.splitext(file_diff.path)[1].lower()):
+            return TriageDecision(SKIP, "comment-only changes")
+        if is_import_only(changes):
+            return TriageDecision(CHEAP, "import changes only")
+        return None
+
+    # {file path: TriageDecision} for whole files (repo scope): only vendored and generated files are skipped
+    def triage_files(self, file_contents):
+        return {
+            file_path: self.get_path_decision(file_path, "".join(content.splitlines(keepends=True)[:GENERATED_MARKER_LINES])) or TriageDecision(REVIEW)
+            for file_path, content in file_contents.items()
+        }
+
+
+def format_triage_summary(decisions):
+    skipped = Counter(decision.reason for decision in decisions.values() if decision.action == SKIP)
+    cheap = Counter(decision.reason for decision in decisions.values() if decision.action == CHEAP)
+    if not skipped and not cheap:
+        return None
+    parts = []
+    if skipped:
+        parts.append(f"skipped {sum(skipped.values())} files (" + ", ".join(f"{count} {reason}" for reason, count in skipped.most_common()) + ")")
+    if cheap:
+        parts.append(f"sent {sum(cheap.values())} to {TRIAGE_CHEAP_MODEL} (" + ", ".join(f"{count} {reason}" for reason, count in cheap.most_common()) + ")")
+    num_reviewed = sum(decision.action == REVIEW for decision in decisions.values())
+    return f"Triage: {', '.join(parts)}, {num_reviewed} reviewed in full"
@@ -0,0 +1,57 @@
+import threading
+
+############################
+## Token usage reported by the provider
+############################
+# Collects the `usage` block of every completion in a run, including how many prompt
+# tokens the provider served from its prompt cache (`prompt_tokens_details.cached_tokens`).
+
+def get_usage_field(usage, *keys):
+    value = usage
+    for key in keys:
+        if value is None:
+            return 0
+        value = value.get(key) if hasattr(value, 'get') else getattr(value, key, None)
+    return value or 0
+
+
+class UsageStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cached_tokens = 0
+        self.by_model = {}
+
+    def record(self, model, usage):
+        if usage is None:
+            return
+        prompt_tokens = get_usage_field(usage, 'prompt_tokens')
+        completion_tokens = get_usage_field(usage, 'completion_tokens')
+        cached_tokens = get_usage_field(usage, 'prompt_tokens_details', 'cached_tokens')
+        with self.lock:
+            self.requests += 1
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            self.cached_tokens += cached_tokens
+            model_totals = self.by_model.setdefault(model, {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0})
+            model_totals["requests"] += 1
+            model_totals["prompt_tokens"] += prompt_tokens
+            model_totals["completion_tokens"] += completion_tokens
+            model_totals["cached_tokens"] += cached_tokens
+
+    def get_cache_hit_rate(self):
+        return self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+
+    def get_summary(self, static_prefix_tokens):
+        if self.requests == 0:
+            return "no completions returned usage"
+        # every request after the first could in principle reuse the static prefix
+        reusable_tokens = static_prefix_tokens * max(0, self.requests - 1)
+        prefix_reuse = self.cached_tokens / reusable_tokens if reusable_tokens else 0.0
+        return (
+            f"{self.requests} requests, {self.prompt_tokens:,} prompt + {self.completion_tokens:,} completion tokens. "
+            f"Provider prompt cache: {self.cached_tokens:,} cached tokens ({self.get_cache_hit_rate():.0%} of prompt tokens, "
+            f"{prefix_reuse:.0%} of the {static_prefix_tokens:,}-token shared prefix reused)"
+        )
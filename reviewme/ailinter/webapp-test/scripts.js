@@ -1,42 +1,192 @@
-console.log("Data loaded from data.js:");
-console.log(data);
+// Both tables are virtualized: rows are fetched a page at a time and only the rows scrolled into
+// view (plus a margin) are in the DOM, so reports with thousands of findings open instantly.
+// A report opened from disk pages through data.js; under `scanline serve` data.js is empty and
+// pages come from the /api/findings endpoint instead.
+const PAGE_SIZE = 200;
+const OVERSCAN_ROWS = 20;
+const DEFAULT_ROW_HEIGHT = 40;
 
 window.addEventListener('load', handleFileSelect);
 
 function handleFileSelect() {
-    populateTable(data);
+    if (typeof data !== 'undefined' && data !== null) {
+        populateTable(data);
+    } else {
+        setUpReviewFilters();
+    }
 }
 
+// The report written by a review: data.js, split by priority
 function populateTable(data) {
-    const headers = Object.keys(data[0]);
+    const highPriorityRows = data.filter((row) => row['Priority'] === '🔴 High');
+    const mediumLowPriorityRows = data.filter((row) => row['Priority'] !== '🔴 High');
+    showTables(createArraySource(highPriorityRows), createArraySource(mediumLowPriorityRows));
+}
+
+function showTables(highPrioritySource, mediumLowPrioritySource) {
+    showVirtualTable('highPriority', highPrioritySource);
+    showVirtualTable('mediumLowPriority', mediumLowPrioritySource);
+}
+
+function showVirtualTable(name, source) {
+    const table = document.getElementById(`${name}Table`);
+    if (table.virtualTable) {
+        // drop the pages still loading for the previous filters
+        table.virtualTable.active = false;
+    }
+    table.virtualTable = new VirtualTable(table, document.getElementById(`${name}Details`), document.getElementById(`${name}Count`), source);
+}
+
+// A source returns one page of rows and the total number of rows: {total, items}
+function createArraySource(rows) {
+    return {
+        fetchPage: (offset, limit) => Promise.resolve({ total: rows.length, items: rows.slice(offset, offset + limit) }),
+    };
+}
+
+function createApiSource(params, priorities) {
+    return {
+        fetchPage: (offset, limit) => {
+            const query = new URLSearchParams(params);
+            priorities.forEach((priority) => query.append('priority', priority));
+            query.set('offset', offset);
+            query.set('limit', limit);
+            return fetch(`/api/findings?${query}`).then((response) => response.json());
+        },
+    };
+}
+
+class VirtualTable {
+    constructor(table, details, count, source) {
+        this.table = table;
+        this.viewport = table.parentElement;
+        this.details = details;
+        this.count = count;
+        this.source = source;
+        this.active = true;
+        // page index -> rows, or the promise of a page that is loading
+        this.pages = new Map();
+        this.total = 0;
+        this.headers = null;
+        this.rowHeight = DEFAULT_ROW_HEIGHT;
+        this.rowHeightMeasured = false;
+
+        table.querySelector('thead').replaceChildren();
+        table.querySelector('tbody').replaceChildren();
+        details.hidden = true;
+        this.viewport.scrollTop = 0;
+        this.viewport.onscroll = () => this.scheduleRender();
+        this.loadPage(0);
+    }
+
+    loadPage(pageIndex) {
+        if (this.pages.has(pageIndex)) {
+            return;
+        }
+        const request = this.source.fetchPage(pageIndex * PAGE_SIZE, PAGE_SIZE).then((page) => {
+            this.total = page.total;
+            this.pages.set(pageIndex, page.items);
+            this.scheduleRender();
+        });
+        this.pages.set(pageIndex, request);
+    }
+
+    getRow(index) {
+        const page = this.pages.get(Math.floor(index / PAGE_SIZE));
+        return Array.isArray(page) ? page[index % PAGE_SIZE] : undefined;
+    }
+
+    scheduleRender() {
+        if (this.renderScheduled) {
+            return;
+        }
+        this.renderScheduled = true;
+        requestAnimationFrame(() => {
+            this.renderScheduled = false;
+            this.render();
+        });
+    }
+
+    render() {
+        if (!this.active) {
+            return;
+        }
+        this.count.textContent = `(${this.total})`;
+        if (this.total === 0) {
+            return;
+        }
+        if (this.headers === null) {
+            this.headers = Object.keys(this.getRow(0));
+            createHeaders(this.headers, this.table);
+        }
 
-    const highPriorityTable = document.getElementById('highPriorityTable');
-    const mediumLowPriorityTable = document.getElementById('mediumLowPriorityTable');
+        const scrollTop = this.viewport.scrollTop;
+        const first = Math.max(0, Math.floor(scrollTop / this.rowHeight) - OVERSCAN_ROWS);
+        const last = Math.min(this.total, Math.ceil((scrollTop + this.viewport.clientHeight) / this.rowHeight) + OVERSCAN_ROWS);
+        for (let pageIndex = Math.floor(first / PAGE_SIZE); pageIndex <= Math.floor((last - 1) / PAGE_SIZE); pageIndex++) {
+            this.loadPage(pageIndex);
+        }
 
-    // Create headers for both tables
-    createHeaders(headers, highPriorityTable);
-    createHeaders(headers, mediumLowPriorityTable);
+        const fragment = document.createDocumentFragment();
+        fragment.appendChild(this.createSpacer(first * this.rowHeight));
+        for (let index = first; index < last; index++) {
+            fragment.appendChild(this.createRow(index, this.getRow(index)));
+        }
+        fragment.appendChild(this.createSpacer((this.total - last) * this.rowHeight));
+        this.table.querySelector('tbody').replaceChildren(fragment);
 
-    // Populate data
-    const highPriorityTbody = highPriorityTable.querySelector('tbody');
-    const mediumLowPriorityTbody = mediumLowPriorityTable.querySelector('tbody');
+        // rows are one line high, but how high depends on the font: measure the first one rendered
+        if (!this.rowHeightMeasured) {
+            const row = this.table.querySelector('tbody tr.finding-row');
+            if (row && row.offsetHeight > 0) {
+                this.rowHeightMeasured = true;
+                if (row.offsetHeight !== this.rowHeight) {
+                    this.rowHeight = row.offsetHeight;
+                    this.render();
+                }
+            }
+        }
+    }
 
-    data.forEach((row) => {
+    createSpacer(height) {
         const tr = document.createElement('tr');
+        tr.className = 'spacer-row';
+        const td = document.createElement('td');
+        td.colSpan = this.headers.length;
+        td.style.height = `${height}px`;
+        tr.appendChild(td);
+        return tr;
+    }
 
-        headers.forEach((header) => {
+    createRow(index, row) {
+        const tr = document.createElement('tr');
+        tr.className = index % 2 ? 'finding-row alt-row' : 'finding-row';
+        this.headers.forEach((header) => {
             const td = document.createElement('td');
-            td.textContent = row[header];
+            // placeholder while the row's page is loading
+            td.textContent = row ? row[header] : '…';
+            td.title = td.textContent;
             tr.appendChild(td);
         });
-
-        // Add row to the appropriate table based on priority
-        if (row['Priority'] === '🔴 High') {
-            highPriorityTbody.appendChild(tr);
-        } else {
-            mediumLowPriorityTbody.appendChild(tr);
+        if (row) {
+            tr.addEventListener('click', () => this.showDetails(row));
         }
-    });
+        return tr;
+    }
+
+    // Cells are cut to one line: the full issue and fix of a clicked row show below the table
+    showDetails(row) {
+        this.details.replaceChildren();
+        this.headers.forEach((header) => {
+            const line = document.createElement('p');
+            const label = document.createElement('strong');
+            label.textContent = `${header}: `;
+            line.appendChild(label);
+            line.appendChild(document.createTextNode(row[header]));
+            this.details.appendChild(line);
+        });
+        this.details.hidden = false;
+    }
 }
 
 function createHeaders(headers, table) {
@@ -52,4 +202,41 @@ function createHeaders(headers, table) {
     thead.appendChild(headerRow);
 }
 
-console.log("Hello World!")
\ No newline at end of file
+// `scanline serve`: pick a review from the history, or the open issues across reviews
+function setUpReviewFilters() {
+    const filters = document.getElementById('reviewFilters');
+    const runSelect = document.getElementById('runSelect');
+    const pathFilter = document.getElementById('pathFilter');
+    filters.hidden = false;
+
+    fetch('/api/runs').then((response) => response.json()).then(({ runs }) => {
+        runs.forEach((run) => {
+            const option = document.createElement('option');
+            option.value = run.id;
+            option.textContent = `Run ${run.id}: ${run.scope} on ${run.started_at.slice(0, 16).replace('T', ' ')} UTC, ${run.findings} findings`;
+            runSelect.appendChild(option);
+        });
+        const openIssues = document.createElement('option');
+        openIssues.value = 'open';
+        openIssues.textContent = 'Open issues across reviews';
+        runSelect.appendChild(openIssues);
+        runSelect.value = runs.length ? runs[0].id : 'open';
+
+        let filterTimeout = null;
+        runSelect.addEventListener('change', showReviewFromApi);
+        pathFilter.addEventListener('input', () => {
+            clearTimeout(filterTimeout);
+            filterTimeout = setTimeout(showReviewFromApi, 300);
+        });
+        showReviewFromApi();
+    });
+}
+
+function showReviewFromApi() {
+    const params = new URLSearchParams({ run: document.getElementById('runSelect').value });
+    const path = document.getElementById('pathFilter').value.trim();
+    if (path) {
+        params.set('file', path);
+    }
+    showTables(createApiSource(params, ['High']), createApiSource(params, ['Medium', 'Low']));
+}
@@ -1,42 +1,235 @@
 #!/usr/bin/env python3
-from reviewme.ailinter import ailinter 
 import click
 import logging
 from click_default_group import DefaultGroup
 import os
+import sys
+from contextlib import nullcontext, redirect_stdout
+
+from reviewme.ailinter.git_utils import get_current_branch, get_git_root
+from reviewme.ailinter.helpers import load_config, load_environment
 
 logging.basicConfig(level=logging.DEBUG)
 
+# Only the config is needed to build the options. The review pipeline (openai, aiohttp, the
+# tokenizer, the rule guide) is imported inside the commands, after arguments are parsed.
+config = load_config()
+
 @click.group(cls=DefaultGroup, default='run', default_if_no_args=True)
 def cli():
-    print("Booting up code review process... ")
+    # on stderr, so `--ci --jsonl -` / `--sarif -` leave stdout to the results
+    click.echo("Booting up code review process... ", err=True)
     pass
 
+# Print why the run can't start. Under --ci this fails the job, so a misconfigured pipeline doesn't pass silently.
+def exit_early(message, ci):
+    click.echo(message, err=ci)
+    if ci:
+        from reviewme.ailinter.ci import EXIT_REFUSED
+        sys.exit(EXIT_REFUSED)
+
+def get_missing_api_key_message(model):
+    from reviewme.ailinter.providers import PROVIDERS, split_model_spec
+    api_key_env = PROVIDERS[split_model_spec(model)[0]].get('api_key_env')
+    if api_key_env and os.environ.get(api_key_env) == None:
+        return "👨🏻‍💻 An {0} was not found. Please set it in your .bashrc or in this terminal session via \'export {0}=*****\' and try scanline again.".format(api_key_env)
+    return None
+
 @cli.command()
 @click.option('--scope', default="demo", help='Scope of code review. Can be "commit", "branch", "repo", or "demo". Defaults to "demo"')
 @click.option('--file', default="", help='Select a specific file to review. Defaults to all files in scope.')
-@click.option('--model', default="gpt-4", help='Specify openai model to use listed @ https://platform.openai.com/docs/models/overview. For example gpt-4-32k supports 4x larger files whereas gpt-3.5-turbo should be faster and >10x cheaper. Defaults to gpt-4.')
-def run(scope, file, model):
-    branch = ailinter.get_current_branch()
-    if branch == None:
-        print ("👨🏻‍💻 You are not in a git repo. Please run this command in a git repo.")
+@click.option('--model', default="gpt-4", help='Specify openai model to use listed @ https://platform.openai.com/docs/models/overview. For example gpt-4-32k supports 4x larger files whereas gpt-3.5-turbo should be faster and >10x cheaper. Other providers are named "<provider>:<model>", e.g. anthropic:claude-3-5-sonnet-latest or local:llama3 (see PROVIDERS in config.yaml). Defaults to gpt-4.')
+@click.option('--concurrency', default=config['DEFAULT_CONCURRENCY'], type=int, help='Number of files to review at the same time. Requests are paced by a shared per-model rate limiter. Defaults to {0}.'.format(config['DEFAULT_CONCURRENCY']))
+@click.option('--base-url', default=None, help='Base URL of an OpenAI-compatible API to send reviews to, e.g. a local mock server. Defaults to $OPENAI_API_BASE or the OpenAI API.')
+@click.option('--no-cache', is_flag=True, default=False, help='Always send files to the model, ignoring previously cached reviews of identical code.')
+@click.option('--incremental', is_flag=True, default=False, help='With --scope repo, only review files that changed since the last saved repo review and reuse the saved results for the rest.')
+@click.option('--plan-only', is_flag=True, default=False, help='Print the token, cost and time plan for this review and exit without calling the model.')
+@click.option('--batch', is_flag=True, default=False, help='Submit all reviews as one batch job (cheaper, not interactive). The run can be resumed with "scanline resume-batch".')
+@click.option('--batch-backend', default=config['BATCH_BACKEND'], type=click.Choice(['openai', 'local']), help='Where --batch runs go: the OpenAI Batch API, or "local" to run the batch file against --base-url. Defaults to {0}.'.format(config['BATCH_BACKEND']))
+@click.option('--feedback-format', default=config['FEEDBACK_FORMAT'], type=click.Choice(['json', 'text']), help='Ask the model for feedback as schema-validated JSON, or in the plain text format. Text is also parsed as a fallback in JSON mode. Defaults to {0}.'.format(config['FEEDBACK_FORMAT']))
+@click.option('--route', is_flag=True, default=False, help='Pick the model for each request with MODEL_ROUTES in config.yaml (e.g. small diffs to a cheap model, security-sensitive files to a stronger one). --model is used for requests no route matches.')
+@click.option('--no-pack', is_flag=True, default=False, help='In commit and branch scope, send every small diff in its own request instead of packing several into one (see PACK_* in config.yaml).')
+@click.option('--no-triage', is_flag=True, default=False, help='Send every changed file for review, including whitespace/comment-only changes and vendored or generated files (see TRIAGE_* in config.yaml).')
+@click.option('--request-timeout', default=None, type=float, help='Seconds a single model request may take before it is aborted and retried on the next model of its fallback chain. Defaults to PROVIDER_TIMEOUT_SECONDS ({0}s) or the provider\'s own timeout_seconds in config.yaml.'.format(config['PROVIDER_TIMEOUT_SECONDS']))
+@click.option('--deadline', default=None, type=float, help='Seconds the whole run may take. At the deadline, unfinished reviews are cancelled and the results of the files that finished are reported. Ctrl-C does the same.')
+@click.option('--ci', is_flag=True, default=False, help='Non-interactive mode for CI: never prompt (size and cost limits come from CI_* in config.yaml), don\'t open the browser, and exit non-zero on findings at or above --fail-on. Writes JSON Lines to stdout unless --jsonl or --sarif is given.')
+@click.option('--fail-on', default=config['CI_FAIL_ON'], type=click.Choice(['High', 'Medium', 'Low', 'never']), help='With --ci, exit with code 1 if any finding has this priority or higher. Defaults to {0}.'.format(config['CI_FAIL_ON']))
+@click.option('--sarif', default=None, help='Write the findings as a SARIF 2.1.0 log to this file, or "-" for stdout, when the run ends.')
+@click.option('--jsonl', default=None, help='Write one JSON line per finding to this file, or "-" for stdout, as each file finishes.')
+@click.option('--report', default=config['RUN_REPORT_PATH'], help='Write a JSON run report (per-stage timings, queue/rate-limit waits, LLM latency histograms, retries, token usage) to this file. Defaults to {0}.'.format(config['RUN_REPORT_PATH']))
+@click.option('--metrics', default=None, help='Also write the run telemetry in OpenMetrics text format to this file, e.g. for a Prometheus textfile collector.')
+def run(scope, file, model, concurrency, base_url, no_cache, incremental, plan_only, batch, batch_backend, feedback_format, route, no_pack, no_triage, request_timeout, deadline, ci, fail_on, sarif, jsonl, report, metrics):
+    if sarif == "-" and jsonl == "-":
+        exit_early("👨🏻‍💻 Only one of --sarif and --jsonl can write to stdout.", ci)
         return
+    if ci and not sarif and not jsonl:
+        jsonl = "-"
 
-    # check if OPENAI_API_KEY is not set, if so, exit
-    if os.environ.get('OPENAI_API_KEY') == None:
-        print ("👨🏻‍💻 An OPENAI_API_KEY was not found. Please set it in your .bashrc or in this terminal session via \'export OPENAI_API_KEY=*****\' and try scanline again.")
+    # not the branch name: CI systems usually check out a detached HEAD
+    if not get_git_root():
+        exit_early("👨🏻‍💻 You are not in a git repo. Please run this command in a git repo.", ci)
         return
 
+    # check if the API key of the model's provider (OPENAI_API_KEY for OpenAI models) is not set, if so, exit
+    load_environment()
+    missing_api_key_message = get_missing_api_key_message(model)
+    if missing_api_key_message:
+        exit_early(missing_api_key_message, ci)
+        return
+
+    branch = get_current_branch()
     if scope == "branch" and (branch == "main" or branch == "master"):
-        print ("👨🏻‍💻 You are on the {0} branch already. Please checkout a different branch to see a review on the branch differences. Or, if you want to compare local changes on your main branch to itself then run \"scanline --scope commit\".".format(branch))
+        exit_early("👨🏻‍💻 You are on the {0} branch already. Please checkout a different branch to see a review on the branch differences. Or, if you want to compare local changes on your main branch to itself then run \"scanline --scope commit\".".format(branch), ci)
         return
 
-    if file != "":
-        print ("👨🏻‍💻 Starting AI code review on {0}, in {1}".format(scope, file))
-    else:
-        print ("👨🏻‍💻 Starting AI code review on {0} ".format(scope, file))
+    if incremental and scope != "repo":
+        exit_early("👨🏻‍💻 --incremental only applies to --scope repo.", ci)
+        return
+
+    from reviewme.ailinter import ailinter
+    from reviewme.ailinter.ci import open_result_writers
+    from reviewme.ailinter.telemetry import write_run_report
+    result_writers = open_result_writers(sarif, jsonl, get_git_root() or ".")
+    # when results go to stdout, everything else goes to stderr
+    try:
+        with redirect_stdout(sys.stderr) if "-" in (sarif, jsonl) else nullcontext():
+            if file != "":
+                print ("👨🏻‍💻 Starting AI code review on {0}, in {1}".format(scope, file))
+            else:
+                print ("👨🏻‍💻 Starting AI code review on {0} ".format(scope, file))
+            exit_code = ailinter.run(scope, file, model, concurrency=concurrency, base_url=base_url, use_cache=not no_cache, incremental=incremental, plan_only=plan_only, batch=batch, batch_backend=batch_backend, feedback_format=feedback_format, route=route, pack=config['PACK_SMALL_DIFFS'] and not no_pack, triage=config['TRIAGE_DIFFS'] and not no_triage, request_timeout=request_timeout, deadline=deadline, ci=ci, fail_on=fail_on, result_writers=result_writers)
+    finally:
+        for result_writer in result_writers:
+            result_writer.close()
+        write_run_report(report, metrics)
+    if ci:
+        sys.exit(exit_code)
+
+@cli.command(name='resume-batch')
+@click.option('--run-dir', default=None, help='Batch run directory to resume. Defaults to the most recent batch run.')
+def resume_batch(run_dir):
+    load_environment()
+    from reviewme.ailinter import ailinter
+    ailinter.resume_batch_review(run_dir)
+
+@cli.command()
+@click.option('--open', 'open_issues', is_flag=True, default=False, help='List the open issues of this repo: findings of the latest review of each file, deduplicated across runs.')
+@click.option('--diff', nargs=2, type=int, default=None, metavar='OLD_RUN NEW_RUN', help='List the findings new in NEW_RUN and the ones it fixed since OLD_RUN.')
+@click.option('--diff-latest', is_flag=True, default=False, help='Like --diff, for the two latest runs of this repo.')
+@click.option('--file', default=None, help='With --open, only files under this repo-relative path.')
+@click.option('--category', default=None, help='With --open, only this category, e.g. "Security" or "Logic".')
+@click.option('--priority', default=None, type=click.Choice(['High', 'Medium', 'Low']), help='With --open, only this priority.')
+@click.option('--limit', default=20, type=int, help='Number of runs to list. Defaults to 20.')
+@click.option('--json', 'as_json', is_flag=True, default=False, help='Print JSON instead of a table.')
+def history(open_issues, diff, diff_latest, file, category, priority, limit, as_json):
+    import json
+    from reviewme.ailinter.history import ReviewHistory, format_history_diff, format_history_runs, format_open_issues, get_repo_id
+
+    git_root = get_git_root()
+    if not git_root:
+        click.echo("👨🏻‍💻 You are not in a git repo. Please run this command in a git repo.")
+        return
+    repo = get_repo_id(git_root)
+    review_history = ReviewHistory()
+    try:
+        if diff_latest:
+            diff = review_history.get_latest_run_ids(repo, 2)
+            if len(diff) < 2:
+                click.echo("👨🏻‍💻 This repo needs at least two finished runs in the history to diff.")
+                return
+        if diff:
+            result = review_history.diff_runs(*diff)
+            click.echo(json.dumps(result, indent=2) if as_json else format_history_diff(result))
+        elif open_issues:
+            result = review_history.get_open_issues(repo, file, category, priority)
+            click.echo(json.dumps(result, indent=2) if as_json else format_open_issues(result))
+        else:
+            result = review_history.get_runs(repo, limit)
+            click.echo(json.dumps(result, indent=2) if as_json else format_history_runs(result))
+    finally:
+        review_history.close()
+
+@cli.command()
+@click.option('--port', default=config['REVIEW_SERVER_PORT'], type=int, help='Port to serve the report on, on localhost. Defaults to {0}.'.format(config['REVIEW_SERVER_PORT']))
+@click.option('--no-browser', is_flag=True, default=False, help='Don\'t open the report in the browser.')
+def serve(port, no_browser):
+    from reviewme.ailinter.server import serve_reviews
+    serve_reviews(port=port, open_browser=not no_browser)
+
+@cli.command()
+@click.option('--model', default="gpt-4", help='Model to review with, as for "scanline run". Use the same options as your "scanline --scope commit" runs so they find the daemon\'s reviews in the cache. Defaults to gpt-4.')
+@click.option('--concurrency', default=config['DEFAULT_CONCURRENCY'], type=int, help='Number of requests in flight at the same time. Defaults to {0}.'.format(config['DEFAULT_CONCURRENCY']))
+@click.option('--base-url', default=None, help='Base URL of an OpenAI-compatible API to send reviews to. Defaults to $OPENAI_API_BASE or the OpenAI API.')
+@click.option('--feedback-format', default=config['FEEDBACK_FORMAT'], type=click.Choice(['json', 'text']), help='As for "scanline run". Defaults to {0}.'.format(config['FEEDBACK_FORMAT']))
+@click.option('--route', is_flag=True, default=False, help='As for "scanline run": pick the model for each request with MODEL_ROUTES in config.yaml.')
+@click.option('--no-pack', is_flag=True, default=False, help='As for "scanline run": send every small diff in its own request.')
+@click.option('--no-triage', is_flag=True, default=False, help='As for "scanline run": review every changed file, including trivial changes.')
+@click.option('--install-hook', is_flag=True, default=False, help='Install a post-commit hook that shows the review of each commit ("scanline post-commit"), then exit.')
+@click.option('--status', is_flag=True, default=False, help='Show what the running daemon of this repo has reviewed, then exit.')
+@click.option('--stop', is_flag=True, default=False, help='Stop the running daemon of this repo.')
+def daemon(model, concurrency, base_url, feedback_format, route, no_pack, no_triage, install_hook, status, stop):
+    import json
+    git_root = get_git_root()
+    if not git_root:
+        click.echo("👨🏻‍💻 You are not in a git repo. Please run this command in a git repo.")
+        return
 
-    ailinter.run(scope, file, model)
+    from reviewme.ailinter.daemon import DaemonNotRunning, install_post_commit_hook, request_daemon
+    if install_hook:
+        hook_path = install_post_commit_hook(git_root)
+        if hook_path is None:
+            click.echo("👨🏻‍💻 This repo already has a post-commit hook. Add \"scanline post-commit || true\" to it to see the review of each commit.")
+        else:
+            click.echo(f"👨🏻‍💻 Installed {hook_path}. Start the daemon with \"scanline daemon\" to have commits reviewed ahead of time.")
+        return
+    if status or stop:
+        try:
+            response = request_daemon(git_root, {"command": "stop" if stop else "status"}, timeout=10)
+        except DaemonNotRunning:
+            click.echo("👨🏻‍💻 No scanline daemon is running for this repo.")
+            return
+        click.echo("👨🏻‍💻 Stopping the scanline daemon." if stop else json.dumps(response, indent=2))
+        return
+
+    load_environment()
+    missing_api_key_message = get_missing_api_key_message(model)
+    if missing_api_key_message:
+        click.echo(missing_api_key_message)
+        return
+    from reviewme.ailinter.daemon import ReviewDaemon
+    review_daemon = ReviewDaemon(git_root, model, concurrency, base_url, feedback_format, route, pack=config['PACK_SMALL_DIFFS'] and not no_pack, triage=config['TRIAGE_DIFFS'] and not no_triage)
+    if not review_daemon.run():
+        click.echo("👨🏻‍💻 A scanline daemon is already running for this repo. See \"scanline daemon --status\".")
+
+@cli.command(name='post-commit')
+@click.option('--commit', default="HEAD", help='Commit to show the review of. Defaults to HEAD.')
+def post_commit(commit):
+    from reviewme.ailinter.daemon import DaemonNotRunning, request_daemon
+    git_root = get_git_root()
+    if not git_root:
+        return
+    try:
+        response = request_daemon(git_root, {"command": "review", "commit": commit})
+    except DaemonNotRunning:
+        click.echo("👨🏻‍💻 scanline: no daemon is running for this repo, so this commit wasn't reviewed. Start one with \"scanline daemon\".")
+        return
+    except (OSError, ValueError) as e:
+        click.echo(f"👨🏻‍💻 scanline: no review of this commit from the daemon ({e}).")
+        return
+    if not response.get("ok"):
+        click.echo(f"👨🏻‍💻 scanline: the daemon couldn't review this commit: {response.get('error')}")
+        return
+
+    from reviewme.ailinter.dedup import DEDUP_FINDINGS, cluster_feedback_items
+    from reviewme.ailinter.format_results import format_feedback_for_print
+    feedback_items = response["feedback_items"]
+    click.echo(f"\n=== 🔍 scanline: review of {commit}: {response['files']} files, {response['requests']} requests ({response['cache_hits']} from the cache) in {response['seconds']:.1f}s ===")
+    if response["failed_files"]:
+        click.echo(f"Not reviewed: {', '.join(response['failed_files'])}")
+    if feedback_items:
+        click.echo(format_feedback_for_print(cluster_feedback_items(feedback_items) if DEDUP_FINDINGS else feedback_items))
+    else:
+        click.echo("💚 No issues found.")
 
 if __name__ == '__main__':
     cli()
\ No newline at end of file
@@ -9,8 +9,8 @@ a = Analysis(
     binaries=[],
     datas=[('reviewme/ailinter/config.yaml', 'reviewme/ailinter'),
        ('reviewme/ailinter/rule_templates/human_guide_1.md', 'reviewme/ailinter/rule_templates'),
-       ('reviewme/ailinter/webapp-test', 'webapp-test'),
-       ('reviewme/ailinter/', 'ailinter-all')],
+       ('reviewme/ailinter/tokenizers/cl100k_base.tiktoken', 'reviewme/ailinter/tokenizers'),
+       ('reviewme/ailinter/webapp-test', 'webapp-test')],
     hiddenimports=[],
     hookspath=[],
     hooksconfig={},
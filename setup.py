@@ -7,7 +7,9 @@ long_description = (this_directory / "README.md").read_text()
 
 setup(
     name='scanline',
-    packages=['reviewme'],
+    packages=['reviewme', 'reviewme.ailinter'],
+    # the cl100k_base vocabulary, so token counts and plans are exact without network access
+    package_data={'reviewme.ailinter': ['tokenizers/*.tiktoken']},
     py_modules=["cli"],
     version='0.0.1',
     license='Apache License 2.0',
@@ -21,6 +23,8 @@ setup(
     setup_requires=['wheel'],
     install_requires=[
         "openai==0.27.2",
+        "aiohttp==3.8.6",
+        "tiktoken==0.5.1",
         "python-dotenv==1.0.0",
         "PyYAML==6.0.1",
     ],